@@ -0,0 +1,115 @@
+"""
+GadgetDeck with its full-screen UI and on-screen keyboard. See headless.py for running without Qt.
+"""
+import os
+import sys
+import threading
+import traceback
+import concurrent.futures
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QApplication
+
+try:
+    import joystick_ui
+    import emulator
+    import gadget_client
+    import startup
+except ImportError:
+    sys.path.append(os.path.dirname(__file__))
+    import joystick_ui
+    import emulator
+    import gadget_client
+    import startup
+
+
+class JoystickEmulator(emulator.JoystickEmulator):
+    """
+    The emulator, shown in a full-screen JoystickUI with an on-screen keyboard.
+    It is created and started on the startup thread, so the input loop does not wait for Qt; attach() connects it to
+    the window on the Qt thread once both exist.
+    """
+    window = None
+
+    def attach(self, window: joystick_ui.JoystickUI):
+        self.window = window
+        self.window.keypress.connect(self.key_press)
+        self.window.keyrelease.connect(self.key_release)
+        self.keystate_callback = self.window.onscreen_keystate_set
+        self.window.set_publisher(self.publisher)
+        self.window.set_stats_provider(self.stats)
+
+
+class Startup(QObject):
+    """
+    Set up the gadget and Steam Input in the background, at the same time, and start the emulator as soon as both are
+    done. Meanwhile the Qt thread shows the window, and attaches the emulator to it once the emulator is running.
+    """
+    ready = pyqtSignal(object)
+
+    def __init__(self, args, startup_timer: startup.StartupTimer):
+        QObject.__init__(self)
+        self.args = args
+        self.startup_timer = startup_timer
+        self.window = None
+        self.joystick_emulator = None
+        self.ready.connect(self.attach_emulator)
+
+    def start(self):
+        threading.Thread(target=self.initialize, name='startup', daemon=True).start()
+        self.window = joystick_ui.JoystickUI()
+        self.window.show()
+        self.startup_timer.mark('window shown')
+        self.window.set_status('Starting...')
+        # Build the on-screen keyboard once the window is on screen
+        QTimer.singleShot(0, self.build_keyboard)
+
+    def build_keyboard(self):
+        self.window.build_keyboard()
+        self.startup_timer.mark('keyboard built')
+
+    def initialize(self):
+        try:
+            with concurrent.futures.ThreadPoolExecutor(2) as executor:
+                # All HID functions are set up at once, so the host only enumerates the gadget once
+                gadget = executor.submit(self.timed, 'gadget ready', gadget_client.ensure_gadget)
+                steam_input = executor.submit(self.timed, 'steam input ready', emulator.init_steam_input)
+                gadget.result()
+                devices = emulator.find_devices()
+                descriptors = emulator.find_descriptors()
+                steam_input = steam_input.result()
+            args = self.args
+            joystick_emulator = JoystickEmulator(steam_input, devices, args.rate, args.spin, args.keepalive, args.latency,
+                                                 args.stats_socket, args.record, descriptors=descriptors,
+                                                 macro_file=args.macros, profile_file=args.profiles, profile=args.profile)
+            joystick_emulator.start()
+            self.startup_timer.mark('emulator running')
+            self.ready.emit(joystick_emulator)
+        except Exception as e:
+            self.ready.emit(e)
+
+    def timed(self, name, function):
+        result = function()
+        self.startup_timer.mark(name)
+        return result
+
+    def attach_emulator(self, result):
+        if isinstance(result, Exception):
+            # Keep the window open to show the error, an exception in a slot would abort the application
+            traceback.print_exception(type(result), result, result.__traceback__)
+            self.window.set_status(f'Startup failed: {result}')
+            return
+        self.joystick_emulator = result
+        self.joystick_emulator.attach(self.window)
+        self.window.set_status('')
+        self.startup_timer.mark('window attached')
+        if self.args.startup_timing:
+            self.startup_timer.report()
+
+
+def main(args, startup_timer: startup.StartupTimer):
+    startup_timer.mark('imports')
+    app = QApplication([])
+    gadget_deck = Startup(args, startup_timer)
+    gadget_deck.start()
+    app.exec()
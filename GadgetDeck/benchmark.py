@@ -0,0 +1,232 @@
+"""
+Benchmarks of the GadgetDeck input path. These run without a Steam Deck, Steam or Qt.
+
+    python GadgetDeck/benchmark.py sample     # Per-frame cost of reading the controller state
+    python GadgetDeck/benchmark.py loop       # The emulator loop against simulated input and fake hidg devices
+    python GadgetDeck/benchmark.py keys       # On-screen keyboard key handling
+"""
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+
+try:
+    import controller_state
+    import simulation
+except ImportError:
+    sys.path.append(os.path.dirname(__file__))
+    import controller_state
+    import simulation
+
+
+class StaticInput:
+    """
+    Steam Input stand-in that returns the same action data objects every call.
+    Real Steamworks calls return a fresh ctypes struct per call, that cost is the same for every sample path and is
+    excluded here on purpose.
+    """
+
+    def __init__(self):
+        self.analog = SimpleNamespace(x=0.25, y=-0.5, eMode=0, bActive=True)
+        self.digital = SimpleNamespace(bState=True, bActive=True)
+
+    def GetAnalogActionHandle(self, name):
+        return controller_state.ANALOG_ACTIONS.index(name) + 1
+
+    def GetDigitalActionHandle(self, name):
+        actions = controller_state.DIGITAL_ACTIONS + controller_state.DIGITAL_MOUSE_ACTIONS
+        return actions.index(name) + 1
+
+    def GetAnalogActionData(self, controller, handle):
+        return self.analog
+
+    def GetDigitalActionData(self, controller, handle):
+        return self.digital
+
+
+def _handles(steam_input):
+    analog = {name: steam_input.GetAnalogActionHandle(name) for name in controller_state.ANALOG_ACTIONS}
+    digital = {name: steam_input.GetDigitalActionHandle(name)
+               for name in controller_state.DIGITAL_ACTIONS + controller_state.DIGITAL_MOUSE_ACTIONS}
+    return analog, digital
+
+
+def dict_sample_path(steam_input):
+    """The per-frame dict building that steam_worker used before ControllerState"""
+    analog_actions, digital_actions = _handles(steam_input)
+
+    def frame():
+        analog_data = {action: steam_input.GetAnalogActionData(0, handle) for action, handle in analog_actions.items()}
+        digital_data = {action: steam_input.GetDigitalActionData(0, handle).bState for action, handle in digital_actions.items()}
+        data = {'analog_data': analog_data, 'digital_action': digital_data}
+        buttons = [digital_data[btn] for btn in controller_state.DIGITAL_ACTIONS]
+        return data, buttons
+    return frame
+
+
+def state_sample_path(steam_input):
+    analog_actions, digital_actions = _handles(steam_input)
+    state = controller_state.ControllerState(analog_actions.values(), digital_actions.values())
+
+    def frame():
+        state.read(steam_input, 0)
+        return state.digital & controller_state.BUTTON_MASK
+    return frame
+
+
+def measure(frame, frames):
+    """Return (seconds per frame, peak transient bytes per frame, blocks retained per frame)"""
+    for _ in range(100):
+        frame()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(frames):
+            frame()
+        elapsed = (time.perf_counter() - start) / frames
+
+        tracemalloc.start()
+        peak = 0
+        for _ in range(100):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            frame()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+        tracemalloc.stop()
+
+        blocks = sys.getallocatedblocks()
+        for _ in range(frames):
+            frame()
+        retained = (sys.getallocatedblocks() - blocks) / frames
+    finally:
+        gc.enable()
+    return elapsed, peak, retained
+
+
+def sample_benchmark(args):
+    steam_input = StaticInput()
+    print(f'{"sample path":<12} {"time/frame":>12} {"peak alloc/frame":>18} {"retained blocks/frame":>22}')
+    for name, path in (('dict', dict_sample_path), ('state', state_sample_path)):
+        elapsed, peak, retained = measure(path(steam_input), args.frames)
+        print(f'{name:<12} {elapsed * 1e6:>10.2f}us {peak:>16d} B {retained:>22.3f}')
+
+
+def _emulator(steam_input, sink, **kwargs):
+    import emulator
+    joystick_emulator = emulator.JoystickEmulator(steam_input, sink.devices, rate=None, **kwargs)
+    joystick_emulator.writer.start()
+    joystick_emulator.compile_profiles()
+    return joystick_emulator
+
+
+def _drain(joystick_emulator, timeout=5.0):
+    """Wait until the writer thread wrote everything that was queued"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not any(channel.queue for channel in joystick_emulator.writer.channels):
+            break
+        time.sleep(0.001)
+
+
+def loop_benchmark(args):
+    names = [f'joystick{i}' for i in range(args.controllers)] + ['mouse', 'keyboard']
+    with simulation.FakeHIDSink(names, fifo=args.fifo) as sink:
+        record = os.path.join(sink.directory, 'recording') if args.record else None
+        joystick_emulator = _emulator(simulation.SimulatedInput(args.controllers), sink, measure_latency=args.latency, record=record,
+                                      macro_file=args.macros, profile_file=args.profiles)
+        joystick_emulator.run(100)
+        _drain(joystick_emulator)
+        written_before = sum(sink.bytes_written().values())
+
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        thread_start = time.thread_time()
+        joystick_emulator.run(args.frames)
+        elapsed = time.perf_counter() - start
+        thread_cpu = time.thread_time() - thread_start
+        _drain(joystick_emulator)
+        cpu = time.process_time() - cpu_start
+        if args.fifo:
+            time.sleep(0.05)
+        written = sum(sink.bytes_written().values()) - written_before
+
+        tracemalloc.start()
+        peak = 0
+        for _ in range(200):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            joystick_emulator.run(1)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+        tracemalloc.stop()
+        stats = joystick_emulator.stats()
+        joystick_emulator.stop()
+
+    results = {'frames': args.frames,
+               'controllers': args.controllers,
+               'frames_per_second': args.frames / elapsed,
+               'loop_cpu_per_frame_us': thread_cpu / args.frames * 1e6,
+               'process_cpu_per_frame_us': cpu / args.frames * 1e6,
+               'peak_alloc_per_frame_bytes': peak,
+               'report_bytes_written': written,
+               'report_bytes_per_frame': written / args.frames,
+               'stats': stats}
+    _print_results(results, args)
+
+
+def keys_benchmark(args):
+    import keyboard_layout
+    keys = list(keyboard_layout.load().keys)
+    with simulation.FakeHIDSink(['keyboard']) as sink:
+        joystick_emulator = _emulator(simulation.SimulatedInput(0), sink)
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        for i in range(args.frames):
+            key = keys[i % len(keys)]
+            joystick_emulator.key_press(key)
+            joystick_emulator.key_release(key)
+        elapsed = time.perf_counter() - start
+        cpu = time.thread_time() - cpu_start
+        _drain(joystick_emulator)
+        written = sink.bytes_written()['keyboard']
+        stats = joystick_emulator.writer.to_dict()['keyboard']
+        joystick_emulator.stop()
+    _print_results({'keystrokes': args.frames,
+                    'keystrokes_per_second': args.frames / elapsed,
+                    'cpu_per_keystroke_us': cpu / args.frames * 1e6,
+                    'report_bytes_written': written,
+                    'reports_dropped': stats['dropped']}, args)
+
+
+def _print_results(results, args):
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for key, value in results.items():
+        if isinstance(value, float):
+            value = f'{value:.2f}'
+        elif isinstance(value, dict):
+            value = json.dumps(value)
+        print(f'{key:<28} {value}')
+
+
+def main():
+    parser = argparse.ArgumentParser('GadgetDeck benchmark')
+    parser.add_argument('benchmark', nargs='?', choices=('sample', 'loop', 'keys'), default='sample')
+    parser.add_argument('--frames', type=int, default=100000)
+    parser.add_argument('--controllers', type=int, default=1, help='Number of simulated controllers (loop)')
+    parser.add_argument('--fifo', action='store_true', help='Write to named pipes instead of files (loop)')
+    parser.add_argument('--latency', action='store_true', help='Also measure latency while benchmarking (loop)')
+    parser.add_argument('--record', action='store_true', help='Also record the controller state while benchmarking (loop)')
+    parser.add_argument('--macros', help='Also run the macros of this file while benchmarking (loop)')
+    parser.add_argument('--profiles', help='Also apply the first response curve profile of this file (loop)')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+    {'sample': sample_benchmark, 'loop': loop_benchmark, 'keys': keys_benchmark}[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import threading
+from array import array
+
+ANALOG_ACTIONS = ('JoyLeft', 'JoyRight', 'TrigLeft', 'TrigRight', 'Mouse', 'Scroll')
+DIGITAL_ACTIONS = ('A', 'B', 'X', 'Y', 'UP', 'DOWN', 'LEFT', 'RIGHT', 'BumpLeft', 'BumpRight', 'Menu', 'Start', 'JoyPressLeft', 'JoyPressRight',
+                   'BackLeftTop', 'BackLeftBottom', 'BackRightTop', 'BackRightBottom')
+DIGITAL_MOUSE_ACTIONS = ('MouseClickLeft', 'MouseClickRight')
+
+# Offsets of the x value of every analog action in ControllerState.analog, the y value follows at offset+1
+JOY_LEFT, JOY_RIGHT, TRIG_LEFT, TRIG_RIGHT, MOUSE, SCROLL = (2 * ANALOG_ACTIONS.index(action) for action in ANALOG_ACTIONS)
+# Bits in ControllerState.digital. Joystick buttons occupy the low bits, in the order of DIGITAL_ACTIONS
+BUTTON_MASK = (1 << len(DIGITAL_ACTIONS)) - 1
+MOUSE_CLICK_LEFT, MOUSE_CLICK_RIGHT = (len(DIGITAL_ACTIONS) + i for i in range(len(DIGITAL_MOUSE_ACTIONS)))
+
+
+class ControllerState:
+    """
+    Preallocated state of one controller, updated in place every frame.
+
+    Analog actions are stored as interleaved x,y floats in `analog`, digital actions as a bitmask in `digital`.
+    The action handles are resolved once, so reading a frame is a walk over two tuples without any name lookups.
+    """
+    __slots__ = ('analog', 'digital', 'analog_handles', 'digital_handles', '_digital_bits')
+
+    def __init__(self, analog_handles=(), digital_handles=()):
+        self.analog_handles = tuple(analog_handles)
+        self.digital_handles = tuple(digital_handles)
+        self._digital_bits = tuple((handle, 1 << i) for i, handle in enumerate(self.digital_handles))
+        self.analog = array('f', bytes(4 * 2 * max(len(self.analog_handles), len(ANALOG_ACTIONS))))
+        self.digital = 0
+
+    def read(self, steam_input, controller):
+        """Read all actions of a controller. Steam Input RunFrame() must have been called for this frame."""
+        get_analog = steam_input.GetAnalogActionData
+        get_digital = steam_input.GetDigitalActionData
+        analog = self.analog
+        i = 0
+        for handle in self.analog_handles:
+            data = get_analog(controller, handle)
+            analog[i] = data.x
+            analog[i + 1] = data.y
+            i += 2
+        digital = 0
+        for handle, bit in self._digital_bits:
+            if get_digital(controller, handle).bState:
+                digital |= bit
+        self.digital = digital
+
+    def is_pressed(self, bit: int) -> bool:
+        return bool(self.digital >> bit & 1)
+
+    def copy_from(self, other: 'ControllerState'):
+        self.analog[:] = other.analog
+        self.digital = other.digital
+
+    def reset(self):
+        for i in range(len(self.analog)):
+            self.analog[i] = 0.0
+        self.digital = 0
+
+    def __repr__(self):
+        axes = ' '.join(f'{name}=({self.analog[2*i]:.2f} {self.analog[2*i+1]:.2f})' for i, name in enumerate(ANALOG_ACTIONS))
+        return f'<{self.__class__.__qualname__} {axes} digital={self.digital:#x}>'
+
+
+class StatePublisher:
+    """
+    Hand the latest controller state from the input thread to a slower consumer, like the UI.
+
+    publish() only copies the state under a lock, it never queues or waits for the consumer. A consumer polls at its
+    own rate, and all states published in between are coalesced into the latest one.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = ControllerState()
+        self.controllers = ()
+        self.version = 0
+
+    def publish(self, state: ControllerState):
+        with self.lock:
+            self.state.copy_from(state)
+            self.version += 1
+
+    def publish_controllers(self, controllers):
+        with self.lock:
+            self.controllers = tuple(controllers)
+            self.version += 1
+
+    def read(self, target: ControllerState, version: int = -1) -> int:
+        """Copy the latest state into target if it was published after `version`. Return the current version."""
+        with self.lock:
+            if self.version != version:
+                target.copy_from(self.state)
+            return self.version
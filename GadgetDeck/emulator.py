@@ -0,0 +1,593 @@
+import os
+import re
+import sys
+import stat
+import time
+import threading
+import functools
+from typing import Callable, Optional
+
+try:
+    import scheduler
+    import hid_output
+    import controller_state
+    import latency
+    import recording
+    import hid_layout
+    import gadget_status
+    import keyboard_layout
+    import macros
+    import response_curve
+except ImportError:
+    sys.path.append(os.path.dirname(__file__))
+    import scheduler
+    import hid_output
+    import controller_state
+    import latency
+    import recording
+    import hid_layout
+    import gadget_status
+    import keyboard_layout
+    import macros
+    import response_curve
+
+
+def find_devices(gadget_name: str = 'gadget-deck') -> dict[str, str]:
+    """Map the HID functions of the gadget ('joystick0', 'mouse', 'keyboard', ...) to their /dev/hidg* device"""
+    devices = {}
+    for entry, function in gadget_status.snapshot(gadget_name)['functions'].items():
+        if function['type'] == 'hid' and function['device'] is not None:
+            name = entry[len('hid.'):]
+            print(f'Gadget {name} found')
+            devices[name] = function['device']['path']
+    return devices
+
+
+def find_descriptors(gadget_name: str = 'gadget-deck') -> dict[str, bytes]:
+    """Read the report descriptor of every HID function of the gadget, as configured by gadget-deck-manager"""
+    functions = os.path.join(gadget_status.CONFIGFS, gadget_name, 'functions')
+    descriptors = {}
+    for entry in sorted(os.listdir(functions)):
+        if entry.startswith('hid.'):
+            with open(os.path.join(functions, entry, 'report_desc'), 'rb') as f:
+                descriptors[entry[len('hid.'):]] = f.read()
+    return descriptors
+
+
+def load_layout(name: str, descriptors: Optional[dict[str, bytes]] = None) -> hid_layout.ReportLayout:
+    """Layout of a HID function: its live descriptor if known, otherwise the descriptor file it is created from"""
+    if descriptors and name in descriptors:
+        return hid_layout.load(descriptors[name])
+    if name == 'composite':
+        return hid_layout.load(hid_layout.composite_descriptor())
+    return hid_layout.load(re.sub(r'\d+$', '', name))
+
+
+def keyboard_state(layout: hid_layout.ReportLayout, report_id: Optional[int] = None) -> keyboard_layout.KeyboardState:
+    """
+    Keyboard state for the report of a keyboard function: with N-key rollover if its descriptor has a key bitmap
+    after the boot report (keyboard_nkro.txt), otherwise the 6 key boot report.
+    """
+    for field in layout.input_fields(report_id):
+        if (field.usage_page == hid_layout.USAGE_PAGE_KEYBOARD and field.variable and field.size == 1 and field.count > 8
+                and field.usage(0) == 0 and field.offset % 8 == 0 and field.offset >= 64):
+            return keyboard_layout.KeyboardState(report_size=(layout.report_bits[(hid_layout.INPUT, report_id)] + 7) // 8,
+                                                 bitmap_offset=field.offset // 8, bitmap_usages=field.count,
+                                                 report_id=report_id)
+    return keyboard_layout.KeyboardState(report_id=report_id)
+
+
+def composite_parts(devices: dict[str, str], descriptors: Optional[dict[str, bytes]] = None) -> dict[str, int]:
+    """
+    The report ID of every part (joystick, mouse, keyboard) of a composite HID function, which carries their reports
+    through one device. Separate functions take precedence: the composite joystick is only used without joystick functions.
+    """
+    if 'composite' not in devices:
+        return {}
+    report_ids = load_layout('composite', descriptors).report_ids
+    separate = set(devices)
+    if any(re.fullmatch(r'joystick\d*', name) for name in devices):
+        separate.add('joystick')
+    return {part: report_id for part, report_id in hid_layout.COMPOSITE_REPORT_IDS.items()
+            if report_id in report_ids and part not in separate}
+
+
+def is_hidg(device: str) -> bool:
+    """Whether a device is a real hidg character device, which receives output reports, and not a stand-in file"""
+    return stat.S_ISCHR(os.stat(device).st_mode)
+
+
+class JoystickReport:
+    """
+    Build the input reports of a joystick function from a ControllerState.
+    Axes are matched to the controller state by their usage, so the report follows the descriptor of the function.
+    With a response curve profile (see response_curve.py), the sticks and triggers are looked up in its tables.
+    """
+    # HID usage: (offset in ControllerState.analog, direction)
+    AXES = {0x30: (controller_state.JOY_LEFT, 1),           # X
+            0x31: (controller_state.JOY_LEFT + 1, -1),      # Y
+            0x33: (controller_state.JOY_RIGHT, 1),          # Rx
+            0x34: (controller_state.JOY_RIGHT + 1, -1),     # Ry
+            0x32: (controller_state.TRIG_LEFT, 1),          # Z
+            0x35: (controller_state.TRIG_RIGHT, 1)}         # Rz
+    STICKS = {'JoyLeft': (0x30, 0x31), 'JoyRight': (0x33, 0x34)}
+    TRIGGERS = {'TrigLeft': 0x32, 'TrigRight': 0x35}
+
+    def __init__(self, layout: hid_layout.ReportLayout, report_id: Optional[int] = None):
+        self.packer = layout.packer(report_id)
+        self.axes = []
+        for page, usage, minimum, maximum, relative in self.packer.axes:
+            offset, direction = self.AXES[usage] if page == hid_layout.USAGE_PAGE_GENERIC_DESKTOP and usage in self.AXES else (None, 0)
+            self.axes.append((offset, direction * maximum, minimum, maximum))
+        self.values = [0] * len(self.axes)
+        self.tables = None
+        self.button_mask = controller_state.BUTTON_MASK & ((1 << self.packer.button_count) - 1)
+        # Byte offset of the left and right motor speed in the output report, if the descriptor has rumble
+        self.rumble_offset = next((field.offset // 8 for field in layout.output_fields(report_id)
+                                   if field.usage_page == hid_layout.USAGE_PAGE_VENDOR and field.size == 8 and field.count == 2), None)
+
+    def build(self, state: controller_state.ControllerState) -> bytes:
+        analog = state.analog
+        tables = self.tables
+        if tables is None:
+            axes = [0 if offset is None else min(max(int(analog[offset] * scale), minimum), maximum)
+                    for offset, scale, minimum, maximum in self.axes]
+            return self.packer.pack(axes, state.digital & self.button_mask)
+        values = self.values
+        sticks, triggers = tables
+        for x, y, offset, steps, size, table_x, table_y in sticks:
+            ix = int(analog[offset] * steps + steps + 0.5)
+            iy = int(analog[offset + 1] * steps + steps + 0.5)
+            i = (0 if ix < 0 else size - 1 if ix >= size else ix) * size + (0 if iy < 0 else size - 1 if iy >= size else iy)
+            values[x] = table_x[i]
+            values[y] = table_y[i]
+        for axis, offset, steps, table in triggers:
+            i = int(analog[offset] * steps + 0.5)
+            values[axis] = table[0 if i < 0 else steps if i > steps else i]
+        return self.packer.pack(values, state.digital & self.button_mask)
+
+    def compile(self, profile: response_curve.Profile) -> tuple:
+        """The lookup tables of a profile for the axes of this report, for set_tables()"""
+        index = {usage: i for i, (page, usage, *_) in enumerate(self.packer.axes) if page == hid_layout.USAGE_PAGE_GENERIC_DESKTOP}
+        sticks = []
+        for action, (x_usage, y_usage) in self.STICKS.items():
+            if x_usage in index and y_usage in index:
+                x, y = index[x_usage], index[y_usage]
+                steps = min(max(self.axes[x][3], self.axes[y][3]), response_curve.STICK_STEPS)
+                table_x, table_y = profile.stick_table(action, steps, self.axes[x][1], self.axes[y][1])
+                sticks.append((x, y, self.axes[x][0], steps, 2 * steps + 1, table_x, table_y))
+        triggers = []
+        for action, usage in self.TRIGGERS.items():
+            if usage in index:
+                axis = index[usage]
+                steps = min(self.axes[axis][3], response_curve.TRIGGER_STEPS)
+                triggers.append((axis, self.axes[axis][0], steps, profile.trigger_table(action, steps, self.axes[axis][3])))
+        return tuple(sticks), tuple(triggers)
+
+    def set_tables(self, tables: Optional[tuple]):
+        """Switch to the tables of another profile, or back to the raw values with None"""
+        self.tables = tables
+
+    def neutral(self) -> bytes:
+        return self.packer.pack([0] * len(self.axes), 0)
+
+    def rumble(self, report: bytes) -> Optional[tuple[int, int]]:
+        """Left and right motor speed (0-255) of an output report"""
+        if self.rumble_offset is None or len(report) < self.rumble_offset + 2:
+            return None
+        return report[self.rumble_offset], report[self.rumble_offset + 1]
+
+
+class MouseReport:
+    """
+    Build the relative input reports of a mouse function from the Mouse and Scroll actions.
+
+    Steam Input reports the trackpad motion in fractional pixels. The fraction that does not fit into a whole report
+    unit, and anything beyond the logical range of an axis, is carried over to the next frame instead of being
+    truncated, so slow motion still moves the pointer and a higher report rate does not lose precision. Reports the
+    host did not read in time are combined by merge() rather than dropped. The axes are 16 bit, see mouse.txt.
+    """
+    # Analog value: (HID usage page, usage, scale). The wheel turns up when scrolling up, which is a negative y.
+    AXES = ((controller_state.MOUSE, hid_layout.USAGE_PAGE_GENERIC_DESKTOP, 0x30, 1.0),              # X
+            (controller_state.MOUSE + 1, hid_layout.USAGE_PAGE_GENERIC_DESKTOP, 0x31, 1.0),          # Y
+            (controller_state.SCROLL + 1, hid_layout.USAGE_PAGE_GENERIC_DESKTOP, 0x38, -1 / 40),     # Wheel
+            (controller_state.SCROLL, hid_layout.USAGE_PAGE_CONSUMER, 0x238, 1 / 40))                # AC Pan
+
+    def __init__(self, layout: hid_layout.ReportLayout, report_id: Optional[int] = None):
+        self.packer = layout.packer(report_id)
+        self.values = [0] * len(self.packer.axes)
+        self.remainder = [0.0] * len(self.packer.axes)
+        self.axes = []
+        for offset, page, usage, scale in self.AXES:
+            try:
+                i = self.packer.axis_index(usage, page)
+            except KeyError:
+                continue
+            self.axes.append((i, offset, scale) + self.packer.axis_range(i))
+
+    def build(self, state: controller_state.ControllerState) -> tuple[bytes, bool]:
+        """The report of a frame, and whether it moves anything"""
+        analog = state.analog
+        values = self.values
+        remainder = self.remainder
+        moved = False
+        for i, offset, scale, minimum, maximum in self.axes:
+            value = remainder[i] + analog[offset] * scale
+            whole = min(max(int(value), minimum), maximum)
+            # Motion beyond the range is carried over for one more report at most, it should not lag behind
+            remainder[i] = min(max(value - whole, minimum), maximum)
+            values[i] = whole
+            moved = moved or whole != 0
+        buttons = state.digital >> controller_state.MOUSE_CLICK_LEFT & 0x3
+        return self.packer.pack(values, buttons), moved
+
+    def merge(self, queued: bytes, report: bytes) -> bytes:
+        """
+        One report with the motion of an unsent report and a newer one, for HIDChannel. Motion beyond the range of an
+        axis goes back to the remainder. The buttons are those of the newer report.
+        """
+        previous, _ = self.packer.unpack(queued)
+        values, buttons = self.packer.unpack(report)
+        for i, offset, scale, minimum, maximum in self.axes:
+            total = previous[i] + values[i]
+            values[i] = min(max(total, minimum), maximum)
+            self.remainder[i] += total - values[i]
+        return self.packer.pack(values, buttons)
+
+    def idle(self) -> bytes:
+        """A report without motion or buttons"""
+        return self.packer.pack([0] * len(self.values), 0)
+
+    def reset(self):
+        for i in range(len(self.remainder)):
+            self.remainder[i] = 0.0
+
+
+def init_steam_input():
+    """Initialize Steamworks and return its Steam Input interface"""
+    from steamworks import STEAMWORKS
+    steam = STEAMWORKS()
+    steam.initialize()
+    steam.Input.Init()
+    return steam.Input
+
+
+class JoystickEmulator:
+    """
+    Forward Steam Input actions to the HID gadgets.
+
+    `steam_input` is the Steam Input interface of Steamworks, or anything that implements the same calls (see
+    simulation.py). `devices` maps HID function names to their device, as returned by find_devices(). The reports are
+    built from the report descriptors in `descriptors` (see find_descriptors()), or the descriptor files by default.
+    A 'composite' function carries the joystick, mouse and keyboard reports through one device, see composite_parts().
+    Nothing in here depends on Qt; a UI reads the controller state from `publisher`, sends on-screen keyboard events
+    to key_press()/key_release(), and receives keyboard LED and modifier state through `keystate_callback`.
+    Digital actions can also type on the keyboard, with the chords and macros of `macro_file` (see macros.py).
+    The sticks and triggers follow the response curves of `profile` in `profile_file` (see response_curve.py).
+    """
+    ACTION_SETS = ('InGameControls',)
+    ANALOG_ACTIONS = controller_state.ANALOG_ACTIONS
+    DIGITAL_ACTIONS = controller_state.DIGITAL_ACTIONS
+    DIGITAL_MOUSE_ACTIONS = controller_state.DIGITAL_MOUSE_ACTIONS
+
+    def __init__(self, steam_input, devices: dict[str, str], rate: Optional[float] = 500, spin=0.0003, keepalive=1.0,
+                 measure_latency=False, stats_socket=None, record=None, descriptors: Optional[dict[str, bytes]] = None,
+                 macro_file: Optional[str] = None, profile_file: Optional[str] = None, profile: Optional[str] = None):
+        self.steam_input = steam_input
+        self.keystate_callback: Optional[Callable] = None
+        self.latency_monitor = latency.LatencyMonitor() if measure_latency else None
+        self.process_usage = latency.ProcessUsage()
+        self.writer = hid_output.HIDWriter(monitor=self.latency_monitor)
+        self.mouse_report = self.keyboard_state = self.macros = None
+        self.js_reports = []
+        self.js_filters = []
+        # Latest rumble output report of every joystick, handed from the writer thread to the input loop
+        self.rumble: dict[int, tuple[int, int]] = {}
+        self.rumble_lock = threading.Lock()
+        # The parts of a composite HID function share its device, their reports are tagged with a report ID
+        self.report_ids = composite_parts(devices, descriptors)
+        layouts = {part: load_layout('composite', descriptors) for part in self.report_ids}
+        devices = {**devices, **{part: devices['composite'] for part in self.report_ids}}
+        # Output reports of all parts arrive on the shared device, see composite_output()
+        composite_output = self.composite_output if self.report_ids and is_hidg(devices['composite']) else None
+        for index, name in enumerate(self.joystick_functions(devices)):
+            js_report = JoystickReport(layouts.get(name) or load_layout(name, descriptors), self.report_ids.get(name))
+            self.js_reports.append(js_report)
+            on_output = None
+            if name in self.report_ids:
+                on_output = composite_output
+            elif js_report.rumble_offset is not None and is_hidg(devices[name]):
+                on_output = functools.partial(self.joystick_output, index)
+            channel = self.writer.add(name, devices[name], on_output=on_output)
+            self.js_filters.append(hid_output.ReportFilter(channel.submit, keepalive))
+        if 'mouse' in devices:
+            self.mouse_report = MouseReport(layouts.get('mouse') or load_layout('mouse', descriptors), self.report_ids.get('mouse'))
+            channel = self.writer.add('mouse', devices['mouse'], depth=2, merge=self.mouse_report.merge,
+                                      on_output=composite_output if 'mouse' in self.report_ids else None)
+            self.mouse_filter = hid_output.ReportFilter(channel.submit, keepalive)
+        if 'keyboard' in devices:
+            self.keyboard_layout = keyboard_layout.load()
+            self.keyboard_state = keyboard_state(layouts.get('keyboard') or load_layout('keyboard', descriptors),
+                                                 self.report_ids.get('keyboard'))
+            # The on-screen keyboard (UI thread) and macros (input thread) share the keyboard state
+            self.keyboard_lock = threading.Lock()
+            # Key presses and releases are events, losing one would lose a keystroke or leave a key stuck
+            if 'keyboard' in self.report_ids:
+                on_output = composite_output
+            else:
+                on_output = self.keyboard_output if is_hidg(devices['keyboard']) else None
+            self.keyboard_channel = self.writer.add('keyboard', devices['keyboard'], depth=None, on_output=on_output)
+            if macro_file is not None:
+                self.macros = macros.load(macro_file, self.keyboard_layout, self.press_keys, self.release_keys,
+                                          self.set_profile)
+                # An action that types keys does not press a joystick button as well
+                if self.macros is not None and self.js_reports:
+                    self.js_reports[0].button_mask &= ~self.macros.mask
+        elif macro_file is not None:
+            print('No keyboard function, macros are disabled')
+
+        self.profiles = response_curve.load(profile_file) if profile_file is not None else {}
+        if profile is not None and profile not in self.profiles:
+            raise ValueError(f'Unknown response curve profile {profile}')
+        self.profile = profile or next(iter(self.profiles), None)
+        self.profile_tables: dict[str, list] = {}
+        self.profile_lock = threading.Lock()
+
+        self.action_set = steam_input.GetActionSetHandle(self.ACTION_SETS[0])
+        self.analog_actions = {name: steam_input.GetAnalogActionHandle(name) for name in self.ANALOG_ACTIONS}
+        self.digital_actions = {name: steam_input.GetDigitalActionHandle(name) for name in self.DIGITAL_ACTIONS}
+        self.digital_actions.update({name: steam_input.GetDigitalActionHandle(name) for name in self.DIGITAL_MOUSE_ACTIONS})
+        # One state per joystick function - the first controller also drives the mouse and the UI
+        self.states = [controller_state.ControllerState(self.analog_actions.values(), self.digital_actions.values())
+                       for _ in range(max(1, len(self.js_reports)))]
+        self.state = self.states[0]
+        self.publisher = controller_state.StatePublisher()
+        self.controllers = ()
+        self.bindings = ()
+
+        # Without a rate, the loop runs as fast as it can (for benchmarks)
+        self.scheduler = scheduler.LoopScheduler(rate, spin) if rate else None
+        self.recorder = recording.Recorder(record, len(self.state.analog)) if record is not None else None
+        self.running = False
+        self.js_thread = None
+        if stats_socket is not None:
+            latency.StatsServer(stats_socket, self.stats).start()
+
+    @staticmethod
+    def joystick_functions(devices) -> list[str]:
+        """Names of the joystick HID functions, ordered by joystick number"""
+        functions = []
+        for name in devices:
+            if match := re.fullmatch(r'joystick(\d*)', name):
+                functions.append((int(match.group(1) or 0), name))
+        return [name for index, name in sorted(functions)]
+
+    def start(self, background=True):
+        """Start the writer and run the input loop, in a background thread, or in this thread until stop() is called"""
+        self.writer.start()
+        if self.profiles and self.js_reports:
+            threading.Thread(target=self.compile_profiles, name='profiles', daemon=True).start()
+        if background:
+            self.js_thread = threading.Thread(target=self.run, daemon=True)
+            self.js_thread.start()
+        else:
+            self.run()
+
+    def stop(self):
+        self.running = False
+        if self.js_thread is not None and self.js_thread is not threading.current_thread():
+            self.js_thread.join()
+        if self.macros is not None:
+            self.macros.cancel()
+        self.release_all()
+        self.writer.stop()
+        if self.writer.is_alive():
+            # Let the writer write the released state before the process exits
+            self.writer.join(1.0)
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def release_all(self):
+        """Queue neutral joysticks, an idle mouse and a released keyboard, so the host does not keep anything held"""
+        for js_report, js_filter in zip(self.js_reports, self.js_filters):
+            js_filter.submit(js_report.neutral())
+        if self.mouse_report is not None:
+            self.mouse_report.reset()
+            self.mouse_filter.submit(self.mouse_report.idle())
+        if self.keyboard_state is not None:
+            with self.keyboard_lock:
+                self.keyboard_state.reset()
+                self.keyboard_channel.submit(self.keyboard_state.report())
+        self.writer.flush()
+
+    def bind_controllers(self, controllers):
+        """Assign connected controllers to joystick functions, in the order Steam Input reports them"""
+        for controller in controllers:
+            if controller not in self.controllers:
+                self.steam_input.ActivateActionSet(controller, self.action_set)
+        if self.mouse_report is not None and tuple(controllers[:1]) != self.controllers[:1]:
+            # The first controller drives the mouse: drop the motion left from the previous one, and release the buttons
+            self.mouse_report.reset()
+            self.mouse_filter.submit(self.mouse_report.idle())
+        self.controllers = tuple(controllers)
+        bindings = []
+        for i, controller in enumerate(self.controllers[:len(self.states)]):
+            if i < len(self.js_reports):
+                bindings.append((controller, self.states[i], self.js_reports[i], self.js_filters[i]))
+            else:
+                bindings.append((controller, self.states[i], None, None))
+        # Joysticks that lost their controller go back to neutral
+        for state in self.states[len(bindings):]:
+            state.reset()
+        for js_report, js_filter in zip(self.js_reports[len(bindings):], self.js_filters[len(bindings):]):
+            js_filter.submit(js_report.neutral())
+        self.writer.flush()
+        self.bindings = tuple(bindings)
+        self.publisher.publish_controllers(self.controllers)
+
+    def run(self, frames: Optional[int] = None):
+        """Run the input loop until stop() is called, or for a number of frames"""
+        steam_input = self.steam_input
+        state = self.state
+        publisher = self.publisher
+        monitor = self.latency_monitor
+        recorder = self.recorder
+        pacer = self.scheduler
+        rescan_interval = int(pacer.rate) if pacer is not None else 1000
+        rescan = 0
+        self.running = True
+        while self.running:
+            if frames is not None:
+                if frames <= 0:
+                    break
+                frames -= 1
+            if pacer is not None:
+                pacer.wait()
+            frame_start = time.monotonic_ns()
+            steam_input.RunFrame()
+            if monitor is not None:
+                stage_start = monitor.stage('run_frame', frame_start)
+            # Look for (dis)connected controllers once per second, or every frame while there are none
+            rescan -= 1
+            if rescan <= 0 or not self.bindings:
+                controllers = steam_input.GetConnectedControllers()
+                if tuple(controllers) != self.controllers:
+                    self.bind_controllers(controllers)
+                rescan = rescan_interval
+            if not self.bindings:
+                continue
+
+            for controller, js_state, js_report, js_filter in self.bindings:
+                js_state.read(steam_input, controller)
+            if self.rumble:
+                self.forward_rumble()
+            if recorder is not None:
+                for index, binding in enumerate(self.bindings):
+                    recorder.write(index, binding[1], frame_start)
+            if monitor is not None:
+                stage_start = monitor.stage('read_actions', stage_start)
+            publisher.publish(state)
+            if self.macros is not None:
+                self.macros.update(state.digital, frame_start)
+
+            for controller, js_state, js_report, js_filter in self.bindings:
+                if js_report is not None:
+                    js_filter.submit(js_report.build(js_state), stamp=frame_start)
+            if self.mouse_report is not None:
+                self.write_mouse(state, frame_start)
+            if monitor is not None:
+                monitor.stage('build_reports', stage_start)
+            self.writer.flush()
+
+    def write_mouse(self, state: controller_state.ControllerState, stamp: int = 0):
+        report, moved = self.mouse_report.build(state)
+        # Mouse movement is relative, so repeating a report that moves the cursor is not redundant
+        self.mouse_filter.submit(report, force=moved, stamp=stamp)
+
+    def stats(self) -> dict:
+        """Statistics of the input loop and the HID output, see also latency.StatsServer"""
+        filters = {f'joystick{i}': js_filter.to_dict() for i, js_filter in enumerate(self.js_filters)}
+        if self.mouse_report is not None:
+            filters['mouse'] = self.mouse_filter.to_dict()
+        return {'macros': self.macros.to_dict() if self.macros is not None else None,
+                'profile': self.profile,
+                'loop': self.scheduler.stats.to_dict() if self.scheduler is not None else None,
+                'filters': filters,
+                'writer': self.writer.to_dict(),
+                'latency': self.latency_monitor.to_dict() if self.latency_monitor is not None else None,
+                'process': self.process_usage.to_dict()}
+
+    def compile_profiles(self):
+        """Compile the tables of every profile in advance, the selected profile first, so switching never waits"""
+        for name in sorted(self.profiles, key=lambda name: name != self.profile):
+            tables = [js_report.compile(self.profiles[name]) for js_report in self.js_reports]
+            with self.profile_lock:
+                self.profile_tables[name] = tables
+                if name == self.profile:
+                    self._apply_profile(name)
+
+    def set_profile(self, name: str):
+        """Switch the response curves of all joysticks. A profile that is still being compiled applies once it's ready."""
+        if name not in self.profiles:
+            print(f'Unknown response curve profile {name}')
+            return
+        with self.profile_lock:
+            self.profile = name
+            if name in self.profile_tables:
+                self._apply_profile(name)
+
+    def _apply_profile(self, name: str):
+        for js_report, tables in zip(self.js_reports, self.profile_tables[name]):
+            js_report.set_tables(tables)
+
+    def set_keystate(self, **states):
+        if self.keystate_callback is not None:
+            self.keystate_callback(**states)
+
+    def keyboard_output(self, report: bytes):
+        """LED output report of the keyboard, called from the writer thread"""
+        leds = report[0] if report else 0
+        self.set_keystate(**{name: bool(leds >> i & 1) for i, name in enumerate(('numlock', 'capslock', 'scrolllock'))})
+
+    def composite_output(self, report: bytes):
+        """Output report of a composite function, called from the writer thread: passed on by its report ID"""
+        if not report:
+            return
+        if report[0] == self.report_ids.get('keyboard'):
+            self.keyboard_output(report[1:])
+        elif report[0] == self.report_ids.get('joystick'):
+            self.joystick_output(0, report[1:])
+
+    def joystick_output(self, index: int, report: bytes):
+        """Output report of joystick `index`, called from the writer thread. Only the latest rumble is kept."""
+        speeds = self.js_reports[index].rumble(report)
+        if speeds is not None:
+            with self.rumble_lock:
+                self.rumble[index] = speeds
+
+    def forward_rumble(self):
+        """Pass the rumble the host sent since the last frame on to the controllers"""
+        with self.rumble_lock:
+            rumble, self.rumble = self.rumble, {}
+        for index, (left, right) in rumble.items():
+            if index < len(self.bindings):
+                # Steam Input motor speeds are 0-65535
+                self.steam_input.TriggerVibration(self.bindings[index][0], left * 257, right * 257)
+
+    def key_press(self, name: str):
+        if self.keyboard_state is not None:
+            key = self.keyboard_layout.key(name)
+            with self.keyboard_lock:
+                self.keyboard_state.press(key)
+                self.keyboard_channel.write(self.keyboard_state.report())
+            if key.modifier:
+                self.set_keystate(**{group: True for group in self.keyboard_state.groups(key.modifier)})
+
+    def key_release(self, name: str):
+        if self.keyboard_state is not None:
+            # Modifier keys stay pressed until another key is released, then they are released with it
+            with self.keyboard_lock:
+                released = self.keyboard_state.release(self.keyboard_layout.key(name))
+                self.keyboard_channel.write(self.keyboard_state.report())
+            if released:
+                self.set_keystate(**{group: False for group in self.keyboard_state.groups(released)})
+
+    def press_keys(self, keys: tuple):
+        """Press a chord of keys in one report, from the input loop (macros). It is written with the next flush."""
+        pressed = 0
+        with self.keyboard_lock:
+            for key in keys:
+                pressed |= self.keyboard_state.press(key)
+            self.keyboard_channel.submit(self.keyboard_state.report())
+        if pressed:
+            self.set_keystate(**{group: True for group in self.keyboard_state.groups(pressed)})
+
+    def release_keys(self, keys: tuple):
+        """Release a chord of keys in one report. Unlike key_release(), other held modifiers stay pressed."""
+        released = 0
+        with self.keyboard_lock:
+            for key in keys:
+                released |= self.keyboard_state.release(key, latched=False)
+            self.keyboard_channel.submit(self.keyboard_state.report())
+        if released:
+            self.set_keystate(**{group: False for group in self.keyboard_state.groups(released)})
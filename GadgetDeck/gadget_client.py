@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Client of the gadget-deck-manager daemon.
+
+The daemon ('gadget-deck-manager.py daemon') keeps the gadget in memory and takes the same arguments as the manager
+command line, so this runs a manager action without starting the manager itself:
+    gadget_client.py apply joystick,mouse,keyboard
+When the daemon is not running, the command line falls back to running gadget-deck-manager.py directly.
+"""
+import os
+import re
+import sys
+import json
+import socket
+import subprocess
+
+DEFAULT_SOCKET = '/run/gadget-deck/manager.sock'
+
+
+class ManagerError(RuntimeError):
+    pass
+
+
+class ManagerClient:
+    def __init__(self, path: str = DEFAULT_SOCKET, timeout: float = 10.0):
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, argv: list[str]) -> dict:
+        """Send one request and return the response: {'ok': bool, 'result': ..., 'error': str, 'output': str}"""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            sock.sendall(json.dumps({'argv': list(argv)}).encode() + b'\n')
+            with sock.makefile('rb') as f:
+                line = f.readline()
+        if not line:
+            raise ConnectionError('The manager closed the connection')
+        return json.loads(line)
+
+    def run(self, *argv: str):
+        """Run a manager action, like run('enable', 'mouse'). Returns the result of the action."""
+        response = self.request(argv)
+        if not response['ok']:
+            raise ManagerError(response.get('error') or response.get('output'))
+        return response.get('result')
+
+    def status(self) -> dict:
+        """Snapshot of the gadget, see gadget_status.py"""
+        return self.run('status', '--compact')
+
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+
+def gadget_ready(status: dict) -> bool:
+    """Whether the gadget is bound with a joystick, a mouse and a keyboard, separate or in the composite function"""
+    linked = set(status.get('configs', {}).get('c.1', []))
+    if not status.get('udc'):
+        return False
+    if 'hid.composite' in linked:
+        return True
+    return any(re.fullmatch(r'hid\.joystick\d*', f) for f in linked) and {'hid.mouse', 'hid.keyboard'} <= linked
+
+
+def ensure_gadget(functions: str = 'joystick,mouse,keyboard', path: str = DEFAULT_SOCKET):
+    """
+    Set up the gadget functions through the daemon, or by starting gadget-deck.service (which applies with --keep as
+    well) when it is not running.
+    Functions that are already there stay as they are (like a second joystick, the NKRO keyboard or the network), and
+    a gadget that has all of them is not touched, so the host does not enumerate it again.
+    """
+    client = ManagerClient(path)
+    try:
+        if gadget_ready(client.status()):
+            return
+        response = client.request(['apply', functions, '--keep'])
+    except (FileNotFoundError, ConnectionRefusedError):
+        if subprocess.call(['systemctl', 'is-active', '--quiet', 'gadget-deck.service']) != 0:
+            print('Gadget not active, starting...')
+            subprocess.call(['systemctl', 'start', 'gadget-deck.service'])
+        return
+    if not response['ok']:
+        raise ManagerError(response.get('error'))
+
+
+def manager_path() -> str:
+    """gadget-deck-manager.py, next to this file when installed, or in the repository root"""
+    directory = os.path.dirname(os.path.realpath(__file__))
+    for path in (os.path.join(directory, 'gadget-deck-manager.py'), os.path.join(os.path.dirname(directory), 'gadget-deck-manager.py')):
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError('gadget-deck-manager.py not found')
+
+
+def main():
+    argv = sys.argv[1:]
+    socket_path = os.environ.get('GADGET_DECK_SOCKET', DEFAULT_SOCKET)
+    try:
+        response = ManagerClient(socket_path).request(argv)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # No daemon, do it ourselves
+        manager = manager_path()
+        os.execv(sys.executable, [sys.executable, manager] + argv)
+    sys.stdout.write(response.get('output', ''))
+    if not response['ok']:
+        print(response.get('error'), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Snapshot of the USB gadget: its functions, configuration links, UDC binding and /dev/hidg* and /dev/video* nodes.
+
+The snapshot is read in one pass over configfs and cached. The cache is invalidated when the mtime of the gadget
+directories or /dev changes (functions or links added or removed, device nodes created), and after a short TTL for
+state that has no mtime, like the UDC binding and the connection state.
+
+    python GadgetDeck/gadget_status.py
+"""
+import os
+import glob
+import json
+import time
+import stat
+from typing import Optional
+
+CONFIGFS = '/sys/kernel/config/usb_gadget'
+UDC_CLASS = '/sys/class/udc'
+
+
+def _read(path: str, default=None):
+    try:
+        with open(path, 'rt') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _device_node(dev: Optional[str]) -> Optional[dict]:
+    """The /dev node of a 'major:minor' character device"""
+    if not dev:
+        return None
+    uevent = _read(f'/sys/dev/char/{dev}/uevent', '')
+    name = next((line[len('DEVNAME='):] for line in uevent.splitlines() if line.startswith('DEVNAME=')), None)
+    if name is None:
+        return None
+    path = os.path.join('/dev', name)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        return {'path': path, 'exists': False}
+    return {'path': path, 'exists': True, 'mode': f'{mode:04o}'}
+
+
+def _video_node(udc: Optional[str]) -> Optional[dict]:
+    """The /dev/video* node of the UVC function of a gadget bound to `udc`"""
+    if not udc:
+        return None
+    for path in sorted(glob.glob(os.path.join(UDC_CLASS, udc, 'device', 'gadget*', 'video4linux', 'video*'))):
+        return _device_node(_read(os.path.join(path, 'dev')))
+    return None
+
+
+def _function(path: str, kind: str) -> dict:
+    function = {'type': kind, 'configs': []}
+    if kind == 'hid':
+        function['protocol'] = int(_read(os.path.join(path, 'protocol'), 0))
+        function['subclass'] = int(_read(os.path.join(path, 'subclass'), 0))
+        function['report_length'] = int(_read(os.path.join(path, 'report_length'), 0))
+        function['dev'] = _read(os.path.join(path, 'dev'))
+        function['device'] = _device_node(function['dev'])
+    elif kind in ('acm', 'gser'):
+        function['port_num'] = _read(os.path.join(path, 'port_num'))
+    elif kind == 'uvc':
+        function['streaming_maxpacket'] = int(_read(os.path.join(path, 'streaming_maxpacket'), 0))
+        function['control_interface'] = int(_read(os.path.join(path, 'control', 'bInterfaceNumber'), -1))
+        function['streaming_interface'] = int(_read(os.path.join(path, 'streaming', 'bInterfaceNumber'), -1))
+    elif kind in ('ecm', 'ncm', 'rndis', 'eem'):
+        for attribute in ('ifname', 'dev_addr', 'host_addr', 'qmult'):
+            function[attribute] = _read(os.path.join(path, attribute))
+    return function
+
+
+def snapshot(name: str = 'gadget-deck', root: str = CONFIGFS) -> dict:
+    """Read the state of a gadget in one pass"""
+    path = os.path.join(root, name)
+    status = {'name': name, 'exists': os.path.isdir(path), 'time': time.time()}
+    try:
+        status['available_udcs'] = sorted(os.listdir(UDC_CLASS))
+    except OSError:
+        status['available_udcs'] = []
+    if not status['exists']:
+        return status
+
+    for attribute in ('idVendor', 'idProduct', 'bcdDevice', 'bcdUSB'):
+        status[attribute] = _read(os.path.join(path, attribute))
+    udc = _read(os.path.join(path, 'UDC')) or None
+    status['udc'] = udc
+    status['udc_state'] = _read(os.path.join(UDC_CLASS, udc, 'state')) if udc else None
+
+    functions = {}
+    with os.scandir(os.path.join(path, 'functions')) as entries:
+        for entry in entries:
+            functions[entry.name] = _function(entry.path, entry.name.partition('.')[0])
+    configs = {}
+    with os.scandir(os.path.join(path, 'configs')) as entries:
+        for config in entries:
+            with os.scandir(config.path) as links:
+                linked = sorted(link.name for link in links if link.is_symlink())
+            configs[config.name] = linked
+            for function in linked:
+                if function in functions:
+                    functions[function]['configs'].append(config.name)
+    for function in functions.values():
+        if function['type'] == 'uvc':
+            function['device'] = _video_node(udc)
+    status['configs'] = configs
+    status['functions'] = dict(sorted(functions.items()))
+    return status
+
+
+class StatusCache:
+    """Cached snapshot(), rebuilt when the gadget tree changed or the snapshot is older than `ttl` seconds"""
+
+    def __init__(self, name: str = 'gadget-deck', root: str = CONFIGFS, ttl: float = 1.0):
+        self.name = name
+        self.root = root
+        self.ttl = ttl
+        self.status = None
+        self.key = None
+        self.expires = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self) -> tuple:
+        path = os.path.join(self.root, self.name)
+        key = []
+        for directory in (path, os.path.join(path, 'functions'), os.path.join(path, 'configs'), '/dev'):
+            try:
+                key.append(os.stat(directory).st_mtime_ns)
+            except OSError:
+                key.append(None)
+        try:
+            with os.scandir(os.path.join(path, 'configs')) as configs:
+                key.extend(os.stat(config.path).st_mtime_ns for config in configs)
+        except OSError:
+            pass
+        return tuple(key)
+
+    def get(self) -> dict:
+        key = self._key()
+        now = time.monotonic()
+        if self.status is not None and key == self.key and now < self.expires:
+            self.hits += 1
+            return self.status
+        self.misses += 1
+        self.status = snapshot(self.name, self.root)
+        self.key = key
+        self.expires = now + self.ttl
+        return self.status
+
+    def invalidate(self):
+        self.status = None
+
+
+if __name__ == '__main__':
+    print(json.dumps(snapshot(), indent=2))
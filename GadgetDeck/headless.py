@@ -0,0 +1,89 @@
+"""
+GadgetDeck without a UI, for a docked Deck or a systemd service: no PyQt5 is imported, the input loop runs on the main
+thread, and SIGTERM or SIGINT stop it cleanly, returning the joysticks to neutral. With systemd Type=notify, the
+service is reported ready once the emulator runs (see util/user/gadget-deck-headless.service).
+
+    python GadgetDeck --headless --report-interval 60
+"""
+import os
+import sys
+import json
+import signal
+import socket
+import threading
+import concurrent.futures
+from typing import Optional
+
+try:
+    import emulator
+    import gadget_client
+    import startup
+except ImportError:
+    sys.path.append(os.path.dirname(__file__))
+    import emulator
+    import gadget_client
+    import startup
+
+
+def notify_systemd(state: str):
+    """sd_notify() without libsystemd, does nothing when not started by systemd"""
+    path = os.environ.get('NOTIFY_SOCKET')
+    if not path:
+        return
+    if path.startswith('@'):
+        path = '\0' + path[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as client:
+            client.sendto(state.encode(), path)
+    except OSError:
+        pass
+
+
+class HeadlessEmulator(emulator.JoystickEmulator):
+    """The emulator, printing its statistics every `report_interval` seconds"""
+
+    def __init__(self, *args, report_interval: Optional[float] = None, **kwargs):
+        emulator.JoystickEmulator.__init__(self, *args, **kwargs)
+        self.report_interval = report_interval
+        self.stopped = threading.Event()
+
+    def report(self):
+        while not self.stopped.wait(self.report_interval):
+            stats = self.stats()
+            print(json.dumps({'process': stats['process'], 'loop': stats['loop'], 'profile': stats['profile']}), flush=True)
+
+    def shutdown(self, signum=None, frame=None):
+        # Only ends the input loop; stop() runs on the main thread once it returned
+        self.running = False
+        self.stopped.set()
+
+
+def main(args, startup_timer: startup.StartupTimer):
+    startup_timer.mark('imports')
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        gadget = executor.submit(gadget_client.ensure_gadget)
+        steam_input = executor.submit(emulator.init_steam_input)
+        gadget.result()
+        devices = emulator.find_devices()
+        descriptors = emulator.find_descriptors()
+        steam_input = steam_input.result()
+    startup_timer.mark('gadget and steam input ready')
+
+    joystick_emulator = HeadlessEmulator(steam_input, devices, args.rate, args.spin, args.keepalive, args.latency,
+                                         args.stats_socket, args.record, descriptors=descriptors, macro_file=args.macros,
+                                         profile_file=args.profiles, profile=args.profile, report_interval=args.report_interval)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, joystick_emulator.shutdown)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if args.report_interval:
+        threading.Thread(target=joystick_emulator.report, name='report', daemon=True).start()
+    startup_timer.mark('emulator running')
+    if args.startup_timing:
+        startup_timer.report()
+    notify_systemd('READY=1')
+    try:
+        joystick_emulator.start(background=False)
+    finally:
+        notify_systemd('STOPPING=1')
+        joystick_emulator.shutdown()
+        joystick_emulator.stop()
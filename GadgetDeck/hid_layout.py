@@ -0,0 +1,369 @@
+"""
+Compile HID report descriptors into report layouts and packers.
+
+The descriptors in 'HID Descriptors/*.txt' are the single source of truth for the report format: gadget-deck-manager
+uses the layout for the report length of a function, and the emulator packs its reports with a ReportPacker generated
+from the same layout, instead of hardcoding the report format.
+"""
+import os
+import re
+import struct
+import functools
+from typing import Optional, Union
+
+# 'HID Descriptors' next to this module when installed (make install), or one level up in the repository
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+DESCRIPTOR_DIRS = (os.path.join(_MODULE_DIR, 'HID Descriptors'), os.path.join(os.path.dirname(_MODULE_DIR), 'HID Descriptors'))
+
+# Item tags, see the USB Device Class Definition for HID, section 6.2.2
+MAIN, GLOBAL, LOCAL = 0, 1, 2
+INPUT, OUTPUT, COLLECTION, FEATURE, END_COLLECTION = 0x8, 0x9, 0xA, 0xB, 0xC
+USAGE_PAGE, LOGICAL_MINIMUM, LOGICAL_MAXIMUM, REPORT_SIZE, REPORT_ID, REPORT_COUNT, PUSH, POP = 0x0, 0x1, 0x2, 0x7, 0x8, 0x9, 0xA, 0xB
+USAGE, USAGE_MINIMUM, USAGE_MAXIMUM = 0x0, 0x1, 0x2
+
+USAGE_PAGE_GENERIC_DESKTOP = 0x01
+USAGE_PAGE_KEYBOARD = 0x07
+USAGE_PAGE_BUTTON = 0x09
+USAGE_PAGE_CONSUMER = 0x0C
+USAGE_PAGE_VENDOR = 0xFF00
+
+# Report IDs of the parts of the composite HID function, see composite_descriptor()
+COMPOSITE_REPORT_IDS = {'joystick': 1, 'mouse': 2, 'keyboard': 3}
+
+
+class Field:
+    """A main item of a report: `count` values of `size` bits each, starting at bit `offset` of the report"""
+    __slots__ = ('kind', 'report_id', 'offset', 'size', 'count', 'logical_minimum', 'logical_maximum',
+                 'usage_page', 'usages', 'flags')
+
+    def __init__(self, kind, report_id, offset, size, count, logical_minimum, logical_maximum, usage_page, usages, flags):
+        self.kind = kind
+        self.report_id = report_id
+        self.offset = offset
+        self.size = size
+        self.count = count
+        self.logical_minimum = logical_minimum
+        self.logical_maximum = logical_maximum
+        self.usage_page = usage_page
+        self.usages = usages
+        self.flags = flags
+
+    @property
+    def constant(self) -> bool:
+        return bool(self.flags & 0x01)
+
+    @property
+    def variable(self) -> bool:
+        return bool(self.flags & 0x02)
+
+    @property
+    def relative(self) -> bool:
+        return bool(self.flags & 0x04)
+
+    @property
+    def signed(self) -> bool:
+        return self.logical_minimum < 0
+
+    def usage(self, i: int) -> Optional[int]:
+        """Usage of the i'th value. When there are fewer usages than values, the last one repeats."""
+        if not self.usages:
+            return None
+        return self.usages[min(i, len(self.usages) - 1)]
+
+    def __repr__(self):
+        kind = 'Input' if self.kind == INPUT else 'Output' if self.kind == OUTPUT else 'Feature'
+        return (f'<{kind} id={self.report_id} offset={self.offset} size={self.size}x{self.count} '
+                f'range={self.logical_minimum}..{self.logical_maximum} page={self.usage_page:#x} flags={self.flags:#x}>')
+
+
+class ReportLayout:
+    """The fields of all reports described by a report descriptor"""
+
+    def __init__(self, descriptor: bytes):
+        self.descriptor = bytes(descriptor)
+        self.fields: list[Field] = []
+        self.report_bits: dict[tuple[int, Optional[int]], int] = {}
+        self._parse()
+
+    def _parse(self):
+        state = {'usage_page': 0, 'logical_minimum': 0, 'logical_maximum': 0, 'report_size': 0, 'report_count': 0, 'report_id': None}
+        stack = []
+        usages = []
+        usage_minimum = None
+        data = self.descriptor
+        i = 0
+        while i < len(data):
+            prefix = data[i]
+            if prefix == 0xFE:
+                # Long item, skip it
+                i += 3 + data[i + 1]
+                continue
+            size = (0, 1, 2, 4)[prefix & 0x03]
+            item_type = (prefix >> 2) & 0x03
+            tag = prefix >> 4
+            raw = data[i + 1:i + 1 + size]
+            unsigned = int.from_bytes(raw, 'little')
+            signed = int.from_bytes(raw, 'little', signed=True)
+            i += 1 + size
+
+            if item_type == MAIN:
+                if tag in (INPUT, OUTPUT, FEATURE):
+                    key = (tag, state['report_id'])
+                    offset = self.report_bits.get(key, 0)
+                    count = state['report_count']
+                    field = Field(tag, state['report_id'], offset, state['report_size'], count,
+                                  state['logical_minimum'], state['logical_maximum'], state['usage_page'], usages, unsigned)
+                    self.fields.append(field)
+                    self.report_bits[key] = offset + state['report_size'] * count
+                usages = []
+            elif item_type == GLOBAL:
+                if tag == USAGE_PAGE:
+                    state['usage_page'] = unsigned
+                elif tag == LOGICAL_MINIMUM:
+                    state['logical_minimum'] = signed
+                elif tag == LOGICAL_MAXIMUM:
+                    # The maximum is only negative if the minimum is, otherwise 0xFF means 255
+                    state['logical_maximum'] = signed if state['logical_minimum'] < 0 else unsigned
+                elif tag == REPORT_SIZE:
+                    state['report_size'] = unsigned
+                elif tag == REPORT_ID:
+                    state['report_id'] = unsigned
+                elif tag == REPORT_COUNT:
+                    state['report_count'] = unsigned
+                elif tag == PUSH:
+                    stack.append(dict(state))
+                elif tag == POP:
+                    state = stack.pop()
+            elif item_type == LOCAL:
+                if tag == USAGE:
+                    usages.append(unsigned)
+                elif tag == USAGE_MINIMUM:
+                    usage_minimum = unsigned
+                elif tag == USAGE_MAXIMUM and usage_minimum is not None:
+                    usages.extend(range(usage_minimum, unsigned + 1))
+                    usage_minimum = None
+
+    @property
+    def report_ids(self) -> list[Optional[int]]:
+        return sorted({report_id for kind, report_id in self.report_bits}, key=lambda r: -1 if r is None else r)
+
+    def report_size(self, kind: int = INPUT, report_id: Optional[int] = None) -> int:
+        """Size in bytes of a report, including the report ID byte"""
+        bits = self.report_bits.get((kind, report_id), 0)
+        return (bits + 7) // 8 + (1 if report_id is not None and bits else 0)
+
+    @property
+    def report_length(self) -> int:
+        """Size of the largest report, the report_length of a HID gadget function"""
+        return max((self.report_size(kind, report_id) for kind, report_id in self.report_bits), default=0)
+
+    def input_fields(self, report_id: Optional[int] = None) -> list[Field]:
+        return [f for f in self.fields if f.kind == INPUT and f.report_id == report_id]
+
+    def output_fields(self, report_id: Optional[int] = None) -> list[Field]:
+        return [f for f in self.fields if f.kind == OUTPUT and f.report_id == report_id]
+
+    def packer(self, report_id: Optional[int] = None) -> 'ReportPacker':
+        return ReportPacker(self, report_id)
+
+
+class ReportPacker:
+    """
+    Serialize an input report with a single precompiled struct.Struct.
+
+    Variable fields of 8, 16 or 32 bits become the axes, in descriptor order. All 1-bit fields are buttons, combined
+    into a single bitmask; button i is bit i, in descriptor order. Constant padding is packed as zero.
+    A report is built with pack(axes, buttons), where axes is a sequence of integers in the logical range of each axis;
+    unpack() reads one back.
+    """
+    _FORMATS = {(8, False): 'B', (8, True): 'b', (16, False): 'H', (16, True): 'h', (32, False): 'I', (32, True): 'i'}
+
+    def __init__(self, layout: ReportLayout, report_id: Optional[int] = None):
+        self.report_id = report_id
+        self.axes: list[tuple[int, int, int, int, bool]] = []        # (usage page, usage, logical min, logical max, relative)
+        self.button_count = 0
+        fmt = '<'
+        prefix = []
+        if report_id is not None:
+            fmt += 'B'
+            prefix.append(report_id)
+        # Sequence of struct items: ('axis', index), ('buttons', bit offset, bits), ('pad', bits)
+        items = []
+        fields = sorted(layout.input_fields(report_id), key=lambda f: f.offset)
+        bit = 0
+        for field in fields:
+            if field.offset != bit:
+                raise ValueError(f'Unsupported gap in report before {field}')
+            bits = field.size * field.count
+            if field.size == 1 and not field.constant:
+                items.append(('buttons', self.button_count, bits))
+                self.button_count += bits
+            elif field.constant:
+                items.append(('pad', bits))
+            elif field.variable and (field.size, field.signed) in self._FORMATS:
+                for i in range(field.count):
+                    items.append(('axis', field.size, field.signed))
+                    self.axes.append((field.usage_page, field.usage(i), field.logical_minimum, field.logical_maximum, field.relative))
+            else:
+                raise ValueError(f'Unsupported field {field}')
+            bit += bits
+
+        # Merge adjacent bit runs (buttons and padding) into whole bytes
+        self._button_words: list[tuple[int, int]] = []      # (shift, mask) of every button struct item
+        pending_bits = 0
+        pending_shift = None
+        for item in items + [('end',)]:
+            if item[0] in ('buttons', 'pad'):
+                if pending_shift is None:
+                    pending_shift = item[1] if item[0] == 'buttons' else self.button_count
+                pending_bits += item[-1]
+                continue
+            if pending_bits:
+                if pending_bits % 8:
+                    raise ValueError('Bit fields must add up to whole bytes')
+                remaining = pending_bits // 8
+                shift = pending_shift
+                for size, char in ((4, 'I'), (2, 'H'), (1, 'B')):
+                    while remaining >= size:
+                        fmt += char
+                        self._button_words.append((shift, (1 << (8 * size)) - 1))
+                        shift += 8 * size
+                        remaining -= size
+                pending_bits = 0
+                pending_shift = None
+            if item[0] == 'axis':
+                fmt += self._FORMATS[(item[1], item[2])]
+                self._button_words.append(None)
+        self.struct = struct.Struct(fmt)
+        self.prefix = tuple(prefix)
+        self.size = self.struct.size
+        # When the axes are contiguous, the report is (button words, axes, button words)
+        words = self._button_words
+        first = words.index(None) if self.axes else len(words)
+        self._contiguous = all(word is None for word in words[first:first + len(self.axes)]) and \
+            None not in words[first + len(self.axes):]
+        self._head = tuple(words[:first])
+        self._tail = tuple(words[first + len(self.axes):])
+
+    def pack(self, axes, buttons: int = 0) -> bytes:
+        if self._contiguous:
+            # Fast path, every GadgetDeck descriptor has its axes in one block
+            return self.struct.pack(*self.prefix, *[buttons >> shift & mask for shift, mask in self._head], *axes,
+                                    *[buttons >> shift & mask for shift, mask in self._tail])
+        values = list(self.prefix)
+        axis = 0
+        for word in self._button_words:
+            if word is None:
+                values.append(axes[axis])
+                axis += 1
+            else:
+                values.append(buttons >> word[0] & word[1])
+        return self.struct.pack(*values)
+
+    def unpack(self, report: bytes) -> tuple[list[int], int]:
+        """The axes and buttons of a report built by pack()"""
+        values = self.struct.unpack(report)[len(self.prefix):]
+        axes = []
+        buttons = 0
+        for word, value in zip(self._button_words, values):
+            if word is None:
+                axes.append(value)
+            else:
+                buttons |= value << word[0]
+        return axes, buttons
+
+    def axis_range(self, i: int) -> tuple[int, int]:
+        return self.axes[i][2], self.axes[i][3]
+
+    def axis_index(self, usage: int, usage_page: int = USAGE_PAGE_GENERIC_DESKTOP) -> int:
+        for i, (page, axis_usage, *_) in enumerate(self.axes):
+            if page == usage_page and axis_usage == usage:
+                return i
+        raise KeyError(f'No axis with usage {usage_page:#x}:{usage:#x}')
+
+    def clamp(self, i: int, value: int) -> int:
+        """Limit a value to the logical range of axis i"""
+        lo, hi = self.axes[i][2], self.axes[i][3]
+        return lo if value < lo else hi if value > hi else value
+
+    def scale(self, i: int, value: float) -> int:
+        """Map a value in -1...1 (signed axis) or 0...1 (unsigned axis) to the logical range of axis i"""
+        return self.clamp(i, int(value * self.axes[i][3]))
+
+
+def parse_descriptor_text(text: str) -> bytes:
+    """Read a descriptor in the format of 'HID Descriptors/*.txt': hex bytes with // comments"""
+    data = bytearray()
+    for line in text.splitlines():
+        line = line.split('//', 1)[0]
+        data.extend(int(value, 16) for value in re.findall(r'0x[0-9A-Fa-f]{1,2}\b', line))
+    return bytes(data)
+
+
+def tag_descriptor(descriptor: bytes, report_id: int) -> bytes:
+    """Put all reports of a descriptor without report IDs under `report_id`, by inserting it into every top-level collection"""
+    tagged = bytearray()
+    depth = 0
+    i = 0
+    while i < len(descriptor):
+        prefix = descriptor[i]
+        size = 3 + descriptor[i + 1] if prefix == 0xFE else 1 + (0, 1, 2, 4)[prefix & 0x03]
+        tagged += descriptor[i:i + size]
+        i += size
+        if prefix & 0xFC == 0x84:
+            raise ValueError('The descriptor already has report IDs')
+        if prefix & 0xFC == 0xA0:
+            if depth == 0:
+                tagged += bytes((0x85, report_id))
+            depth += 1
+        elif prefix & 0xFC == 0xC0:
+            depth -= 1
+    return bytes(tagged)
+
+
+def composite_descriptor(parts: Optional[dict[str, str]] = None) -> bytes:
+    """
+    Merge descriptors into the descriptor of a single composite HID function: `parts` maps a part of
+    COMPOSITE_REPORT_IDS to the name or path of its descriptor (by default, the descriptor named after the part),
+    and every part becomes its own report ID.
+    """
+    if parts is None:
+        parts = {part: part for part in COMPOSITE_REPORT_IDS}
+    descriptor = bytearray()
+    for part, name in parts.items():
+        with open(descriptor_path(name), 'rt') as f:
+            descriptor += tag_descriptor(parse_descriptor_text(f.read()), COMPOSITE_REPORT_IDS[part])
+    return bytes(descriptor)
+
+
+def descriptor_path(name: str) -> str:
+    """A path to a descriptor text file as is, or the file of a descriptor name in the first of DESCRIPTOR_DIRS that has it"""
+    if os.path.exists(name):
+        return name
+    for directory in DESCRIPTOR_DIRS:
+        path = os.path.join(directory, f'{name}.txt')
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f'No HID descriptor {name} in {" or ".join(DESCRIPTOR_DIRS)}')
+
+
+@functools.lru_cache(maxsize=None)
+def compile_descriptor(descriptor: bytes) -> ReportLayout:
+    return ReportLayout(descriptor)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_file(path: str, mtime: int) -> ReportLayout:
+    with open(path, 'rt') as f:
+        return compile_descriptor(parse_descriptor_text(f.read()))
+
+
+def load(descriptor: Union[str, bytes]) -> ReportLayout:
+    """
+    Compile a descriptor, given as raw bytes, a path to a descriptor text file, or the name of a descriptor in
+    'HID Descriptors'. Compiled layouts are cached, files are only parsed again when they were modified.
+    """
+    if isinstance(descriptor, (bytes, bytearray)):
+        return compile_descriptor(bytes(descriptor))
+    path = descriptor_path(descriptor)
+    return _load_file(os.path.abspath(path), os.stat(path).st_mtime_ns)
@@ -0,0 +1,279 @@
+import os
+import time
+import select
+import threading
+import collections
+from typing import Callable, Optional
+
+
+class ReportFilter:
+    """
+    Only pass on HID reports that differ from the last one written.
+
+    The host keeps the last report it received, so resending identical bytes is wasted work. An unchanged report is
+    still written once every `keepalive` seconds, to recover from reports the host may have missed.
+    """
+
+    def __init__(self, write: Callable[[bytes, int], object], keepalive: float = 1.0):
+        self.write = write
+        self.keepalive = int(keepalive * 1e9)
+        self.last_report = None
+        self.last_write = 0
+        self.written = 0
+        self.suppressed = 0
+
+    def submit(self, report: bytes, force=False, stamp: int = 0) -> bool:
+        """
+        Write a report if it changed since the last write, or when the keepalive interval passed.
+        Set `force` for reports that carry relative data, where sending the same report twice is meaningful.
+        Return whether the report was written.
+        """
+        now = time.monotonic_ns()
+        if not force and report == self.last_report and now - self.last_write < self.keepalive:
+            self.suppressed += 1
+            return False
+        self.write(report, stamp)
+        self.last_report = report
+        self.last_write = now
+        self.written += 1
+        return True
+
+    def reset(self):
+        """Forget the last report, so the next one is always written"""
+        self.last_report = None
+
+    def to_dict(self):
+        return {'written': self.written, 'suppressed': self.suppressed}
+
+
+class HIDChannel:
+    """
+    Output queue of one report stream, owned by a HIDWriter.
+
+    Reports that describe absolute state (joystick) use a depth of 1: when the queue is full, the oldest report is
+    dropped, as a report that is stuck behind newer state is stale anyway. Relative reports (mouse) can not be dropped
+    without losing their motion: with `merge(queued, report)`, a full queue combines the new report into the newest
+    queued one instead. The first queued report may be in the middle of being written, so merging needs a depth of at
+    least 2. Every keyboard report is a press or release, so the keyboard uses a depth of None: its queue is unbounded
+    and never drops a report.
+    Usually a channel has its own hidg device; the channels of a composite HID function share one device.
+    """
+
+    def __init__(self, writer: 'HIDWriter', name: str, device: 'HIDDevice', depth: Optional[int] = 1,
+                 merge: Optional[Callable[[bytes, bytes], bytes]] = None):
+        if merge is not None and (depth is None or depth < 2):
+            raise ValueError('A merging channel needs a bounded depth of at least 2')
+        self.writer = writer
+        self.name = name
+        self.device = device
+        self.fd = device.fd
+        self.queue = collections.deque(maxlen=depth)
+        self.merge = merge
+        self.stamp = 0                  # Start time of the frame of the latest queued report, for latency measurement
+        self.written = 0
+        self.dropped = 0
+        self.merged = 0
+        self.eagain = 0
+        self.stalls = 0
+        self.errors = 0
+
+    def submit(self, report: bytes, stamp: int = 0):
+        """Queue a report. It is written after the next HIDWriter.flush()"""
+        with self.writer.lock:
+            if len(self.queue) == self.queue.maxlen:
+                if self.merge is not None:
+                    # The writer only ever writes the first report, the last one is not in flight
+                    self.queue[-1] = self.merge(self.queue[-1], report)
+                    self.merged += 1
+                    self.stamp = stamp
+                    return
+                self.dropped += 1
+            self.queue.append(report)
+            self.stamp = stamp
+
+    def write(self, report: bytes, stamp: int = 0):
+        """Queue a report and wake up the writer immediately"""
+        self.submit(report, stamp)
+        self.writer.flush()
+
+    def to_dict(self):
+        return {'written': self.written, 'dropped': self.dropped, 'merged': self.merged, 'eagain': self.eagain,
+                'stalls': self.stalls, 'errors': self.errors, 'queued': len(self.queue), 'received': self.device.received}
+
+
+class HIDDevice:
+    """A hidg file descriptor, its epoll registration and the channels that write to it"""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.channels: list[HIDChannel] = []
+        self.on_output: Optional[Callable[[bytes], object]] = None      # Called from the writer thread with every output report
+        self.output_length = 64
+        self.events = 0                 # Events the fd is registered for in the writer's epoll
+        self.waiting = False            # EAGAIN was returned, waiting for the host to read the previous report
+        self.blocked_since = None
+        self.received = 0
+
+
+class HIDWriter(threading.Thread):
+    """
+    Write HID reports from a dedicated thread, using non-blocking file descriptors and epoll.
+
+    A hidg write blocks until the host has read the previous report, so when the host stalls (suspended, or nobody
+    reading the endpoint), an inline write freezes the input loop. Here, the input loop only queues reports and calls
+    flush() once per frame. A device that returns EAGAIN is retried when epoll reports it writable. When it stays
+    blocked for longer than `stall_timeout` seconds, that is counted as a stall.
+
+    The same epoll also reads the output reports the host sends (keyboard LEDs, rumble) from the devices that have an
+    `on_output` callback, so there is no reader thread per device.
+    """
+
+    def __init__(self, stall_timeout: float = 0.5, monitor=None):
+        threading.Thread.__init__(self, name='HIDWriter', daemon=True)
+        self.monitor = monitor          # Optional latency.LatencyMonitor
+        self.lock = threading.Lock()
+        self.devices: dict[int, HIDDevice] = {}
+        self.paths: dict[str, int] = {}
+        self.channels: list[HIDChannel] = []
+        self.stall_timeout = int(stall_timeout * 1e9)
+        self.epoll = select.epoll()
+        self.wakeup = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        self.epoll.register(self.wakeup, select.EPOLLIN)
+        self.running = True
+
+    def add(self, name: str, device, depth: Optional[int] = 1, on_output: Optional[Callable[[bytes], object]] = None,
+            output_length: int = 64, merge: Optional[Callable[[bytes, bytes], bytes]] = None) -> HIDChannel:
+        """
+        Take over writing to a hidg device. `device` is a file object, file descriptor or path. Channels added with
+        the same path or file descriptor share the device, and are written in the order they were added.
+        With `on_output`, the output reports of the host are read from the device as well, see set_output().
+        `merge` combines relative reports instead of dropping them, a `depth` of None never drops one, see HIDChannel.
+        """
+        if isinstance(device, str):
+            fd = self.paths.get(device)
+            if fd is None:
+                fd = self.paths[device] = os.open(device, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+        else:
+            fd = device if isinstance(device, int) else device.fileno()
+            os.set_blocking(fd, False)
+        if fd not in self.devices:
+            self.devices[fd] = HIDDevice(fd)
+        channel = HIDChannel(self, name, self.devices[fd], depth, merge)
+        self.devices[fd].channels.append(channel)
+        self.channels.append(channel)
+        if on_output is not None:
+            self.set_output(channel, on_output, output_length)
+        return channel
+
+    def set_output(self, channel: HIDChannel, on_output: Callable[[bytes], object], output_length: int = 64):
+        """Read the output reports of the device of a channel. That needs a character device, epoll can not watch a regular file."""
+        channel.device.on_output = on_output
+        channel.device.output_length = output_length
+        self._watch(channel.device)
+
+    def _watch(self, device: HIDDevice):
+        """Register the events of a device: readable if it takes output reports, writable while it waits"""
+        events = (select.EPOLLIN if device.on_output is not None else 0) | (select.EPOLLOUT if device.waiting else 0)
+        if events == device.events:
+            return
+        if not events:
+            self.epoll.unregister(device.fd)
+        elif not device.events:
+            self.epoll.register(device.fd, events)
+        else:
+            self.epoll.modify(device.fd, events)
+        device.events = events
+
+    def flush(self):
+        """Wake up the writer thread to write all queued reports"""
+        os.eventfd_write(self.wakeup, 1)
+
+    def stop(self):
+        self.running = False
+        self.flush()
+
+    def run(self):
+        while self.running:
+            timeout = self.stall_timeout / 1e9 if any(d.waiting for d in self.devices.values()) else -1
+            for fd, event in self.epoll.poll(timeout):
+                if fd == self.wakeup:
+                    try:
+                        os.eventfd_read(self.wakeup)
+                    except BlockingIOError:
+                        pass
+                else:
+                    device = self.devices[fd]
+                    if event & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP) and device.on_output is not None:
+                        self._read_output(device)
+                    if event & select.EPOLLOUT:
+                        device.waiting = False
+                        self._watch(device)
+            now = time.monotonic_ns()
+            for device in self.devices.values():
+                if not device.waiting:
+                    for channel in device.channels:
+                        if not self._write_queue(channel, now):
+                            break
+                elif now - device.blocked_since >= self.stall_timeout:
+                    # Count every stalled period once
+                    for channel in device.channels:
+                        channel.stalls += 1
+                    device.blocked_since = now
+        # One more pass for what was queued right before stop(), like the released state of the emulator
+        now = time.monotonic_ns()
+        for device in self.devices.values():
+            if not device.waiting:
+                for channel in device.channels:
+                    if not self._write_queue(channel, now):
+                        break
+
+    def _write_queue(self, channel: HIDChannel, now: int) -> bool:
+        """Write the queued reports of a channel, return False when its device is blocked"""
+        device = channel.device
+        while True:
+            with self.lock:
+                if not channel.queue:
+                    return True
+                report = channel.queue[0]
+            try:
+                os.write(channel.fd, report)
+            except BlockingIOError:
+                channel.eagain += 1
+                device.waiting = True
+                if device.blocked_since is None:
+                    device.blocked_since = now
+                self._watch(device)
+                return False
+            except OSError:
+                # The device is gone (gadget deactivated or host disconnected) - drop the report
+                channel.errors += 1
+            else:
+                device.blocked_since = None
+                channel.written += 1
+                if self.monitor is not None and channel.stamp:
+                    self.monitor.record(channel.name, channel.stamp)
+            with self.lock:
+                # The report may have been dropped by submit() while writing; only remove it if it's still queued
+                if channel.queue and channel.queue[0] is report:
+                    channel.queue.popleft()
+
+    def _read_output(self, device: HIDDevice):
+        while True:
+            try:
+                report = os.read(device.fd, device.output_length)
+            except BlockingIOError:
+                return
+            except OSError:
+                # The device is gone, stop reading it instead of spinning on the error
+                for channel in device.channels:
+                    channel.errors += 1
+                device.on_output = None
+                self._watch(device)
+                return
+            if not report:
+                return
+            device.received += 1
+            device.on_output(report)
+
+    def to_dict(self):
+        return {channel.name: channel.to_dict() for channel in self.channels}
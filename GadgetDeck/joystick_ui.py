@@ -1,11 +1,10 @@
-import os
-import json
-
-from PyQt5.QtCore import pyqtSignal, QPoint, Qt, QRect
-from PyQt5.QtGui import QPainter, QPen, QBrush
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, qApp
+from PyQt5.QtCore import pyqtSignal, QPoint, Qt, QRect, QTimer
+from PyQt5.QtGui import QPainter, QPen, QBrush, QFont
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, qApp
 
 import onscreen_keyboard
+import keyboard_layout
+import controller_state
 
 
 def constrain(value, lo, hi):
@@ -13,7 +12,6 @@ def constrain(value, lo, hi):
 
 
 class JoystickUI(QWidget):
-    _update_info_signal = pyqtSignal(object)
     keypress = pyqtSignal(str)
     keyrelease = pyqtSignal(str)
     keystate = pyqtSignal(object)
@@ -23,32 +21,81 @@ class JoystickUI(QWidget):
         self.main_layout = QVBoxLayout()
         self.js = AnalogWidget()
         self.main_layout.addWidget(self.js)
+        self.button_layout = QHBoxLayout()
+        self.status_label = QLabel()
+        self.button_layout.addWidget(self.status_label)
+        self.stats_button = QPushButton('Stats')
+        self.stats_button.setCheckable(True)
+        self.stats_button.toggled.connect(self.show_stats)
+        self.button_layout.addWidget(self.stats_button)
         self.exit_button = QPushButton('Exit')
         self.exit_button.clicked.connect(self.exit)
-        self.main_layout.addWidget(self.exit_button)
-        with open(os.path.join(os.path.dirname(__file__), 'keyboard.json')) as f:
-            keyboard_keys = json.load(f)
-        self.keyboard = onscreen_keyboard.Keyboard(keyboard_keys)
-        self.keyboard.keypress.connect(self.onscreen_keypress_event)
-        self.keyboard.keyrelease.connect(self.onscreen_keyrelease_event)
-        self.keystate.connect(self.keyboard.set_key_state)
-        self.main_layout.addWidget(self.keyboard)
+        self.button_layout.addWidget(self.exit_button)
+        self.main_layout.addLayout(self.button_layout)
+        # The on-screen keyboard is built by build_keyboard(), after the window is shown
+        self.keyboard = None
+        self.key_states = {}
         self.setLayout(self.main_layout)
         self.setWindowState(Qt.WindowMaximized)
         screen = QApplication.desktop().screenGeometry()
         self.setFixedSize(screen.width(), screen.height())
-        self.keyboard.setMaximumHeight(screen.height()//2)
-
-        self.data = {}
-        self._update_info_signal.connect(self._update_information_listener)
-
-    def update_information(self, data):
-        self.data.update(data)
-        self._update_info_signal.emit(self.data)
 
-    def _update_information_listener(self, data):
-        if 'analog_data' in data:
-            self.js.set_value(data['analog_data'])
+        self.publisher = None
+        self.state = controller_state.ControllerState()
+        self.state_version = -1
+        # Refresh from the latest published state once per display frame, independent of the input poll rate
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        refresh_rate = QApplication.primaryScreen().refreshRate() or 60
+        self.refresh_timer.start(int(1000 / refresh_rate))
+
+        self.stats_provider = None
+        self.stats_overlay = StatsOverlay(self)
+        self.stats_overlay.hide()
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.refresh_stats)
+
+    def build_keyboard(self):
+        if self.keyboard is not None:
+            return
+        self.keyboard = onscreen_keyboard.Keyboard(keyboard_layout.load())
+        self.keyboard.keypress.connect(self.onscreen_keypress_event)
+        self.keyboard.keyrelease.connect(self.onscreen_keyrelease_event)
+        self.keystate.connect(self.keyboard.set_key_state)
+        self.keyboard.setMaximumHeight(self.height() // 2)
+        self.main_layout.addWidget(self.keyboard)
+        # Key states that arrived before the keyboard existed
+        if self.key_states:
+            self.keyboard.set_key_state(self.key_states)
+
+    def set_status(self, text: str):
+        self.status_label.setText(text)
+
+    def set_publisher(self, publisher: controller_state.StatePublisher):
+        self.publisher = publisher
+
+    def set_stats_provider(self, provider):
+        self.stats_provider = provider
+
+    def show_stats(self, visible):
+        self.stats_overlay.setVisible(visible)
+        if visible:
+            self.refresh_stats()
+            self.stats_timer.start(500)
+        else:
+            self.stats_timer.stop()
+
+    def refresh_stats(self):
+        if self.stats_provider is not None:
+            self.stats_overlay.set_stats(self.stats_provider())
+
+    def refresh(self):
+        if self.publisher is None:
+            return
+        version = self.publisher.read(self.state, self.state_version)
+        if version != self.state_version:
+            self.state_version = version
+            self.js.set_value(self.state)
 
     def onscreen_keypress_event(self, key):
         self.keypress.emit(key)
@@ -57,6 +104,7 @@ class JoystickUI(QWidget):
         self.keyrelease.emit(key)
 
     def onscreen_keystate_set(self, **kwargs):
+        self.key_states.update(kwargs)
         self.keystate.emit(kwargs)
 
     def exit(self):
@@ -68,6 +116,33 @@ class JoystickUI(QWidget):
         return qApp
 
 
+class StatsOverlay(QLabel):
+    """Text overlay with the loop, HID output and latency statistics"""
+
+    def __init__(self, parent):
+        QLabel.__init__(self, parent)
+        self.setFont(QFont('Monospace', 10))
+        self.setStyleSheet('background-color: rgba(0, 0, 0, 160); color: white; padding: 4px')
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.move(0, 0)
+
+    def set_stats(self, stats):
+        loop = stats['loop']
+        lines = [f"loop    frames={loop['frames']} missed={loop['missed']} "
+                 f"jitter={loop['jitter_mean_us']:.0f}/{loop['jitter_max_us']:.0f}us"]
+        for name, channel in stats['writer'].items():
+            lines.append(f"{name:<10} written={channel['written']} dropped={channel['dropped']} "
+                         f"eagain={channel['eagain']} stalls={channel['stalls']}")
+        if stats['latency'] is not None:
+            for group in ('stages', 'devices'):
+                for name, histogram in stats['latency'][group].items():
+                    lines.append(f"{name:<14} p50={histogram['p50_us']:>7.0f}us p99={histogram['p99_us']:>7.0f}us "
+                                 f"max={histogram['max_us']:>7.0f}us")
+        self.setText('\n'.join(lines))
+        self.adjustSize()
+        self.raise_()
+
+
 class AnalogWidget(QWidget):
     def __init__(self):
         QWidget.__init__(self)
@@ -84,11 +159,12 @@ class AnalogWidget(QWidget):
 
         self.setLayout(self.main_layout)
 
-    def set_value(self, data):
-        self.joystick_left.set_value(data['JoyLeft'].x, data['JoyLeft'].y)
-        self.joystick_right.set_value(data['JoyRight'].x, data['JoyRight'].y)
-        self.trigger_left.set_value(data['TrigLeft'].x)
-        self.trigger_right.set_value(data['TrigRight'].x)
+    def set_value(self, state: controller_state.ControllerState):
+        analog = state.analog
+        self.joystick_left.set_value(analog[controller_state.JOY_LEFT], analog[controller_state.JOY_LEFT + 1])
+        self.joystick_right.set_value(analog[controller_state.JOY_RIGHT], analog[controller_state.JOY_RIGHT + 1])
+        self.trigger_left.set_value(analog[controller_state.TRIG_LEFT])
+        self.trigger_right.set_value(analog[controller_state.TRIG_RIGHT])
 
 
 class JoystickWidget(QWidget):
@@ -149,4 +225,5 @@ if __name__ == '__main__':
     app = QApplication([])
     ui = JoystickUI()
     ui.show()
+    ui.build_keyboard()
     app.exec()
@@ -0,0 +1,266 @@
+"""
+Compiled keyboard layout, shared by the on-screen keyboard and the emulator.
+
+keyboard.json is compiled once into Key objects with their HID usage code, modifier bit and all label variants, and
+the compiled layout is cached in binary form next to the user's other caches. KeyboardState is the modifier/latch state
+machine of the emulator: a key press or release is a table lookup and a bitmask or list update, and the report is
+built in one buffer, with the N-key rollover bitmap updated in place.
+"""
+import os
+import sys
+import json
+import pickle
+import struct
+import hashlib
+import functools
+from typing import Optional
+
+LAYOUT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'keyboard.json')
+CACHE_VERSION = 1
+
+# HID usage codes of the keyboard/keypad usage page
+_SYMBOLS = {'-': 0x2D, '=': 0x2E, '[': 0x2F, ']': 0x30, '\\': 0x31, ';': 0x33, '\'': 0x34, '`': 0x35, ',': 0x36, '.': 0x37,
+            '/': 0x38, ' ': 0x2C}
+_NAMED = {'RETURN': 0x28, 'ENTER': 0x28, 'ESCAPE': 0x29, 'BACKSPACE': 0x2A, 'TAB': 0x2B, 'SPACEBAR': 0x2C, 'SPACE': 0x2C,
+          'CAPSLOCK': 0x39, 'PRINTSCREEN': 0x46, 'SCROLLLOCK': 0x47, 'SCROLL_LOCK': 0x47, 'PAUSE': 0x48, 'INSERT': 0x49,
+          'HOME': 0x4A, 'PAGEUP': 0x4B, 'PAGE_UP': 0x4B, 'DELETE': 0x4C, 'DELETE_FORWARD': 0x4C, 'END': 0x4D,
+          'PAGEDOWN': 0x4E, 'PAGE_DOWN': 0x4E, 'ARROW_RIGHT': 0x4F, 'ARROW_LEFT': 0x50, 'ARROW_DOWN': 0x51,
+          'ARROW_UP': 0x52, 'NUMLOCK': 0x53, 'NUM_LOCK': 0x53, 'APPLICATION': 0x65, 'EXECUTE': 0x74, 'HELP': 0x75,
+          'MENU': 0x76, 'SELECT': 0x77}
+# Modifier keys are not in the key array of a report but bits of the modifier byte
+MODIFIERS = {'CONTROL_LEFT': 0x01, 'SHIFT_LEFT': 0x02, 'ALT_LEFT': 0x04, 'GUI_LEFT': 0x08,
+             'CONTROL_RIGHT': 0x10, 'SHIFT_RIGHT': 0x20, 'ALT_RIGHT': 0x40, 'GUI_RIGHT': 0x80}
+MODIFIER_GROUPS = {'control': 0x11, 'shift': 0x22, 'alt': 0x44, 'gui': 0x88}
+# Key types that latch: they stay pressed until another key is released
+LATCHING_TYPES = ('SHIFT', 'CONTROL', 'ALT', 'GUI', 'LATCHING')
+
+BOOT_REPORT = struct.Struct('<BB6B')
+
+
+def usage_code(name: str) -> Optional[int]:
+    """HID usage of a key name like 'A', '1', ';', 'F5', 'ENTER' or 'SHIFT_LEFT'"""
+    if name in MODIFIERS:
+        return 0xE0 + MODIFIERS[name].bit_length() - 1
+    if name in _NAMED:
+        return _NAMED[name]
+    if len(name) == 1:
+        if 'a' <= name.lower() <= 'z':
+            return 0x04 + ord(name.lower()) - ord('a')
+        if '1' <= name <= '9':
+            return 0x1E + ord(name) - ord('1')
+        if name == '0':
+            return 0x27
+        return _SYMBOLS.get(name)
+    if name[:1] in 'Ff' and name[1:].isdigit():
+        number = int(name[1:])
+        if 1 <= number <= 12:
+            return 0x3A + number - 1
+        if 13 <= number <= 24:
+            return 0x68 + number - 13
+    return None
+
+
+class Key:
+    """A compiled key of the layout"""
+    __slots__ = ('name', 'usage', 'modifier', 'type', 'width', 'row', 'labels', 'listens')
+
+    def __init__(self, name: str, type: Optional[str] = None, width: float = 1.0, row: int = 0, label: Optional[str] = None,
+                 shift: Optional[str] = None, **kwargs):
+        self.name = name
+        self.type = type or name
+        self.width = float(width)
+        self.row = row
+        self.usage = usage_code(name)
+        self.modifier = MODIFIERS.get(name, 0)
+        # The label for every combination of (shift, capslock)
+        self.labels = tuple(self._label(name, label, shift_label=shift, shift=s, capslock=c) for s in (False, True) for c in (False, True))
+        if self.type in LATCHING_TYPES:
+            self.listens = frozenset((self.type.lower(),))
+        elif self.type == 'CAPSLOCK':
+            self.listens = frozenset(('capslock',))
+        else:
+            listens = set()
+            if self.labels[0] != self.labels[2] or self.labels[1] != self.labels[3]:
+                listens.add('shift')
+            if self.labels[0] != self.labels[1] or self.labels[2] != self.labels[3]:
+                listens.add('capslock')
+            self.listens = frozenset(listens)
+
+    def _label(self, name, label, shift_label, shift, capslock) -> str:
+        if self.type == 'FUNCTION':
+            return name.upper()
+        if shift and shift_label is not None:
+            return shift_label
+        if label is not None:
+            return label
+        # Capslock and Shift work like XOR - if one of them is active, capitalize the letter
+        return name.upper() if shift != capslock else name.lower()
+
+    def label(self, shift: bool = False, capslock: bool = False) -> str:
+        return self.labels[2 * shift + capslock]
+
+    @property
+    def latching(self) -> bool:
+        return self.type in LATCHING_TYPES
+
+    def __repr__(self):
+        return f'<Key {self.name} usage={self.usage:#04x} type={self.type}>' if self.usage is not None else f'<Key {self.name}>'
+
+
+class Spacer:
+    __slots__ = ('width',)
+
+    def __init__(self, width: float = 1.0, **kwargs):
+        self.width = float(width)
+
+
+class KeyboardLayout:
+    """Rows of keys and spacers, and a lookup table of the keys by name"""
+
+    def __init__(self, rows: list[list]):
+        self.rows = []
+        self.keys: dict[str, Key] = {}
+        for i, row in enumerate(rows):
+            compiled = []
+            for key in row:
+                if isinstance(key, str):
+                    key = {'name': key}
+                if key.get('type') == 'spacer':
+                    compiled.append(Spacer(**key))
+                else:
+                    compiled.append(Key(row=i, **key))
+                    self.keys[key['name']] = compiled[-1]
+            self.rows.append(compiled)
+
+    def key(self, name: str) -> Key:
+        """The key with a name, also for keys that are not on the layout, like the ones a macro presses"""
+        key = self.keys.get(name)
+        if key is None:
+            key = self.keys[name] = Key(name)
+            if key.usage is None:
+                del self.keys[name]
+                raise KeyError(f'Unknown key {name}')
+        return key
+
+    @classmethod
+    def from_json(cls, path: str) -> 'KeyboardLayout':
+        with open(path, 'rt') as f:
+            return cls(json.load(f))
+
+
+def _cache_path(path: str) -> str:
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, 'gadget-deck', f'keyboard-{digest}.pickle')
+
+
+@functools.lru_cache(maxsize=None)
+def _load(path: str, mtime: int, size: int) -> KeyboardLayout:
+    cache = _cache_path(path)
+    stamp = (CACHE_VERSION, sys.version_info[:2], mtime, size)
+    try:
+        with open(cache, 'rb') as f:
+            cached_stamp, layout = pickle.load(f)
+        if cached_stamp == stamp:
+            return layout
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, TypeError):
+        pass
+    layout = KeyboardLayout.from_json(path)
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        with open(cache + '.tmp', 'wb') as f:
+            pickle.dump((stamp, layout), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(cache + '.tmp', cache)
+    except OSError:
+        pass
+    return layout
+
+
+def load(path: str = LAYOUT_FILE) -> KeyboardLayout:
+    """
+    The compiled layout of a keyboard.json. Within a process, every caller gets the same layout object; between
+    processes, the compiled layout is loaded from the binary cache as long as the json file did not change.
+    """
+    stat = os.stat(path)
+    return _load(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+class KeyboardState:
+    """
+    The pressed keys of the emulated keyboard, and the latching of the on-screen modifier keys: a modifier stays
+    pressed until the next key is released, then all held modifiers are released with it.
+
+    The report always starts with the 8 byte boot keyboard report. With `bitmap_offset`, the report continues with a
+    bitmap of `bitmap_usages` keys (N-key rollover, see keyboard_nkro.txt) that is updated in place on every press
+    and release. With `report_id` (a
+    composite HID function), the report is prefixed with its ID; `report_size` and `bitmap_offset` exclude it.
+    """
+
+    def __init__(self, key_count: int = 6, report_size: int = BOOT_REPORT.size, bitmap_offset: Optional[int] = None,
+                 bitmap_usages: int = 0, report_id: Optional[int] = None):
+        self.key_count = key_count
+        self.modifiers = 0
+        self.keys: list[int] = []
+        self.start = 0 if report_id is None else 1
+        self.buffer = bytearray(self.start + report_size)
+        if report_id is not None:
+            self.buffer[0] = report_id
+        self.bitmap_offset = None if bitmap_offset is None else self.start + bitmap_offset
+        self.bitmap_usages = bitmap_usages if bitmap_offset is not None else 0
+
+    @property
+    def nkro(self) -> bool:
+        return self.bitmap_usages > 0
+
+    def _set_bit(self, usage: int, pressed: bool):
+        if usage < self.bitmap_usages:
+            if pressed:
+                self.buffer[self.bitmap_offset + (usage >> 3)] |= 1 << (usage & 7)
+            else:
+                self.buffer[self.bitmap_offset + (usage >> 3)] &= ~(1 << (usage & 7)) & 0xFF
+
+    def press(self, key: Key) -> int:
+        """Press a key, returns the modifier bits that were pressed"""
+        if key.modifier:
+            pressed = key.modifier & ~self.modifiers
+            self.modifiers |= key.modifier
+            return pressed
+        if key.usage not in self.keys:
+            self.keys.append(key.usage)
+            self._set_bit(key.usage, True)
+        return 0
+
+    def release(self, key: Key, latched: bool = True) -> int:
+        """
+        Release a key and every held modifier, returns the modifier bits that were released.
+        Without `latched`, only the key itself is released, like on a physical keyboard.
+        """
+        released = self.modifiers if latched else self.modifiers & key.modifier
+        self.modifiers &= ~released
+        if not key.modifier and key.usage in self.keys:
+            self.keys.remove(key.usage)
+            self._set_bit(key.usage, False)
+        return released
+
+    def is_pressed(self, key: Key) -> bool:
+        return bool(self.modifiers & key.modifier) if key.modifier else key.usage in self.keys
+
+    def reset(self):
+        self.modifiers = 0
+        self.keys.clear()
+        self.buffer[self.start:] = bytes(len(self.buffer) - self.start)
+
+    def report(self) -> bytes:
+        """Boot protocol report: modifiers, reserved byte and up to 6 keys, followed by the key bitmap if any"""
+        keys = self.keys[:6]
+        if len(self.keys) > 6 and not self.bitmap_usages:
+            # Too many keys for the report, like a real boot keyboard report an error roll-over. With the bitmap, the
+            # array keeps the first 6 keys: hosts take a roll-over as an invalid report and would ignore the bitmap too.
+            keys = [0x01] * 6
+        BOOT_REPORT.pack_into(self.buffer, self.start, self.modifiers, 0, *keys, *(0,) * (6 - len(keys)))
+        return bytes(self.buffer)
+
+    @staticmethod
+    def groups(modifiers: int) -> list[str]:
+        """Names of the modifier groups ('shift', 'control', ...) with a bit in `modifiers`"""
+        return [group for group, mask in MODIFIER_GROUPS.items() if modifiers & mask]
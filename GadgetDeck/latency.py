@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import threading
+from array import array
+from typing import Callable
+
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram, in the style of HdrHistogram.
+
+    Every power of two is split into 2**SUB_BITS buckets, so any recorded value is reported with a relative error
+    below 1/2**SUB_BITS (about 3%). Recording is an index computation and an array increment, without allocations.
+    Values are in nanoseconds, anything above 2**MAX_BITS ns (about 17s) is clamped.
+    """
+    SUB_BITS = 5
+    MAX_BITS = 34
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * ((self.MAX_BITS - self.SUB_BITS + 1) << self.SUB_BITS)))
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def bucket(cls, value: int) -> int:
+        shift = value.bit_length() - cls.SUB_BITS - 1
+        if shift < 0:
+            return value
+        return ((shift + 1) << cls.SUB_BITS) + (value >> shift) - (1 << cls.SUB_BITS)
+
+    @classmethod
+    def bucket_value(cls, index: int) -> int:
+        """Highest value that falls in a bucket"""
+        shift = (index >> cls.SUB_BITS) - 1
+        if shift < 0:
+            return index
+        mantissa = (index & ((1 << cls.SUB_BITS) - 1)) + (1 << cls.SUB_BITS)
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        index = self.bucket(value)
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'LatencyHistogram'):
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.total = 0
+        self.max = 0
+
+    def percentile(self, percent: float) -> int:
+        if not self.total:
+            return 0
+        target = max(1, round(self.total * percent / 100))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.bucket_value(i), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.total,
+                'p50_us': self.percentile(50) / 1000,
+                'p99_us': self.percentile(99) / 1000,
+                'max_us': self.max / 1000}
+
+
+class RollingHistogram:
+    """
+    Histogram over the last one to two `window` seconds.
+    Two histograms are kept; when the current one is older than the window, the previous one is recycled.
+    """
+
+    def __init__(self, window: float = 10.0):
+        self.window = int(window * 1e9)
+        self.current = LatencyHistogram()
+        self.previous = LatencyHistogram()
+        self.started = time.monotonic_ns()
+
+    def record(self, value: int, now: int):
+        if now - self.started >= self.window:
+            self.previous, self.current = self.current, self.previous
+            self.current.reset()
+            self.started = now
+        self.current.record(value)
+
+    def snapshot(self) -> LatencyHistogram:
+        histogram = LatencyHistogram()
+        histogram.merge(self.previous)
+        histogram.merge(self.current)
+        return histogram
+
+    def to_dict(self):
+        return self.snapshot().to_dict()
+
+
+class LatencyMonitor:
+    """
+    Latency of the stages of the input path, and end-to-end latency per HID device.
+
+    The input loop timestamps a frame when it calls RunFrame(), and the stages after it with stage(). The HID writer
+    calls record() when a report of that frame has been written to the device.
+    """
+    STAGES = ('run_frame', 'read_actions', 'build_reports')
+
+    def __init__(self, window: float = 10.0):
+        self.window = window
+        self.stages = {stage: RollingHistogram(window) for stage in self.STAGES}
+        self.devices: dict[str, RollingHistogram] = {}
+        self.lock = threading.Lock()
+
+    def stage(self, name: str, start: int) -> int:
+        """Record the time since `start` for a stage, return the current time as the start of the next stage"""
+        now = time.monotonic_ns()
+        self.stages[name].record(now - start, now)
+        return now
+
+    def record(self, device: str, frame_start: int):
+        """Record the time from the start of a frame until its report was written to a device"""
+        now = time.monotonic_ns()
+        histogram = self.devices.get(device)
+        if histogram is None:
+            with self.lock:
+                histogram = self.devices.setdefault(device, RollingHistogram(self.window))
+        histogram.record(now - frame_start, now)
+
+    def to_dict(self):
+        return {'stages': {name: histogram.to_dict() for name, histogram in self.stages.items()},
+                'devices': {name: histogram.to_dict() for name, histogram in list(self.devices.items())}}
+
+
+class ProcessUsage:
+    """Memory and CPU use of this process, to compare the headless mode with the UI"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def rss(self) -> int:
+        """Resident memory in bytes"""
+        try:
+            with open('/proc/self/statm', 'rt') as f:
+                return int(f.read().split()[1]) * self.page_size
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    def to_dict(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = usage.ru_utime + usage.ru_stime
+        elapsed = time.monotonic() - self.started
+        return {'rss_mb': self.rss() / 2**20,
+                'max_rss_mb': usage.ru_maxrss / 1024,
+                'cpu_s': cpu,
+                'cpu_percent': 100 * cpu / elapsed if elapsed else 0.0,
+                'threads': threading.active_count()}
+
+
+class StatsServer(threading.Thread):
+    """Serve a JSON dump of the statistics to every client that connects to a Unix socket"""
+
+    def __init__(self, path: str, provider: Callable[[], dict]):
+        threading.Thread.__init__(self, name='StatsServer', daemon=True)
+        self.path = path
+        self.provider = provider
+        if os.path.exists(path):
+            os.unlink(path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen()
+
+    def run(self):
+        while True:
+            connection, _ = self.socket.accept()
+            with connection:
+                try:
+                    connection.sendall(json.dumps(self.provider()).encode() + b'\n')
+                except OSError:
+                    pass
+
+
+def read_stats(path: str) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        data = b''
+        while chunk := client.recv(65536):
+            data += chunk
+    return json.loads(data)
+
+
+if __name__ == '__main__':
+    # Print the statistics of a running GadgetDeck, started with --stats-socket
+    print(json.dumps(read_stats(sys.argv[1] if len(sys.argv) > 1 else '/tmp/gadget-deck-stats.sock'), indent=2))
@@ -0,0 +1,162 @@
+"""
+Key chords, sequences and timed macros on Steam Input digital actions, configured in a JSON file:
+
+    {
+        "BackLeftTop": "CONTROL_LEFT+C",
+        "BackLeftBottom": ["CONTROL_LEFT+C", "CONTROL_LEFT+V"],
+        "BackRightTop": {"steps": ["G", 500, "G", {"press": "SHIFT_LEFT"}, 100, {"release": "SHIFT_LEFT"}],
+                         "tap": 30, "gap": 30},
+        "BackRightBottom": {"profile": "precision"}
+    }
+
+A chord is held as long as the action is held. A list of chords is a sequence: every chord is tapped once, in order.
+In the steps of a timed macro, numbers are pauses in milliseconds; `tap` and `gap` are the time a chord is held and
+the time between two chords. A profile macro switches to another response curve profile (see response_curve.py).
+
+Macros are compiled once into steps: (time offset, press or release, keys), or (0, None, profile name). Every frame, MacroEngine.update() looks
+for edges on the digital bitmask of the bound actions and runs the steps that are due. Without an edge or a pending
+step, update() is a mask comparison, and without any macros the emulator does not create an engine at all.
+"""
+import os
+import sys
+import json
+import heapq
+from typing import Callable, Optional
+
+try:
+    import controller_state
+    import keyboard_layout
+except ImportError:
+    sys.path.append(os.path.dirname(__file__))
+    import controller_state
+    import keyboard_layout
+
+TAP = 20        # Default time a key of a sequence is held, in milliseconds
+GAP = 20        # Default time between two keys of a sequence
+
+
+def default_path() -> str:
+    config_dir = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(config_dir, 'gadget-deck', 'macros.json')
+
+
+class Macro:
+    """The steps of one action: on_press runs when the action is pressed, on_release when it is released"""
+    __slots__ = ('action', 'on_press', 'on_release')
+
+    def __init__(self, action: str, on_press: list[tuple], on_release: list[tuple] = ()):
+        self.action = action
+        self.on_press = tuple(on_press)
+        self.on_release = tuple(on_release)
+
+    @classmethod
+    def compile(cls, action: str, definition, layout: keyboard_layout.KeyboardLayout) -> 'Macro':
+        def chord(text: str) -> tuple:
+            try:
+                return tuple(layout.key(name.strip()) for name in text.split('+'))
+            except KeyError as e:
+                raise ValueError(f'Macro {action}: {e.args[0]}') from None
+
+        if isinstance(definition, str):
+            keys = chord(definition)
+            return cls(action, [(0, True, keys)], [(0, False, keys)])
+        if isinstance(definition, dict) and isinstance(definition.get('profile'), str):
+            return cls(action, [(0, None, definition['profile'])])
+        if isinstance(definition, list):
+            definition = {'steps': definition}
+        if not isinstance(definition, dict) or not isinstance(definition.get('steps'), list):
+            raise ValueError(f'Macro {action}: expected a chord, a list of chords, {{"steps": [...]}} or {{"profile": ...}}')
+        tap = int(definition.get('tap', TAP) * 1e6)
+        gap = int(definition.get('gap', GAP) * 1e6)
+        steps = []
+        at = 0
+        for step in definition['steps']:
+            if isinstance(step, (int, float)):
+                at += int(step * 1e6)
+            elif isinstance(step, str):
+                keys = chord(step)
+                steps.append((at, True, keys))
+                steps.append((at + tap, False, keys))
+                at += tap + gap
+            elif isinstance(step, dict) and len(step) == 1 and ('press' in step or 'release' in step):
+                steps.append((at, 'press' in step, chord(step.get('press') or step.get('release'))))
+            else:
+                raise ValueError(f'Macro {action}: invalid step {step!r}')
+        return cls(action, steps)
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self.action} steps={len(self.on_press) + len(self.on_release)}>'
+
+
+class MacroEngine:
+    """
+    Run the macros of the digital actions of one controller.
+
+    `press` and `release` are called with a tuple of Keys, see JoystickEmulator.press_keys()/release_keys(), and
+    `select_profile` with the name of a response curve profile. Timed steps are kept in a heap ordered by their due time.
+    """
+
+    def __init__(self, macros: dict[int, Macro], press: Callable[[tuple], object], release: Callable[[tuple], object],
+                 select_profile: Optional[Callable[[str], object]] = None):
+        self.macros = macros            # Bit in ControllerState.digital: Macro
+        self.mask = 0
+        for bit in macros:
+            self.mask |= 1 << bit
+        self.press = press
+        self.release = release
+        self.select_profile = select_profile
+        self.previous = 0
+        self.pending: list[tuple] = []
+        self.sequence = 0               # Tie breaker of steps that are due at the same time, keeps them in order
+        self.triggered = 0
+        self.steps = 0
+
+    def update(self, digital: int, now: int):
+        """Handle the digital actions of a frame, `now` is the monotonic time of the frame in nanoseconds"""
+        changed = (digital ^ self.previous) & self.mask
+        if changed:
+            self.previous = digital & self.mask
+            for bit, macro in self.macros.items():
+                if changed >> bit & 1:
+                    pressed = digital >> bit & 1
+                    self.triggered += pressed
+                    self.schedule(macro.on_press if pressed else macro.on_release, now)
+        pending = self.pending
+        while pending and pending[0][0] <= now:
+            due, sequence, press, keys = heapq.heappop(pending)
+            if press is None:
+                if self.select_profile is not None:
+                    self.select_profile(keys)
+            else:
+                (self.press if press else self.release)(keys)
+            self.steps += 1
+
+    def schedule(self, steps: tuple, now: int):
+        for offset, press, keys in steps:
+            self.sequence += 1
+            heapq.heappush(self.pending, (now + offset, self.sequence, press, keys))
+
+    def cancel(self):
+        """Drop all pending steps and release every key a macro could hold"""
+        self.pending.clear()
+        self.previous = 0
+        for macro in self.macros.values():
+            for offset, press, keys in macro.on_press + macro.on_release:
+                if press:
+                    self.release(keys)
+
+    def to_dict(self):
+        return {'macros': len(self.macros), 'triggered': self.triggered, 'steps': self.steps, 'pending': len(self.pending)}
+
+
+def load(path: str, layout: keyboard_layout.KeyboardLayout, press: Callable, release: Callable,
+         select_profile: Optional[Callable] = None) -> Optional[MacroEngine]:
+    """The engine of a macro file, or None if the file has no macros"""
+    with open(path, 'rt') as f:
+        config = json.load(f)
+    macros = {}
+    for action, definition in config.items():
+        if action not in controller_state.DIGITAL_ACTIONS:
+            raise ValueError(f'Macro {action}: unknown digital action, use one of {", ".join(controller_state.DIGITAL_ACTIONS)}')
+        macros[controller_state.DIGITAL_ACTIONS.index(action)] = Macro.compile(action, definition, layout)
+    return MacroEngine(macros, press, release, select_profile) if macros else None
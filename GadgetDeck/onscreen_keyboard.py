@@ -1,17 +1,66 @@
 from PyQt5.QtCore import Qt, pyqtSignal, QRect
-from PyQt5.QtGui import QPainter, QBrush, QPen, QFont
+from PyQt5.QtGui import QPainter, QBrush, QPen, QFont, QPixmap
 from PyQt5.QtWidgets import QWidget, QApplication, QHBoxLayout, QVBoxLayout, QSpacerItem
 
+import keyboard_layout
+
+
+class GlyphCache:
+    """
+    Prerendered key pixmaps by (label, pressed, width, height). A repaint of a key is a single pixmap blit, the text is
+    only laid out once per label and size. The cache is cleared when the keyboard is resized.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.glyphs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, label: str, pressed: bool, width: int, height: int) -> QPixmap:
+        key = (label, pressed, width, height)
+        glyph = self.glyphs.get(key)
+        if glyph is not None:
+            self.hits += 1
+            return glyph
+        self.misses += 1
+        if len(self.glyphs) >= self.max_size:
+            # Dicts keep insertion order, drop the oldest half
+            for old in list(self.glyphs)[:self.max_size // 2]:
+                del self.glyphs[old]
+        glyph = self.glyphs[key] = self.render(label, pressed, width, height)
+        return glyph
+
+    @staticmethod
+    def render(label: str, pressed: bool, width: int, height: int) -> QPixmap:
+        glyph = QPixmap(max(width, 1), max(height, 1))
+        glyph.fill(Qt.transparent)
+        painter = QPainter(glyph)
+        painter.setBrush(QBrush(Qt.gray if pressed else Qt.black))
+        rect = QRect(3, 3, width - 6, height - 6)
+        painter.drawRect(rect)
+        painter.setPen(QPen(Qt.white))
+        painter.setFont(QFont('Arial', max(height // 2, 1)))
+        painter.drawText(rect, Qt.AlignCenter, label)
+        painter.end()
+        return glyph
+
+    def clear(self):
+        self.glyphs.clear()
+
+
+glyph_cache = GlyphCache()
+
 
 class Keyboard(QWidget):
     keypress = pyqtSignal(str)
     keyrelease = pyqtSignal(str)
 
-    def __init__(self, keys):
+    def __init__(self, layout: keyboard_layout.KeyboardLayout):
         QWidget.__init__(self)
         self.setLayout(QVBoxLayout())
         self.rows = []
-        for i,row in enumerate(keys):
+        for i,row in enumerate(layout.rows):
             widget = KeyboardRow(row)
             widget.keypress.connect(self.onscreen_keypress_event)
             widget.keyrelease.connect(self.onscreen_keyrelease_event)
@@ -20,6 +69,12 @@ class Keyboard(QWidget):
             self.layout().setStretch(i, 1)
         self.layout().setContentsMargins(0,0,0,0)
         self.layout().setSpacing(0)
+        # Only the keys that show a state get to hear about it
+        self.listeners = {}
+        for row in self.rows:
+            for key in row.keys:
+                for state in key.layout_key.listens:
+                    self.listeners.setdefault(state, []).append(key)
 
     def onscreen_keypress_event(self, key):
         self.keypress.emit(key)
@@ -28,32 +83,32 @@ class Keyboard(QWidget):
         self.keyrelease.emit(key)
 
     def set_key_state(self, kwargs):
-        for widget in self.rows:
-            widget.set_key_state(**kwargs)
+        keys = {key for state in kwargs for key in self.listeners.get(state, ())}
+        for key in keys:
+            key.set_key_state(**kwargs)
+
+    def resizeEvent(self, a0) -> None:
+        glyph_cache.clear()
 
 
 class KeyboardRow(QWidget):
     keypress = pyqtSignal(str)
     keyrelease = pyqtSignal(str)
 
-    def __init__(self, keys):
+    def __init__(self, keys: list):
         QWidget.__init__(self)
         self.setLayout(QHBoxLayout())
         self.keys = []
         for i,key in enumerate(keys):
-            if isinstance(key, str):
-                key = {'name': key}
-            if 'width' not in key:
-                key['width'] = 1.0
-            if key.get('type', None) == 'spacer':
+            if isinstance(key, keyboard_layout.Spacer):
                 btn = QWidget()
             else:
-                btn = KeyboardKey(**key)
+                btn = KeyboardKey.create(key)
                 btn.keypress.connect(self.onscreen_keypress_event)
                 btn.keyrelease.connect(self.onscreen_keyrelease_event)
                 self.keys.append(btn)
             self.layout().addWidget(btn)
-            self.layout().setStretch(i, int(key['width']*10))
+            self.layout().setStretch(i, int(key.width*10))
 
         self.layout().setContentsMargins(0, 0, 0, 0)
         self.layout().setSpacing(0)
@@ -75,36 +130,28 @@ class KeyboardKey(QWidget):
 
     key_type = ''
     _subclasses = {}
-    def __new__(cls, name, *args, **kwargs):
-        if cls is KeyboardKey:
-            keytype = kwargs.get('type', name)
-            if keytype in KeyboardKey._subclasses:
-                cls = KeyboardKey._subclasses[keytype]
-            return super().__new__(cls)
 
     def __init_subclass__(cls, key=None):
         if key is not None:
             KeyboardKey._subclasses[key] = cls
             cls.key_type = key
 
-    def __init__(self, name: str, **kwargs):
+    @staticmethod
+    def create(key: keyboard_layout.Key) -> 'KeyboardKey':
+        """The key widget for the type of a layout key"""
+        return KeyboardKey._subclasses.get(key.type, KeyboardKey)(key)
+
+    def __init__(self, key: keyboard_layout.Key):
         QWidget.__init__(self)
-        self.key = name
-        self.kwargs = kwargs
-        self.font = QFont('Arial', 15)
-        self.key_states = {'capslock': False, 'shift': False, 'numlock': False, 'scrolllock': False}
+        self.layout_key = key
+        self.key = key.name
+        self.shift = False
+        self.capslock = False
         self.pressed = False
 
     @property
     def label(self):
-        if self.key_states['shift'] and self.kwargs.get('shift') is not None:
-            return self.kwargs['shift']
-        if self.kwargs.get('label') is not None:
-            return self.kwargs['label']
-        label = self.key
-        # Capslock and Shift work like XOR - if one of them is active, capitalize the letter
-        capitalized = self.key_states['shift'] != self.key_states['capslock']
-        return label.upper() if capitalized else label.lower()
+        return self.layout_key.label(self.shift, self.capslock)
 
     def mousePressEvent(self, a0) -> None:
         self.keypress.emit(self.key)
@@ -118,22 +165,16 @@ class KeyboardKey(QWidget):
 
     def paintEvent(self, a0) -> None:
         painter = QPainter(self)
-        if self.pressed:
-            painter.setBrush(QBrush(Qt.gray))
-        else:
-            painter.setBrush(QBrush(Qt.black))
-        rect = QRect(3, 3, self.width()-6, self.height()-6)
-        painter.drawRect(rect)
-        painter.setPen(QPen(Qt.white))
-        painter.setFont(self.font)
-        painter.drawText(rect, Qt.AlignCenter, self.label)
-
-    def resizeEvent(self, a0) -> None:
-        self.font = QFont('Arial', self.height() // 2)
+        painter.drawPixmap(0, 0, glyph_cache.get(self.label, self.pressed, self.width(), self.height()))
 
-    def set_key_state(self, **kwargs):
-        self.key_states.update(kwargs)
-        self.update()
+    def set_key_state(self, shift=None, capslock=None, **kwargs):
+        label = self.label
+        if shift is not None:
+            self.shift = shift
+        if capslock is not None:
+            self.capslock = capslock
+        if self.label != label:
+            self.update()
 
 
 class CapslockKey(KeyboardKey, key='CAPSLOCK'):
@@ -144,7 +185,7 @@ class CapslockKey(KeyboardKey, key='CAPSLOCK'):
         self.keyrelease.emit(self.key)
 
     def set_key_state(self, capslock=None, **kwargs):
-        if capslock is not None:
+        if capslock is not None and capslock != self.pressed:
             self.pressed = capslock
             self.update()
 
@@ -160,8 +201,9 @@ class LatchingKey(KeyboardKey, key='LATCHING'):
         pass
 
     def set_key_state(self, **kwargs):
-        if self.key_type.lower() in kwargs:
-            self.pressed = kwargs[self.key_type.lower()]
+        pressed = kwargs.get(self.key_type.lower())
+        if pressed is not None and pressed != self.pressed:
+            self.pressed = pressed
             self.update()
 
 
@@ -181,17 +223,9 @@ class GuiKey(LatchingKey, key='GUI'):
     ...
 
 
-class FunctionKey(KeyboardKey, key='FUNCTION'):
-    @property
-    def label(self):
-        return self.key.upper()
-
 if __name__ == '__main__':
-    import json
     app = QApplication([])
-    with open('keyboard.json') as f:
-        keys = json.load(f)
-    key = Keyboard(keys)
+    key = Keyboard(keyboard_layout.load())
     key.keypress.connect(print)
     key.show()
     app.exec()
@@ -0,0 +1,231 @@
+"""
+Record the controller state of every frame to a compact binary log, and replay it.
+
+A log is a 32 byte header followed by fixed-size frames:
+    header: magic 'GDREC', version (u8), analog float count (u16), frame size (u16), start time (i64, ns), reserved
+    frame:  time since start (i64, ns), controller index (u8), 3 pad bytes, digital bitmask (u32), analog (f32 * n)
+All values are little-endian. Frames are only ever appended, so a log that was cut short is still readable up to the
+last complete frame.
+
+    python GadgetDeck/recording.py info LOG
+    python GadgetDeck/recording.py replay LOG [--speed 2 | --fast] [--sink DIR]
+"""
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+from typing import Callable, Optional
+
+try:
+    import controller_state
+    import simulation
+except ImportError:
+    sys.path.append(os.path.dirname(__file__))
+    import controller_state
+    import simulation
+
+MAGIC = b'GDREC'
+VERSION = 1
+HEADER = struct.Struct('<5sBHHq14x')
+FRAME_HEADER = struct.Struct('<qB3xI')
+
+
+def frame_struct(analog_count: int) -> struct.Struct:
+    return struct.Struct(f'<qB3xI{analog_count}f')
+
+
+class Recorder:
+    """
+    Append controller states to a log file.
+
+    Frames are packed into a preallocated buffer which is written out once it is full, so recording a frame costs a
+    pack_into() and a buffer copy, and a write() syscall only every `buffer_frames` frames.
+    """
+
+    def __init__(self, path: str, analog_count: int = 2 * len(controller_state.ANALOG_ACTIONS), buffer_frames: int = 256):
+        self.analog_count = analog_count
+        self.analog_bytes = 4 * analog_count
+        self.frame_size = FRAME_HEADER.size + self.analog_bytes
+        self.start = time.monotonic_ns()
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, analog_count, self.frame_size, self.start))
+        self.buffer = bytearray(self.frame_size * buffer_frames)
+        self.offset = 0
+        self.frames = 0
+
+    def write(self, index: int, state: controller_state.ControllerState, timestamp: int):
+        """Record the state of controller `index` at `timestamp` (time.monotonic_ns())"""
+        offset = self.offset
+        FRAME_HEADER.pack_into(self.buffer, offset, timestamp - self.start, index, state.digital & 0xFFFFFFFF)
+        offset += FRAME_HEADER.size
+        # The analog array is float32 in native byte order, which is little-endian on the Deck
+        self.buffer[offset:offset + self.analog_bytes] = state.analog
+        self.offset = offset + self.analog_bytes
+        self.frames += 1
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.offset:
+            self.file.write(memoryview(self.buffer)[:self.offset])
+            self.offset = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class Recording:
+    """
+    Memory-mapped, read-only view of a log. Frames are decoded straight from the mapping, without reading the file.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.analog_count, self.frame_size, self.start = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a GadgetDeck recording')
+        self.frame = frame_struct(self.analog_count)
+        if self.frame.size != self.frame_size:
+            raise ValueError(f'{path}: unexpected frame size {self.frame_size}')
+        self.frames = (len(self.mmap) - HEADER.size) // self.frame_size
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, i: int) -> tuple:
+        """(time since start, controller index, digital bitmask, *analog values) of frame i"""
+        if not 0 <= i < self.frames:
+            raise IndexError(i)
+        return self.frame.unpack_from(self.mmap, HEADER.size + i * self.frame_size)
+
+    def __iter__(self):
+        view = memoryview(self.mmap)[HEADER.size:HEADER.size + self.frames * self.frame_size]
+        try:
+            yield from self.frame.iter_unpack(view)
+        finally:
+            view.release()
+
+    @property
+    def duration(self) -> float:
+        """Length of the recording in seconds"""
+        return self[self.frames - 1][0] / 1e9 if self.frames else 0.0
+
+    @property
+    def controllers(self) -> int:
+        return max((frame[1] for frame in self), default=-1) + 1
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+class ReplayInput(simulation.SimulatedInput):
+    """
+    Steam Input stand-in that plays back a recording.
+
+    With a `speed`, every RunFrame() applies all recorded frames up to the elapsed time multiplied by the speed, so
+    the original timing is kept regardless of the loop rate. Without a speed, every RunFrame() applies the next
+    recorded frame of every controller, to replay as fast as the emulator loop runs. `on_finished` is called once the end is reached.
+    """
+
+    def __init__(self, recording: Recording, speed: Optional[float] = 1.0, on_finished: Optional[Callable] = None):
+        simulation.SimulatedInput.__init__(self, max(1, recording.controllers), script=None)
+        self.recording = recording
+        self.speed = speed
+        self.on_finished = on_finished
+        self.position = 0
+        self.started = None
+        self.finished = False
+
+    def RunFrame(self):
+        self.frame += 1
+        recording = self.recording
+        if self.position >= len(recording):
+            if not self.finished:
+                self.finished = True
+                if self.on_finished is not None:
+                    self.on_finished()
+            return
+        if self.speed is None:
+            # Apply the next recorded frame of every controller
+            timestamp = recording[self.position][0]
+            while self.position < len(recording):
+                frame = recording[self.position]
+                if frame[0] != timestamp:
+                    break
+                self._apply(frame)
+                self.position += 1
+            return
+        if self.started is None:
+            self.started = time.monotonic_ns()
+        until = (time.monotonic_ns() - self.started) * self.speed
+        while self.position < len(recording):
+            frame = recording[self.position]
+            if frame[0] > until:
+                break
+            self._apply(frame)
+            self.position += 1
+
+    def _apply(self, frame):
+        controller = self.controllers[frame[1]]
+        digital = frame[2]
+        for i, data in enumerate(self.digital[controller]):
+            data.bState = bool(digital >> i & 1)
+        # Recordings from before an analog action was added have fewer values
+        analog = self.analog[controller][:self.recording.analog_count // 2]
+        for i, data in enumerate(analog):
+            data.x = frame[3 + 2 * i]
+            data.y = frame[4 + 2 * i]
+
+
+def main():
+    parser = argparse.ArgumentParser('GadgetDeck recording')
+    action = parser.add_subparsers(dest='action', required=True)
+    info_parser = action.add_parser('info')
+    info_parser.add_argument('log')
+    replay_parser = action.add_parser('replay')
+    replay_parser.add_argument('log')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='Playback speed (default: %(default)s)')
+    replay_parser.add_argument('--fast', action='store_true', help='Replay one recorded frame per loop, as fast as possible')
+    replay_parser.add_argument('--rate', type=float, default=1000, help='Loop rate for timed replay (default: %(default)s)')
+    replay_parser.add_argument('--sink', help='Write the reports to files in this directory instead of the USB gadget')
+    args = parser.parse_args()
+
+    recording = Recording(args.log)
+    if args.action == 'info':
+        print(f'frames       {len(recording)}')
+        print(f'controllers  {recording.controllers}')
+        print(f'duration     {recording.duration:.3f}s')
+        return
+
+    import emulator
+    if args.sink:
+        os.makedirs(args.sink, exist_ok=True)
+        names = [f'joystick{i}' for i in range(max(1, recording.controllers))] + ['mouse']
+        sink = simulation.FakeHIDSink(names, directory=args.sink)
+        devices = sink.devices
+        descriptors = None
+    else:
+        devices = emulator.find_devices()
+        descriptors = emulator.find_descriptors()
+    replay = ReplayInput(recording, None if args.fast else args.speed)
+    joystick_emulator = emulator.JoystickEmulator(replay, devices, rate=None if args.fast else args.rate, descriptors=descriptors)
+
+    def finished():
+        joystick_emulator.running = False
+    replay.on_finished = finished
+    joystick_emulator.writer.start()
+    start = time.perf_counter()
+    joystick_emulator.run()
+    elapsed = time.perf_counter() - start
+    joystick_emulator.stop()
+    print(f'Replayed {len(recording)} frames ({recording.duration:.3f}s) in {elapsed:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
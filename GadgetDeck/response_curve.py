@@ -0,0 +1,163 @@
+"""
+Response curves of the sticks and triggers: calibration, deadzones, anti-deadzone and curves, configured as named
+profiles in a JSON file:
+
+    {
+        "default": {"sticks": {"deadzone": 0.08}, "triggers": {"deadzone": 0.02}},
+        "precision": {"sticks": {"deadzone": 0.08, "curve": "exponential", "exponent": 2.0},
+                      "JoyRight": {"center": [0.01, -0.02], "scale": [1.0, 1.05]}},
+        "custom": {"sticks": {"deadzone_type": "axial", "curve": "points", "points": [[0.5, 0.25], [0.8, 0.7]]}}
+    }
+
+"sticks" and "triggers" apply to both sticks or triggers, a section named after an analog action (JoyLeft, JoyRight,
+TrigLeft, TrigRight) overrides them for one. Settings:
+    center, scale       calibration, applied to the raw value first (a pair of x, y values for a stick)
+    deadzone            inputs up to this magnitude are 0; 'deadzone_type' is 'radial' (default) or 'axial'
+    outer_deadzone      inputs from this magnitude on are full scale (default 1.0)
+    curve               'linear' (default), 'exponential' (with 'exponent') or 'points' (with 'points', a list of
+                        [input, output] pairs of a piecewise linear curve from (0, 0) to (1, 1))
+    anti_deadzone       the smallest output outside the deadzone, to skip the deadzone of the game
+
+A profile is compiled into lookup tables from the quantized input to the output range of the report descriptor, a 2D
+table per stick (a radial deadzone depends on both axes) and a 1D table per trigger. Per frame, an axis is a table
+index; switching profiles swaps the tables, which are compiled in advance (about 0.1s per stick curve).
+"""
+import os
+import json
+import math
+from array import array
+from typing import Optional
+
+STICKS = ('JoyLeft', 'JoyRight')
+TRIGGERS = ('TrigLeft', 'TrigRight')
+# Input steps per direction of the lookup tables: a stick table has (2 * steps + 1)² entries
+STICK_STEPS = 128
+TRIGGER_STEPS = 1024
+
+DEFAULTS = {'center': 0.0, 'scale': 1.0, 'deadzone': 0.0, 'deadzone_type': 'radial', 'outer_deadzone': 1.0,
+            'curve': 'linear', 'exponent': 2.0, 'points': (), 'anti_deadzone': 0.0}
+
+
+def default_path() -> str:
+    config_dir = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(config_dir, 'gadget-deck', 'profiles.json')
+
+
+class Curve:
+    """The settings of one stick or trigger"""
+
+    def __init__(self, action: str, **settings):
+        unknown = set(settings) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f'{action}: unknown settings {", ".join(sorted(unknown))}')
+        settings = {**DEFAULTS, **settings}
+        self.action = action
+        pair = (lambda value: tuple(value) if isinstance(value, (list, tuple)) else (value, value))
+        self.center = pair(settings['center'])
+        self.scale = pair(settings['scale'])
+        self.deadzone = float(settings['deadzone'])
+        self.outer_deadzone = float(settings['outer_deadzone'])
+        self.radial = settings['deadzone_type'] == 'radial'
+        self.anti_deadzone = float(settings['anti_deadzone'])
+        self.exponent = float(settings['exponent'])
+        self.curve = settings['curve']
+        if settings['deadzone_type'] not in ('radial', 'axial'):
+            raise ValueError(f'{action}: deadzone_type must be radial or axial')
+        if self.curve not in ('linear', 'exponential', 'points'):
+            raise ValueError(f'{action}: curve must be linear, exponential or points')
+        if not 0.0 <= self.deadzone < self.outer_deadzone:
+            raise ValueError(f'{action}: the deadzone must be smaller than the outer deadzone')
+        self.points = [(0.0, 0.0)] + sorted((float(x), float(y)) for x, y in settings['points']) + [(1.0, 1.0)]
+        # Curves with the same settings share their lookup tables
+        self.key = (self.center, self.scale, self.deadzone, self.outer_deadzone, self.radial, self.anti_deadzone,
+                    self.exponent if self.curve == 'exponential' else None, self.curve, tuple(self.points))
+
+    def shape(self, magnitude: float) -> float:
+        """Output magnitude (0...1) of an input magnitude"""
+        if magnitude <= self.deadzone:
+            return 0.0
+        value = min((magnitude - self.deadzone) / (self.outer_deadzone - self.deadzone), 1.0)
+        if self.curve == 'exponential':
+            value = value ** self.exponent
+        elif self.curve == 'points':
+            for (x0, y0), (x1, y1) in zip(self.points, self.points[1:]):
+                if value <= x1:
+                    value = y0 + (y1 - y0) * (value - x0) / (x1 - x0) if x1 > x0 else y1
+                    break
+        return self.anti_deadzone + (1.0 - self.anti_deadzone) * value
+
+    def stick(self, x: float, y: float) -> tuple[float, float]:
+        """Output (-1...1) of a stick position"""
+        x = (x - self.center[0]) * self.scale[0]
+        y = (y - self.center[1]) * self.scale[1]
+        if self.radial:
+            magnitude = math.hypot(x, y)
+            if magnitude == 0.0:
+                return 0.0, 0.0
+            gain = self.shape(magnitude) / magnitude
+            x, y = x * gain, y * gain
+        else:
+            x = math.copysign(self.shape(abs(x)), x)
+            y = math.copysign(self.shape(abs(y)), y)
+        return min(max(x, -1.0), 1.0), min(max(y, -1.0), 1.0)
+
+    def trigger(self, value: float) -> float:
+        """Output (0...1) of a trigger position"""
+        return min(self.shape(max((value - self.center[0]) * self.scale[0], 0.0)), 1.0)
+
+
+_tables: dict[tuple, object] = {}
+
+
+class Profile:
+    """A named set of curves. Its lookup tables are compiled on first use and shared with other profiles."""
+
+    def __init__(self, name: str, settings: Optional[dict] = None):
+        settings = settings or {}
+        unknown = set(settings) - {'sticks', 'triggers', *STICKS, *TRIGGERS}
+        if unknown:
+            raise ValueError(f'Profile {name}: unknown sections {", ".join(sorted(unknown))}')
+        self.name = name
+        self.curves = {}
+        for action in STICKS:
+            self.curves[action] = Curve(action, **{**settings.get('sticks', {}), **settings.get(action, {})})
+        for action in TRIGGERS:
+            self.curves[action] = Curve(action, **{**settings.get('triggers', {}), **settings.get(action, {})})
+
+    def stick_table(self, action: str, steps: int, x_scale: int, y_scale: int) -> tuple[array, array]:
+        """
+        Output values of a stick, indexed by ix * (2 * steps + 1) + iy, where ix and iy are the input quantized to
+        0...2*steps. `x_scale` and `y_scale` are the signed maximum of the axes of the report.
+        """
+        curve = self.curves[action]
+        key = ('stick', curve.key, steps, x_scale, y_scale)
+        if key not in _tables:
+            inputs = [i / steps - 1.0 for i in range(2 * steps + 1)]
+            table_x = array('i')
+            table_y = array('i')
+            for x in inputs:
+                for y in inputs:
+                    out_x, out_y = curve.stick(x, y)
+                    table_x.append(round(out_x * x_scale))
+                    table_y.append(round(out_y * y_scale))
+            _tables[key] = table_x, table_y
+        return _tables[key]
+
+    def trigger_table(self, action: str, steps: int, maximum: int) -> array:
+        """Output values of a trigger, indexed by the input quantized to 0...steps"""
+        curve = self.curves[action]
+        key = ('trigger', curve.key, steps, maximum)
+        if key not in _tables:
+            _tables[key] = array('i', (round(curve.trigger(i / steps) * maximum) for i in range(steps + 1)))
+        return _tables[key]
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self.name}>'
+
+
+def load(path: str) -> dict[str, Profile]:
+    """The profiles of a profile file, by name"""
+    with open(path, 'rt') as f:
+        config = json.load(f)
+    return {name: Profile(name, settings) for name, settings in config.items()}
+
@@ -0,0 +1,93 @@
+import time
+
+
+class LoopStats:
+    """Running statistics of a LoopScheduler. All times are in nanoseconds."""
+    __slots__ = ('frames', 'missed', 'jitter_max', 'jitter_total')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.missed = 0
+        self.jitter_max = 0
+        self.jitter_total = 0
+
+    @property
+    def jitter_mean(self):
+        return self.jitter_total / self.frames if self.frames else 0.0
+
+    def to_dict(self):
+        return {'frames': self.frames,
+                'missed': self.missed,
+                'jitter_mean_us': self.jitter_mean / 1000,
+                'jitter_max_us': self.jitter_max / 1000}
+
+    def __repr__(self):
+        return (f'<{self.__class__.__qualname__} frames={self.frames} missed={self.missed} '
+                f'jitter_mean={self.jitter_mean / 1000:.1f}us jitter_max={self.jitter_max / 1000:.1f}us>')
+
+
+class LoopScheduler:
+    """
+    Pace a loop at a fixed rate using absolute monotonic deadlines.
+
+    Deadlines are advanced by a whole period every frame, so time spent in the loop body or oversleeping does not
+    accumulate as drift. When the loop falls more than one period behind, the missed deadlines are skipped instead of
+    bursting to catch up. The last `spin` seconds before a deadline are busy-waited, because sleep() on a loaded
+    system tends to wake up late.
+    """
+
+    def __init__(self, rate: float = 500, spin: float = 0.0003):
+        self.stats = LoopStats()
+        self.period = 0
+        self.rate = rate
+        self.spin = int(spin * 1e9)
+        self.deadline = None
+
+    @property
+    def rate(self) -> float:
+        return 1e9 / self.period
+
+    @rate.setter
+    def rate(self, rate: float):
+        if rate <= 0:
+            raise ValueError('Rate must be positive')
+        self.period = int(1e9 / rate)
+
+    def reset(self):
+        """Restart the schedule from the current time, e.g. after the loop was paused"""
+        self.deadline = None
+
+    def wait(self):
+        """Block until the next deadline. Call once per loop iteration."""
+        now = time.monotonic_ns()
+        if self.deadline is None:
+            self.deadline = now + self.period
+            return
+        deadline = self.deadline
+        if now > deadline:
+            # Overran the deadline - run this frame now for the latest deadline that passed, and skip the ones before
+            # it. Lateness within a period is jitter, only whole periods are missed frames.
+            late = now - deadline
+            missed = late // self.period
+            self.stats.missed += missed
+            self.deadline = deadline + (missed + 1) * self.period
+            self._record(late % self.period)
+            return
+
+        sleep = deadline - now - self.spin
+        if sleep > 0:
+            time.sleep(sleep / 1e9)
+        while (now := time.monotonic_ns()) < deadline:
+            pass
+        self._record(now - deadline)
+        self.deadline = deadline + self.period
+
+    def _record(self, jitter):
+        stats = self.stats
+        stats.frames += 1
+        stats.jitter_total += jitter
+        if jitter > stats.jitter_max:
+            stats.jitter_max = jitter
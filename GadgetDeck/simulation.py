@@ -0,0 +1,145 @@
+"""
+Stand-ins for Steam Input and the /dev/hidg* devices, to run the emulator without a Steam Deck.
+"""
+import os
+import sys
+import math
+import shutil
+import tempfile
+import threading
+from typing import Callable, Iterable, Optional
+
+try:
+    import controller_state
+except ImportError:
+    sys.path.append(os.path.dirname(__file__))
+    import controller_state
+
+
+class AnalogActionData:
+    __slots__ = ('eMode', 'x', 'y', 'bActive')
+
+    def __init__(self, x=0.0, y=0.0):
+        self.eMode = 0
+        self.x = x
+        self.y = y
+        self.bActive = True
+
+
+class DigitalActionData:
+    __slots__ = ('bState', 'bActive')
+
+    def __init__(self, state=False):
+        self.bState = state
+        self.bActive = True
+
+
+def default_script(frame: int, controller: int, analog: list, digital: list):
+    """Circle both sticks, pulse the triggers, move the mouse, scroll and walk a pressed button over all digital actions"""
+    phase = frame / 250 + controller
+    analog[0].x, analog[0].y = math.cos(phase), math.sin(phase)
+    analog[1].x, analog[1].y = math.sin(phase), math.cos(phase)
+    analog[2].x = (math.sin(phase) + 1) / 2
+    analog[3].x = (math.cos(phase) + 1) / 2
+    analog[4].x, analog[4].y = 3 * math.cos(phase), 3 * math.sin(phase)
+    analog[5].x, analog[5].y = 0.0, 2 * math.sin(phase)
+    pressed = (frame // 50) % len(digital)
+    for i, data in enumerate(digital):
+        data.bState = i == pressed
+
+
+class SimulatedInput:
+    """
+    Scripted replacement for the Steam Input interface of Steamworks.
+
+    On every RunFrame(), `script(frame, controller, analog, digital)` updates the action data of every controller.
+    The action data objects are reused between frames, unlike Steamworks which returns a new ctypes struct per call.
+    """
+
+    def __init__(self, controllers: int = 1, script: Callable = default_script):
+        self.script = script
+        self.frame = 0
+        self.action_set = 1
+        self.analog_actions = controller_state.ANALOG_ACTIONS
+        self.digital_actions = controller_state.DIGITAL_ACTIONS + controller_state.DIGITAL_MOUSE_ACTIONS
+        # Controller handles start at 1, like Steam Input where 0 is an invalid handle
+        self.controllers = tuple(range(1, controllers + 1))
+        self.analog = {c: [AnalogActionData() for _ in self.analog_actions] for c in self.controllers}
+        self.digital = {c: [DigitalActionData() for _ in self.digital_actions] for c in self.controllers}
+        self.active_sets = {}
+
+    def Init(self):
+        return True
+
+    def RunFrame(self):
+        self.frame += 1
+        for i, controller in enumerate(self.controllers):
+            self.script(self.frame, i, self.analog[controller], self.digital[controller])
+
+    def GetConnectedControllers(self):
+        return list(self.controllers)
+
+    def GetActionSetHandle(self, name):
+        return self.action_set
+
+    def ActivateActionSet(self, controller, action_set):
+        self.active_sets[controller] = action_set
+
+    def GetAnalogActionHandle(self, name):
+        return self.analog_actions.index(name) + 1
+
+    def GetDigitalActionHandle(self, name):
+        return self.digital_actions.index(name) + 1
+
+    def GetAnalogActionData(self, controller, handle):
+        return self.analog[controller][handle - 1]
+
+    def GetDigitalActionData(self, controller, handle):
+        return self.digital[controller][handle - 1]
+
+    def TriggerVibration(self, controller, left_speed, right_speed):
+        pass
+
+
+class FakeHIDSink:
+    """
+    Files or pipes that take the place of the /dev/hidg* devices.
+    With `fifo`, every device is a named pipe drained by a thread, so writes behave like a stream to a host.
+    """
+
+    def __init__(self, names: Iterable[str] = ('joystick0', 'mouse', 'keyboard'), fifo=False, directory: Optional[str] = None):
+        self.directory = directory or tempfile.mkdtemp(prefix='gadget-deck-')
+        self.fifo = fifo
+        self.devices = {}
+        self.received = {}
+        self.threads = []
+        for name in names:
+            path = os.path.join(self.directory, f'hidg-{name}')
+            if fifo:
+                os.mkfifo(path)
+                self.received[name] = 0
+                thread = threading.Thread(target=self._drain, args=(name, path), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            else:
+                open(path, 'wb').close()
+            self.devices[name] = path
+
+    def _drain(self, name, path):
+        with open(path, 'rb', buffering=0) as f:
+            while data := f.read(4096):
+                self.received[name] += len(data)
+
+    def bytes_written(self) -> dict[str, int]:
+        if self.fifo:
+            return dict(self.received)
+        return {name: os.path.getsize(path) for name, path in self.devices.items()}
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,54 @@
+"""
+Startup timing: the time of every startup stage, measured from the moment the process was started, so interpreter
+startup and imports are included. Run GadgetDeck with --startup-timing to print them, or with `python -X importtime`
+for the cost of every single import.
+"""
+import os
+import sys
+import time
+import threading
+
+
+def process_age() -> float:
+    """Seconds since this process was started"""
+    try:
+        with open('/proc/self/stat', 'rt') as f:
+            # The command name can contain spaces, the fields after it can not
+            fields = f.read().rsplit(')', 1)[1].split()
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError):
+        return time.process_time()
+
+
+class StartupTimer:
+    """Record named startup stages, from any thread"""
+
+    def __init__(self):
+        self.offset = process_age()
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.marks: list[tuple[str, float, str]] = []
+        self.mark('process start', -self.offset)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def mark(self, name: str, elapsed: float = None):
+        if elapsed is None:
+            elapsed = self.elapsed()
+        with self.lock:
+            self.marks.append((name, elapsed + self.offset, threading.current_thread().name))
+
+    def to_dict(self) -> dict:
+        """Milliseconds since process start of every stage"""
+        with self.lock:
+            return {name: round(at * 1e3, 1) for name, at, thread in self.marks}
+
+    def report(self, file=sys.stderr):
+        with self.lock:
+            marks = sorted(self.marks, key=lambda mark: mark[1])
+        previous = 0.0
+        for name, at, thread in marks:
+            print(f'{at * 1e3:>8.1f}ms  +{(at - previous) * 1e3:>7.1f}ms  {name:<24} [{thread}]', file=file)
+            previous = at
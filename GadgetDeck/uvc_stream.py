@@ -0,0 +1,741 @@
+#!/usr/bin/env python
+"""
+Stream video to the computer through the UVC function of the gadget ('gadget-deck-manager.py enable uvc'), so the
+Deck shows up as a webcam, without an HDMI capture card.
+
+Frames come from a source: a V4L2 capture device (like a v4l2loopback device fed with the screen by GStreamer or
+OBS), a file, or synthetic color bars. The host picks a format and frame size from those the manager configured,
+negotiated here through the probe and commit controls. YUYV frames pass through; for MJPEG, a source that delivers
+MJPEG passes through as well, RGB24 frames are encoded with Pillow.
+
+Frames go straight into the mmap'd buffers of the UVC device. The buffers form a bounded ring: a buffer is free, or
+queued until the host has read it. When the host falls behind and no buffer is free, the frame is dropped instead of
+holding up the source, so a frame is never older than the ring. The stream counts frames per second, drops and the
+latency from capture until the host has read the frame.
+
+To test without a gadget, the loopback sink stands in for the UVC device: a thread that reads the frames at USB
+bandwidth, and optionally writes them to a file:
+    python GadgetDeck/uvc_stream.py --sink loopback --source synthetic --format yuyv --size 640x400 --frames 600
+    python GadgetDeck/uvc_stream.py --source /dev/video10 --report-interval 10
+"""
+import os
+import sys
+import io
+import glob
+import json
+import time
+import errno
+import fcntl
+import mmap
+import select
+import signal
+import struct
+import argparse
+import threading
+import collections
+from typing import Callable, Optional
+
+try:
+    import v4l2
+    import latency
+    import gadget_status
+except ImportError:
+    sys.path.append(os.path.dirname(__file__))
+    import v4l2
+    import latency
+    import gadget_status
+
+# UVC gadget events (linux/usb/g_uvc.h)
+UVC_EVENT_CONNECT = v4l2.EVENT_PRIVATE_START
+UVC_EVENT_DISCONNECT = v4l2.EVENT_PRIVATE_START + 1
+UVC_EVENT_STREAMON = v4l2.EVENT_PRIVATE_START + 2
+UVC_EVENT_STREAMOFF = v4l2.EVENT_PRIVATE_START + 3
+UVC_EVENT_SETUP = v4l2.EVENT_PRIVATE_START + 4
+UVC_EVENT_DATA = v4l2.EVENT_PRIVATE_START + 5
+# struct usb_ctrlrequest, struct uvc_request_data
+SETUP = struct.Struct('<BBHHH')
+REQUEST_DATA = struct.Struct('=i60s')
+UVCIOC_SEND_RESPONSE = v4l2.ioc(v4l2.IOC_WRITE, 1, REQUEST_DATA.size, 'U')
+
+# Class-specific requests and the video streaming controls (UVC 1.1, sections A.8 and A.9.8)
+SET_CUR, GET_CUR, GET_MIN, GET_MAX, GET_RES, GET_LEN, GET_INFO, GET_DEF = 0x01, 0x81, 0x82, 0x83, 0x84, 0x85, 0x86, 0x87
+VS_PROBE_CONTROL, VS_COMMIT_CONTROL = 0x01, 0x02
+# struct uvc_streaming_control: bmHint, bFormatIndex, bFrameIndex, dwFrameInterval, wKeyFrameRate, wPFrameRate,
+# wCompQuality, wCompWindowSize, wDelay, dwMaxVideoFrameSize, dwMaxPayloadTransferSize, dwClockFrequency,
+# bmFramingInfo, bPreferedVersion, bMinVersion, bMaxVersion
+STREAMING_CONTROL = struct.Struct('<HBBIHHHHHIIIBBBB')
+
+FORMATS = {'yuyv': v4l2.PIX_FMT_YUYV, 'mjpeg': v4l2.PIX_FMT_MJPEG}
+# Color bars of the synthetic source
+BARS = ((235, 235, 235), (235, 235, 16), (16, 235, 235), (16, 235, 16), (235, 16, 235), (235, 16, 16), (16, 16, 235), (16, 16, 16))
+
+
+class Frame:
+    """A frame size of a format of the UVC function, as configured in configfs"""
+    __slots__ = ('format_index', 'frame_index', 'pixelformat', 'width', 'height', 'intervals', 'max_size')
+
+    def __init__(self, format_index: int, frame_index: int, pixelformat: int, width: int, height: int,
+                 intervals: list[int], max_size: int):
+        self.format_index = format_index
+        self.frame_index = frame_index
+        self.pixelformat = pixelformat
+        self.width = width
+        self.height = height
+        self.intervals = sorted(intervals)      # In 100ns units
+        self.max_size = max_size
+
+    def format(self) -> v4l2.Format:
+        return v4l2.Format(self.width, self.height, self.pixelformat, sizeimage=self.max_size)
+
+    def interval(self, requested: int) -> int:
+        """The supported interval closest to a requested one"""
+        return min(self.intervals, key=lambda interval: abs(interval - requested))
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self.format_index}.{self.frame_index} {self.width}x{self.height} {self.format().fourcc}>'
+
+
+def _read(path: str) -> str:
+    with open(path, 'rt') as f:
+        return f.read().strip()
+
+
+def read_frames(function: str) -> dict[tuple[int, int], Frame]:
+    """The frames of a UVC function in configfs, by format and frame index"""
+    frames = {}
+    for group, pixelformat in (('uncompressed', v4l2.PIX_FMT_YUYV), ('mjpeg', v4l2.PIX_FMT_MJPEG)):
+        for format_path in glob.glob(os.path.join(function, 'streaming', group, '*', '')):
+            format_index = int(_read(os.path.join(format_path, 'bFormatIndex')))
+            for frame_path in glob.glob(os.path.join(format_path, '*', '')):
+                frame = Frame(format_index, int(_read(os.path.join(frame_path, 'bFrameIndex'))), pixelformat,
+                              int(_read(os.path.join(frame_path, 'wWidth'))), int(_read(os.path.join(frame_path, 'wHeight'))),
+                              [int(interval) for interval in _read(os.path.join(frame_path, 'dwFrameInterval')).split()],
+                              int(_read(os.path.join(frame_path, 'dwMaxVideoFrameBufferSize'))))
+                frames[(frame.format_index, frame.frame_index)] = frame
+    return dict(sorted(frames.items()))
+
+
+def find_uvc(gadget_name: str = 'gadget-deck', timeout: float = 0) -> tuple[str, str, dict]:
+    """
+    The /dev/video* device, configfs path and status of the UVC function of the gadget. The device only exists while
+    the gadget is bound to the UDC, wait up to `timeout` seconds for it.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        for entry, function in gadget_status.snapshot(gadget_name).get('functions', {}).items():
+            if function['type'] == 'uvc' and function.get('device') is not None:
+                return function['device']['path'], os.path.join(gadget_status.CONFIGFS, gadget_name, 'functions', entry), function
+        if time.monotonic() >= deadline:
+            raise RuntimeError('No active UVC function, run gadget-deck-manager.py enable uvc')
+        time.sleep(0.1)
+
+
+class StreamStats:
+    """Frame counters, the frame rate the host reads, and the latency from capture until the host has read a frame"""
+
+    def __init__(self, window: float = 10.0):
+        self.window = int(window * 1e9)
+        self.frames = 0         # From the source
+        self.sent = 0           # Read by the host
+        self.dropped = 0        # No free buffer
+        self.errors = 0
+        self.bytes = 0
+        self.latency = latency.RollingHistogram(window)
+        self.recent: collections.deque[int] = collections.deque()
+
+    def record(self, size: int, stamp: int, now: int):
+        self.sent += 1
+        self.bytes += size
+        self.recent.append(now)
+        self._expire(now)
+        if stamp:
+            self.latency.record(now - stamp, now)
+
+    def _expire(self, now: int):
+        recent = self.recent
+        while recent and now - recent[0] > self.window:
+            recent.popleft()
+
+    def fps(self) -> float:
+        recent = self.recent
+        self._expire(time.monotonic_ns())
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) * 1e9 / (recent[-1] - recent[0])
+
+    def to_dict(self):
+        return {'fps': self.fps(), 'frames': self.frames, 'sent': self.sent, 'dropped': self.dropped,
+                'errors': self.errors, 'mb_sent': self.bytes / 2**20, 'latency': self.latency.to_dict()}
+
+
+class SyntheticSource:
+    """Moving color bars, in the format of the stream (YUYV), or RGB24 to encode into MJPEG"""
+
+    def __init__(self, fmt: v4l2.Format):
+        pixelformat = v4l2.PIX_FMT_RGB24 if fmt.pixelformat == v4l2.PIX_FMT_MJPEG else fmt.pixelformat
+        if pixelformat not in v4l2.BYTES_PER_PIXEL:
+            raise ValueError(f'The synthetic source can not generate {fmt.fourcc}')
+        self.format = v4l2.Format(fmt.width, fmt.height, pixelformat)
+        bar = max(2, fmt.width // len(BARS) // 2 * 2)
+        colors = [BARS[x // bar % len(BARS)] for x in range(2 * fmt.width)]
+        if pixelformat == v4l2.PIX_FMT_YUYV:
+            # BT.601, every pixel pair shares its chroma
+            row = bytearray()
+            for (r0, g0, b0), (r1, g1, b1) in zip(colors[0::2], colors[1::2]):
+                y0 = round(0.257 * r0 + 0.504 * g0 + 0.098 * b0 + 16)
+                y1 = round(0.257 * r1 + 0.504 * g1 + 0.098 * b1 + 16)
+                u = round(-0.148 * r0 - 0.291 * g0 + 0.439 * b0 + 128)
+                v = round(0.439 * r0 - 0.368 * g0 - 0.071 * b0 + 128)
+                row += bytes((y0, u, y1, v))
+        else:
+            row = bytearray(value for color in colors for value in color)
+        self.row = bytes(row)
+        self.buffer = bytearray(self.format.sizeimage)
+        self.memory = memoryview(self.buffer)
+        self.count = 0
+
+    def fileno(self) -> Optional[int]:
+        return None
+
+    def frame(self, now: int) -> tuple[memoryview, int, int]:
+        stride = self.format.bytesperline
+        shift = self.count * 4 % (self.format.width // 2 * 2) * v4l2.BYTES_PER_PIXEL[self.format.pixelformat]
+        self.memory[:] = self.row[shift:shift + stride] * self.format.height
+        self.count += 1
+        return self.memory, len(self.buffer), now
+
+    def release(self):
+        pass
+
+    def close(self):
+        self.memory.release()
+
+
+class FileSource:
+    """
+    Frames of a file, looped: an MJPEG file of concatenated JPEG images, or raw frames of the stream format (YUYV,
+    or RGB24 to encode into MJPEG). The file is mapped, and frames are served from the mapping without a copy.
+    """
+
+    def __init__(self, path: str, fmt: v4l2.Format):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.memory = memoryview(self.mmap)
+        self.frames = []
+        if self.mmap[:2] == b'\xff\xd8':
+            self.format = v4l2.Format(fmt.width, fmt.height, v4l2.PIX_FMT_MJPEG, sizeimage=fmt.sizeimage)
+            start = 0
+            while (end := self.mmap.find(b'\xff\xd9', start)) >= 0:
+                self.frames.append((start, end + 2))
+                start = self.mmap.find(b'\xff\xd8', end)
+                if start < 0:
+                    break
+        else:
+            pixelformat = v4l2.PIX_FMT_RGB24 if fmt.pixelformat == v4l2.PIX_FMT_MJPEG else fmt.pixelformat
+            self.format = v4l2.Format(fmt.width, fmt.height, pixelformat)
+            size = self.format.sizeimage
+            self.frames = [(start, start + size) for start in range(0, len(self.mmap) - size + 1, size)]
+        if not self.frames:
+            raise ValueError(f'{path} has no frames of {fmt.width}x{fmt.height}')
+        self.count = 0
+
+    def fileno(self) -> Optional[int]:
+        return None
+
+    def frame(self, now: int) -> tuple[memoryview, int, int]:
+        start, end = self.frames[self.count % len(self.frames)]
+        self.count += 1
+        return self.memory[start:end], end - start, now
+
+    def release(self):
+        pass
+
+    def close(self):
+        self.memory.release()
+        self.mmap.close()
+
+
+class CaptureSource:
+    """
+    Frames of a V4L2 capture device, dequeued from its mmap'd buffers and queued again once they were sent.
+    Only the newest frame is sent: frames that piled up in the meantime are given back to the driver at once.
+    """
+
+    def __init__(self, path: str, fmt: v4l2.Format, buffer_count: int = 4):
+        self.device = v4l2.Device(path, v4l2.BUF_TYPE_VIDEO_CAPTURE)
+        try:
+            # The format of the stream passes through, RGB24 is encoded into MJPEG
+            candidates = [fmt.pixelformat] + ([v4l2.PIX_FMT_RGB24] if fmt.pixelformat == v4l2.PIX_FMT_MJPEG else [])
+            for pixelformat in candidates:
+                self.format = self.device.set_format(v4l2.Format(fmt.width, fmt.height, pixelformat))
+                if self.format.pixelformat == pixelformat:
+                    break
+            else:
+                raise ValueError(f'{path} can not capture {fmt.fourcc}')
+            if self.format.pixelformat != v4l2.PIX_FMT_MJPEG and (self.format.width, self.format.height) != (fmt.width, fmt.height):
+                raise ValueError(f'{path} captures {self.format.width}x{self.format.height}, not {fmt.width}x{fmt.height}')
+            for buffer in self.device.map_buffers(buffer_count):
+                self.device.queue(buffer)
+            self.device.stream_on()
+        except BaseException:
+            self.device.close()
+            raise
+        self.current = None
+        self.stale = 0
+
+    def fileno(self) -> Optional[int]:
+        return self.device.fd
+
+    def frame(self, now: int) -> Optional[tuple[memoryview, int, int]]:
+        buffer = self.device.dequeue()
+        if buffer is None:
+            return None
+        while (newer := self.device.dequeue()) is not None:
+            self.device.queue(buffer)
+            self.stale += 1
+            buffer = newer
+        self.current = buffer
+        return buffer.memory, buffer.bytesused, buffer.stamp or now
+
+    def release(self):
+        if self.current is not None:
+            self.device.queue(self.current)
+            self.current = None
+
+    def close(self):
+        self.device.close()
+
+
+def open_source(spec: str, fmt: v4l2.Format, buffer_count: int = 4):
+    """A source by its command line name: 'synthetic', 'file:PATH', or the path of a capture device"""
+    if spec == 'synthetic':
+        return SyntheticSource(fmt)
+    if spec.startswith('file:'):
+        return FileSource(spec[len('file:'):], fmt)
+    return CaptureSource(spec, fmt, buffer_count)
+
+
+class _MemoryWriter(io.RawIOBase):
+    """A file that writes into a memoryview, for Pillow to encode into a buffer of the sink"""
+
+    def __init__(self, memory: memoryview):
+        self.memory = memory
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        size = len(data)
+        if self.position + size > len(self.memory):
+            raise OverflowError('The encoded frame does not fit into the buffer')
+        self.memory[self.position:self.position + size] = data
+        self.position += size
+        return size
+
+    def tell(self) -> int:
+        return self.position
+
+
+class JPEGEncoder:
+    """Encode RGB24 frames into MJPEG with Pillow, which is only needed when the source can not deliver MJPEG"""
+
+    def __init__(self, fmt: v4l2.Format, quality: int = 80):
+        try:
+            from PIL import Image
+        except ImportError:
+            raise RuntimeError('MJPEG from raw frames needs Pillow (pip install pillow), or a source that delivers MJPEG') from None
+        self.image = Image
+        self.size = (fmt.width, fmt.height)
+        self.quality = quality
+
+    def __call__(self, source: memoryview, size: int, destination: memoryview) -> int:
+        image = self.image.frombuffer('RGB', self.size, source[:size], 'raw', 'RGB', 0, 1)
+        writer = _MemoryWriter(destination)
+        image.save(writer, 'JPEG', quality=self.quality)
+        return writer.position
+
+
+def copy_frame(source: memoryview, size: int, destination: memoryview) -> int:
+    if size > len(destination):
+        raise OverflowError('The frame does not fit into the buffer')
+    destination[:size] = source[:size]
+    return size
+
+
+def converter(source: v4l2.Format, sink: v4l2.Format, quality: int = 80) -> Callable[[memoryview, int, memoryview], int]:
+    """How frames of a source get into the buffers of a sink: copied when the formats match, or encoded"""
+    if source.pixelformat == sink.pixelformat:
+        return copy_frame
+    if source.pixelformat == v4l2.PIX_FMT_RGB24 and sink.pixelformat == v4l2.PIX_FMT_MJPEG:
+        return JPEGEncoder(source, quality)
+    raise ValueError(f'Can not convert {source.fourcc} to {sink.fourcc}')
+
+
+class UVCSink:
+    """
+    The V4L2 output device of the UVC function: answers the probe and commit requests of the host, and takes the frames
+    while the host streams. The requests arrive as events, see handle_events().
+    """
+    poll_events = select.POLLOUT | select.POLLPRI
+
+    def __init__(self, path: str, frames: dict[tuple[int, int], Frame], streaming_interface: int = -1, max_packet: int = 3072):
+        if not frames:
+            raise ValueError('The UVC function has no formats')
+        self.device = v4l2.Device(path, v4l2.BUF_TYPE_VIDEO_OUTPUT)
+        for event in (UVC_EVENT_CONNECT, UVC_EVENT_DISCONNECT, UVC_EVENT_STREAMON, UVC_EVENT_STREAMOFF, UVC_EVENT_SETUP, UVC_EVENT_DATA):
+            self.device.subscribe(event)
+        self.frames = frames
+        self.streaming_interface = streaming_interface
+        self.max_packet = max_packet
+        first = next(iter(frames.values()))
+        self.probe = self.commit = (first, first.intervals[0])
+        self.pending = None             # Control of a SET_CUR request that waits for its data stage
+        self.active = False             # Between STREAMON and STREAMOFF
+        self.buffers: list[v4l2.Buffer] = []
+
+    def fileno(self) -> int:
+        return self.device.fd
+
+    def handle_events(self):
+        while (event := self.device.dequeue_event()) is not None:
+            kind, data = event
+            if kind == UVC_EVENT_SETUP:
+                self._setup(*SETUP.unpack_from(data))
+            elif kind == UVC_EVENT_DATA:
+                length, payload = REQUEST_DATA.unpack(data)
+                self._data(payload[:length])
+            elif kind == UVC_EVENT_STREAMON:
+                self.active = True
+            elif kind in (UVC_EVENT_STREAMOFF, UVC_EVENT_DISCONNECT):
+                self.active = False
+
+    def _control(self, frame: Frame, interval: int) -> bytes:
+        return STREAMING_CONTROL.pack(1, frame.format_index, frame.frame_index, interval, 0, 0, 0, 0, 0, frame.max_size,
+                                      self.max_packet, 48_000_000, 3, 1, 1, 1)
+
+    def _respond(self, response):
+        """Answer a setup request with data, with the length of the data stage to expect, or stall it with an error"""
+        if isinstance(response, int):
+            data = REQUEST_DATA.pack(response, b'')
+        else:
+            data = REQUEST_DATA.pack(len(response), response)
+        fcntl.ioctl(self.device.fd, UVCIOC_SEND_RESPONSE, bytearray(data))
+
+    def _setup(self, request_type: int, request: int, value: int, index: int, length: int):
+        response = -errno.EL2HLT
+        selector = value >> 8
+        # Class requests to the streaming interface; controls of the control interface (brightness, ...) are stalled
+        if (request_type & 0x7F == 0x21 and selector in (VS_PROBE_CONTROL, VS_COMMIT_CONTROL)
+                and self.streaming_interface in (-1, index & 0xFF)):
+            if request == SET_CUR:
+                self.pending = selector
+                response = min(length, STREAMING_CONTROL.size)
+            elif request == GET_CUR:
+                response = self._control(*(self.probe if selector == VS_PROBE_CONTROL else self.commit))
+            elif request in (GET_MIN, GET_DEF):
+                frame = next(iter(self.frames.values()))
+                response = self._control(frame, frame.intervals[0])
+            elif request == GET_MAX:
+                frame = list(self.frames.values())[-1]
+                response = self._control(frame, frame.intervals[-1])
+            elif request == GET_RES:
+                response = bytes(STREAMING_CONTROL.size)
+            elif request == GET_LEN:
+                response = STREAMING_CONTROL.size.to_bytes(2, 'little')
+            elif request == GET_INFO:
+                response = b'\x03'
+            if isinstance(response, bytes):
+                response = response[:length]
+        self._respond(response)
+
+    def _data(self, payload: bytes):
+        selector, self.pending = self.pending, None
+        if selector is None or len(payload) < 8:
+            return
+        hint, format_index, frame_index, interval = struct.unpack_from('<HBBI', payload)
+        frame = self.frames.get((format_index, frame_index))
+        if frame is None:
+            # Fall back to the first frame of the format, or the first frame overall
+            frame = next((f for f in self.frames.values() if f.format_index == format_index), next(iter(self.frames.values())))
+        negotiated = (frame, frame.interval(interval))
+        if selector == VS_PROBE_CONTROL:
+            self.probe = negotiated
+        else:
+            self.commit = negotiated
+
+    def start(self, buffer_count: int) -> tuple[v4l2.Format, int]:
+        """Set up the committed format, returns it and the frame interval in nanoseconds"""
+        frame, interval = self.commit
+        fmt = self.device.set_format(frame.format())
+        self.buffers = self.device.map_buffers(buffer_count)
+        # Poll reports an error until the queue streams, start it before the first frame
+        self.device.stream_on()
+        return fmt, interval * 100
+
+    def queue(self, buffer: v4l2.Buffer):
+        self.device.queue(buffer)
+
+    def dequeue(self) -> Optional[v4l2.Buffer]:
+        return self.device.dequeue()
+
+    def stop(self):
+        self.device.stream_off()
+        if self.buffers:
+            self.device.unmap_buffers()
+            self.buffers = []
+
+    def close(self):
+        self.device.close()
+
+
+class LoopbackSink:
+    """
+    Stands in for the UVC device to test without a gadget: a host that reads the queued frames at `bandwidth` bytes per
+    second (USB 2.0 isochronous transfers take about 24 MB/s), and appends them to `output`, if given.
+    """
+    poll_events = select.POLLIN
+
+    def __init__(self, fmt: v4l2.Format, bandwidth: float = 24e6, output: Optional[str] = None):
+        self.format = fmt
+        self.bandwidth = bandwidth
+        self.output = open(output, 'wb') if output else None
+        self.buffers: list[v4l2.Buffer] = []
+        self.queued = collections.deque()
+        self.done = collections.deque()
+        self.condition = threading.Condition()
+        self.wakeup = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        self.active = True
+        self.thread = None
+
+    def fileno(self) -> int:
+        return self.wakeup
+
+    def handle_events(self):
+        pass
+
+    def start(self, buffer_count: int):
+        self.buffers = [v4l2.Buffer(index, -1, self.format.sizeimage, 0, mmap.PROT_READ | mmap.PROT_WRITE)
+                        for index in range(buffer_count)]
+        self.thread = threading.Thread(target=self._read, name='loopback', daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        while True:
+            with self.condition:
+                while self.active and not self.queued:
+                    self.condition.wait()
+                if not self.active:
+                    return
+                buffer = self.queued.popleft()
+            time.sleep(buffer.bytesused / self.bandwidth)
+            if self.output is not None:
+                self.output.write(buffer.memory[:buffer.bytesused])
+            with self.condition:
+                self.done.append(buffer)
+                os.eventfd_write(self.wakeup, 1)
+
+    def queue(self, buffer: v4l2.Buffer):
+        with self.condition:
+            self.queued.append(buffer)
+            self.condition.notify()
+
+    def dequeue(self) -> Optional[v4l2.Buffer]:
+        with self.condition:
+            if not self.done:
+                return None
+            buffer = self.done.popleft()
+            if not self.done:
+                try:
+                    os.eventfd_read(self.wakeup)
+                except BlockingIOError:
+                    pass
+            return buffer
+
+    def stop(self):
+        with self.condition:
+            self.active = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        for buffer in self.buffers:
+            buffer.close()
+        self.buffers = []
+
+    def close(self):
+        os.close(self.wakeup)
+        if self.output is not None:
+            self.output.close()
+
+
+class Streamer:
+    """
+    Move frames from a source into the buffer ring of a sink, until the host stops the stream.
+
+    Sources with a file descriptor (capture devices) are sent when they have a frame, the others are paced at the
+    frame interval. A frame that finds no free buffer is dropped.
+    """
+
+    def __init__(self, sink, source, interval: int, stats: StreamStats, convert: Callable, stopped: threading.Event):
+        self.sink = sink
+        self.source = source
+        self.interval = interval
+        self.stats = stats
+        self.convert = convert
+        self.stopped = stopped
+        self.free = list(sink.buffers)
+
+    def reclaim(self):
+        """Take back the buffers the host has read"""
+        while (buffer := self.sink.dequeue()) is not None:
+            if buffer.bytesused:
+                self.stats.record(buffer.bytesused, buffer.stamp, time.monotonic_ns())
+            else:
+                self.stats.errors += 1
+            self.free.append(buffer)
+
+    def send(self, frame: Optional[tuple[memoryview, int, int]]):
+        if frame is None:
+            return
+        memory, size, stamp = frame
+        self.stats.frames += 1
+        self.reclaim()
+        if not self.free:
+            self.stats.dropped += 1
+        else:
+            buffer = self.free.pop()
+            try:
+                buffer.bytesused = self.convert(memory, size, buffer.memory)
+            except (ValueError, OverflowError, OSError) as e:
+                print(f'Frame {self.stats.frames}: {e}')
+                self.stats.errors += 1
+                self.free.append(buffer)
+            else:
+                buffer.stamp = stamp
+                self.sink.queue(buffer)
+        self.source.release()
+
+    def run(self, frames: Optional[int] = None):
+        sink = self.sink
+        source = self.source
+        poller = select.poll()
+        poller.register(sink.fileno(), sink.poll_events)
+        source_fd = source.fileno()
+        if source_fd is not None:
+            poller.register(source_fd, select.POLLIN)
+        due = time.monotonic_ns()
+        while not self.stopped.is_set() and sink.active and (frames is None or self.stats.frames < frames):
+            timeout = 500 if source_fd is not None else max(0, (due - time.monotonic_ns()) // 1_000_000)
+            ready = False
+            for fd, event in poller.poll(timeout):
+                if fd == source_fd:
+                    ready = True
+                elif event & select.POLLPRI:
+                    sink.handle_events()
+            now = time.monotonic_ns()
+            if source_fd is None and now >= due:
+                ready = True
+                # Pace at the frame interval, without catching up on frames missed while the system was busy
+                due = max(due + self.interval, now)
+            if ready:
+                self.send(source.frame(now))
+            else:
+                self.reclaim()
+
+
+def report(stats_provider: Callable[[], dict], interval: float, stopped: threading.Event):
+    while not stopped.wait(interval):
+        print(json.dumps(stats_provider()), flush=True)
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    width, _, height = text.partition('x')
+    return int(width), int(height)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser('uvc_stream')
+    parser.add_argument('--source', default='synthetic', help="'synthetic', 'file:PATH' or a capture device like /dev/video10 (default: %(default)s)")
+    parser.add_argument('--sink', default='uvc', help="'uvc' (the gadget), or 'loopback' or 'loopback:PATH' to test without one (default: %(default)s)")
+    parser.add_argument('--gadget', default='gadget-deck')
+    parser.add_argument('--wait', type=float, default=10, help='Seconds to wait for the gadget to be bound (default: %(default)s)')
+    parser.add_argument('--buffers', type=int, default=4, help='Frames in flight to the host, more frames are dropped (default: %(default)s)')
+    parser.add_argument('--quality', type=int, default=80, help='JPEG quality when encoding MJPEG (default: %(default)s)')
+    parser.add_argument('--format', choices=FORMATS, default='yuyv', help='Loopback: format of the stream (default: %(default)s)')
+    parser.add_argument('--size', type=parse_size, default=(640, 400), help='Loopback: frame size (default: 640x400)')
+    parser.add_argument('--fps', type=float, default=30, help='Loopback: frame rate (default: %(default)s)')
+    parser.add_argument('--bandwidth', type=float, default=24, help='Loopback: MB/s the host reads (default: %(default)s)')
+    parser.add_argument('--frames', type=int, help='Loopback: stop after this many frames')
+    parser.add_argument('--stats-socket', help='Serve statistics as JSON on this Unix socket')
+    parser.add_argument('--report-interval', type=float, help='Print the statistics every this many seconds')
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    stats = StreamStats()
+    stopped = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopped.set())
+    if args.stats_socket is not None:
+        latency.StatsServer(args.stats_socket, stats.to_dict).start()
+    if args.report_interval:
+        threading.Thread(target=report, args=(stats.to_dict, args.report_interval, stopped), daemon=True).start()
+
+    if args.sink.partition(':')[0] == 'loopback':
+        width, height = args.size
+        fmt = v4l2.Format(width, height, FORMATS[args.format])
+        sink = LoopbackSink(fmt, args.bandwidth * 1e6, args.sink.partition(':')[2] or None)
+        source = open_source(args.source, fmt, args.buffers)
+        try:
+            sink.start(args.buffers)
+            streamer = Streamer(sink, source, int(1e9 / args.fps), stats, converter(source.format, fmt, args.quality), stopped)
+            streamer.run(args.frames)
+            # Let the host read what is still queued
+            time.sleep(args.buffers * fmt.sizeimage / sink.bandwidth)
+            streamer.reclaim()
+        finally:
+            sink.stop()
+            sink.close()
+            source.close()
+        print(json.dumps(stats.to_dict(), indent=2))
+        return
+
+    device, function, status = find_uvc(args.gadget, args.wait)
+    sink = UVCSink(device, read_frames(function), status['streaming_interface'], status['streaming_maxpacket'])
+    poller = select.poll()
+    poller.register(sink.fileno(), select.POLLPRI)
+    try:
+        while not stopped.is_set():
+            if not sink.active:
+                if poller.poll(500):
+                    sink.handle_events()
+                continue
+            fmt, interval = sink.start(args.buffers)
+            print(f'Streaming {fmt} every {interval / 1e6:.1f}ms')
+            source = None
+            try:
+                source = open_source(args.source, fmt, args.buffers)
+                convert = converter(source.format, fmt, args.quality)
+            except (OSError, ValueError, RuntimeError) as e:
+                print(f'Can not stream {args.source}: {e}')
+                if source is not None:
+                    source.close()
+                sink.stop()
+                # Wait for the host to give up on this stream
+                while sink.active and not stopped.is_set():
+                    if poller.poll(500):
+                        sink.handle_events()
+                continue
+            try:
+                Streamer(sink, source, interval, stats, convert, stopped).run()
+            finally:
+                source.close()
+                sink.stop()
+            print(json.dumps(stats.to_dict()))
+    finally:
+        sink.close()
+
+
+if __name__ == '__main__':
+    main()
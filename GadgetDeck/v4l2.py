@@ -0,0 +1,190 @@
+"""
+The part of the V4L2 API that uvc_stream.py needs: formats, mmap'd buffer rings, streaming and events, through
+fcntl.ioctl() on the structures of linux/videodev2.h (64 bit layout), without any library.
+"""
+import os
+import mmap
+import errno
+import fcntl
+import struct
+from typing import Optional
+
+BUF_TYPE_VIDEO_CAPTURE = 1
+BUF_TYPE_VIDEO_OUTPUT = 2
+MEMORY_MMAP = 1
+FIELD_NONE = 1
+BUF_FLAG_ERROR = 0x40
+CAP_VIDEO_CAPTURE = 0x1
+CAP_VIDEO_OUTPUT = 0x2
+EVENT_PRIVATE_START = 0x08000000
+
+
+def fourcc(code: str) -> int:
+    return int.from_bytes(code.encode('ascii'), 'little')
+
+
+PIX_FMT_YUYV = fourcc('YUYV')
+PIX_FMT_MJPEG = fourcc('MJPG')
+PIX_FMT_RGB24 = fourcc('RGB3')
+BYTES_PER_PIXEL = {PIX_FMT_YUYV: 2, PIX_FMT_RGB24: 3}
+
+# struct v4l2_capability, v4l2_format (pix), v4l2_requestbuffers, v4l2_buffer, v4l2_event_subscription, v4l2_event
+CAPABILITY = struct.Struct('=16s32s32sIII12x')
+FORMAT = struct.Struct('=I4xIIIIIIII168x')
+REQUESTBUFFERS = struct.Struct('=IIIIB3x')
+BUFFER = struct.Struct('=IIIIi4xqqIIBBBB4sIIQIIi4x')
+EVENT_SUBSCRIPTION = struct.Struct('=III20x')
+EVENT = struct.Struct('=I4x64sIIqqI32x4x')
+
+
+def ioc(direction: int, nr: int, size: int, kind: str = 'V') -> int:
+    """The _IOC() macro of asm-generic/ioctl.h"""
+    return direction << 30 | size << 16 | ord(kind) << 8 | nr
+
+
+IOC_WRITE, IOC_READ = 1, 2
+VIDIOC_QUERYCAP = ioc(IOC_READ, 0, CAPABILITY.size)
+VIDIOC_G_FMT = ioc(IOC_READ | IOC_WRITE, 4, FORMAT.size)
+VIDIOC_S_FMT = ioc(IOC_READ | IOC_WRITE, 5, FORMAT.size)
+VIDIOC_REQBUFS = ioc(IOC_READ | IOC_WRITE, 8, REQUESTBUFFERS.size)
+VIDIOC_QUERYBUF = ioc(IOC_READ | IOC_WRITE, 9, BUFFER.size)
+VIDIOC_QBUF = ioc(IOC_READ | IOC_WRITE, 15, BUFFER.size)
+VIDIOC_DQBUF = ioc(IOC_READ | IOC_WRITE, 17, BUFFER.size)
+VIDIOC_STREAMON = ioc(IOC_WRITE, 18, 4)
+VIDIOC_STREAMOFF = ioc(IOC_WRITE, 19, 4)
+VIDIOC_DQEVENT = ioc(IOC_READ, 89, EVENT.size)
+VIDIOC_SUBSCRIBE_EVENT = ioc(IOC_WRITE, 90, EVENT_SUBSCRIPTION.size)
+
+
+class Format:
+    """A single planar pixel format"""
+    __slots__ = ('width', 'height', 'pixelformat', 'bytesperline', 'sizeimage')
+
+    def __init__(self, width: int, height: int, pixelformat: int, bytesperline: int = 0, sizeimage: int = 0):
+        self.width = width
+        self.height = height
+        self.pixelformat = pixelformat
+        self.bytesperline = bytesperline or width * BYTES_PER_PIXEL.get(pixelformat, 0)
+        self.sizeimage = sizeimage or width * height * BYTES_PER_PIXEL.get(pixelformat, 2)
+
+    @property
+    def fourcc(self) -> str:
+        return self.pixelformat.to_bytes(4, 'little').decode('ascii', 'replace')
+
+    def __repr__(self):
+        return f'<{self.__class__.__qualname__} {self.width}x{self.height} {self.fourcc} {self.sizeimage} bytes>'
+
+
+class Buffer:
+    """A driver buffer mapped into this process: `memory` is written or read in place. With fd -1, anonymous memory."""
+    __slots__ = ('index', 'mmap', 'memory', 'bytesused', 'stamp')
+
+    def __init__(self, index: int, fd: int, length: int, offset: int, prot: int):
+        self.index = index
+        self.mmap = mmap.mmap(fd, length, mmap.MAP_SHARED, prot, offset=offset)
+        self.memory = memoryview(self.mmap)
+        self.bytesused = 0
+        self.stamp = 0                  # Capture time of the frame in the buffer, time.monotonic_ns()
+
+    def close(self):
+        self.memory.release()
+        self.mmap.close()
+
+
+class Device:
+    """A V4L2 video device, opened non-blocking: dequeue() returns None while no buffer is done"""
+
+    def __init__(self, path: str, buffer_type: int):
+        self.path = path
+        self.buffer_type = buffer_type
+        self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+        self.buffers: list[Buffer] = []
+        self.streaming = False
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def _ioctl(self, request: int, data: bytes) -> bytes:
+        buffer = bytearray(data)
+        fcntl.ioctl(self.fd, request, buffer)
+        return bytes(buffer)
+
+    def capabilities(self) -> tuple[str, int]:
+        """Driver name and device capabilities"""
+        driver, card, bus, version, capabilities, device_caps = CAPABILITY.unpack(self._ioctl(VIDIOC_QUERYCAP, bytes(CAPABILITY.size)))
+        return driver.rstrip(b'\0').decode(), device_caps or capabilities
+
+    def get_format(self) -> Format:
+        values = FORMAT.unpack(self._ioctl(VIDIOC_G_FMT, FORMAT.pack(self.buffer_type, 0, 0, 0, 0, 0, 0, 0, 0)))
+        return Format(values[1], values[2], values[3], values[5], values[6])
+
+    def set_format(self, fmt: Format) -> Format:
+        """Set a format, returns the format the driver adjusted it to"""
+        values = FORMAT.unpack(self._ioctl(VIDIOC_S_FMT, FORMAT.pack(self.buffer_type, fmt.width, fmt.height, fmt.pixelformat,
+                                                                     FIELD_NONE, fmt.bytesperline, fmt.sizeimage, 0, 0)))
+        return Format(values[1], values[2], values[3], values[5], values[6])
+
+    def map_buffers(self, count: int) -> list[Buffer]:
+        """Allocate `count` driver buffers and map them, the driver may allocate a different number"""
+        count = REQUESTBUFFERS.unpack(self._ioctl(VIDIOC_REQBUFS, REQUESTBUFFERS.pack(count, self.buffer_type, MEMORY_MMAP, 0, 0)))[0]
+        prot = mmap.PROT_READ | (mmap.PROT_WRITE if self.buffer_type == BUF_TYPE_VIDEO_OUTPUT else 0)
+        for index in range(count):
+            values = BUFFER.unpack(self._ioctl(VIDIOC_QUERYBUF, self._buffer(index)))
+            self.buffers.append(Buffer(index, self.fd, length=values[17], offset=values[16], prot=prot))
+        return self.buffers
+
+    def unmap_buffers(self):
+        for buffer in self.buffers:
+            buffer.close()
+        self.buffers = []
+        self._ioctl(VIDIOC_REQBUFS, REQUESTBUFFERS.pack(0, self.buffer_type, MEMORY_MMAP, 0, 0))
+
+    def _buffer(self, index: int, bytesused: int = 0) -> bytes:
+        return BUFFER.pack(index, self.buffer_type, bytesused, 0, FIELD_NONE, 0, 0, 0, 0, 0, 0, 0, 0, b'', 0, MEMORY_MMAP, 0, 0, 0, 0)
+
+    def queue(self, buffer: Buffer):
+        """Hand a buffer to the driver: an output buffer with `bytesused` bytes of frame, or an empty capture buffer"""
+        self._ioctl(VIDIOC_QBUF, self._buffer(buffer.index, buffer.bytesused))
+
+    def dequeue(self) -> Optional[Buffer]:
+        """The next buffer the driver is done with, or None"""
+        try:
+            values = BUFFER.unpack(self._ioctl(VIDIOC_DQBUF, self._buffer(0)))
+        except BlockingIOError:
+            return None
+        buffer = self.buffers[values[0]]
+        buffer.bytesused = 0 if values[3] & BUF_FLAG_ERROR else values[2]
+        if self.buffer_type == BUF_TYPE_VIDEO_CAPTURE:
+            # Capture drivers stamp a frame with CLOCK_MONOTONIC, the clock of time.monotonic_ns()
+            buffer.stamp = values[5] * 1_000_000_000 + values[6] * 1000
+        return buffer
+
+    def stream_on(self):
+        fcntl.ioctl(self.fd, VIDIOC_STREAMON, struct.pack('=i', self.buffer_type))
+        self.streaming = True
+
+    def stream_off(self):
+        if self.streaming:
+            fcntl.ioctl(self.fd, VIDIOC_STREAMOFF, struct.pack('=i', self.buffer_type))
+            self.streaming = False
+
+    def subscribe(self, event_type: int):
+        self._ioctl(VIDIOC_SUBSCRIBE_EVENT, EVENT_SUBSCRIPTION.pack(event_type, 0, 0))
+
+    def dequeue_event(self) -> Optional[tuple[int, bytes]]:
+        """The type and the 64 data bytes of the next event, or None"""
+        try:
+            values = EVENT.unpack(self._ioctl(VIDIOC_DQEVENT, bytes(EVENT.size)))
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.EAGAIN):
+                return None
+            raise
+        return values[0], values[1]
+
+    def close(self):
+        try:
+            self.stream_off()
+            if self.buffers:
+                self.unmap_buffers()
+        finally:
+            os.close(self.fd)
@@ -1,14 +1,49 @@
 #!/usr/bin/env python
+import io
+import re
+import pwd
+import json
+import socket
 import argparse
 import glob
+import hashlib
 import subprocess
 import os
-from typing import Union
+import sys
+import threading
+import contextlib
+import socketserver
+from typing import Optional, Union
 
-import hid_parser
 import usb_gadget
+try:
+    import hid_layout
+    import gadget_status
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'GadgetDeck'))
+    import hid_layout
+    import gadget_status
 
 gadget = usb_gadget.USBGadget('gadget-deck')
+# Functions that `apply` manages, besides the joysticks
+APPLY_FUNCTIONS = {'mouse': 'hid.mouse', 'keyboard': 'hid.keyboard', 'composite': 'hid.composite', 'shell': 'acm.shell'}
+# Descriptor files of the keyboard variants of a function set, like 'keyboard:nkro' or 'composite:nkro'
+KEYBOARD_VARIANTS = {'boot': None, 'nkro': 'keyboard_nkro'}
+# Formats of the UVC function, in format index order: (configfs group, name, frame sizes). YUYV is the first, the
+# default a host is offered, as it streams without an encoder. MJPEG fits the full resolution at 60 fps into USB 2.0.
+UVC_FORMATS = (('uncompressed', 'yuyv', ((640, 400), (320, 200))),
+               ('mjpeg', 'mjpeg', ((1280, 800), (1280, 720), (640, 400))))
+UVC_FRAME_RATES = (60, 30, 15)
+UVC_MAX_PACKET = 3072       # 3 transactions of 1024 bytes per microframe, the most a high speed isochronous endpoint takes
+UVC_BANDWIDTH = UVC_MAX_PACKET * 8000   # Bytes per second at 8000 microframes per second
+# Network function: 'ncm' is CDC NCM, which packs several Ethernet frames into one USB transfer; 'ecm' is the simpler
+# CDC ECM, for hosts without an NCM driver. 'ncm' falls back to ECM on kernels without usb_f_ncm.
+NET_FUNCTIONS = {'ncm': 'ncm.usb0', 'ecm': 'ecm.usb0'}
+NET_QMULT = 10              # Request queue length multiplier at high speed, the kernel default of 5 limits bulk throughput
+NET_MTU = None              # Interface MTU, up to 15000 with NCM on kernels that have max_segment_size (Linux 6.4)
+NET_ADDRESS = '192.168.7.1/24'  # Address of the Deck, the other end takes another one of the network, like 192.168.7.2
+DAEMON_SOCKET = '/run/gadget-deck/manager.sock'
+status_cache = gadget_status.StatusCache('gadget-deck')
 
 
 def gadget_setup():
@@ -46,34 +81,293 @@ def gadget_destroy():
             os.rmdir(language.path)
         os.rmdir(config.path)
     for function in os.scandir(gadget['functions'].path):
+        if function.name.startswith('uvc.'):
+            remove_uvc_groups(function.path)
         os.rmdir(function.path)
     for language in os.scandir(gadget['strings'].path):
         os.rmdir(language.path)
     os.rmdir(gadget.path)
 
 
-def create_function_hid(name: str, report: Union[str, list[int]], protocol=0, subclass=0):
-    if isinstance(report, str):
-        with open(report, 'rt') as f:
-            descriptor = hid_parser.ReportDescriptor.from_str(f.read())
-    else:
-        descriptor = hid_parser.ReportDescriptor(report)
+def create_function_hid(name: str, report: Union[str, bytes, list[int]], protocol=0, subclass=0):
+    layout = hid_layout.load(report if isinstance(report, (str, bytes)) else bytes(report))
     hid = usb_gadget.HIDFunction(gadget, name)
     hid.protocol = str(protocol)
     hid.subclass = str(subclass)
-    hid.report_length = str(descriptor.get_input_report_size().byte)
-    hid.report_desc = bytes(descriptor.data)
+    hid.report_length = str(layout.report_length)
+    hid.report_desc = layout.descriptor
     gadget.link(hid, gadget['configs']['c.1'])
     return hid
 
+def create_function_uvc(name: str = 'video'):
+    """
+    UVC function with the formats of UVC_FORMATS. GadgetDeck/uvc_stream.py answers the format negotiation of the host
+    and sends the frames; it reads the formats back from configfs.
+    """
+    uvc = usb_gadget.USBFunction(gadget, f'uvc.{name}')
+    uvc.streaming_maxpacket = str(UVC_MAX_PACKET)
+    header = uvc['streaming']['header']['h']
+    for group, format_name, sizes in UVC_FORMATS:
+        video_format = uvc['streaming'][group][format_name]
+        for width, height in sizes:
+            frame = video_format[f'{width}x{height}']
+            frame_size = width * height * 2
+            # Uncompressed frames only get the rates that fit into the endpoint, a compressed frame is much smaller
+            rates = [rate for rate in UVC_FRAME_RATES if group != 'uncompressed' or frame_size * rate <= UVC_BANDWIDTH]
+            frame.wWidth = str(width)
+            frame.wHeight = str(height)
+            frame.dwMaxVideoFrameBufferSize = str(frame_size)
+            frame.dwMinBitRate = str(frame_size * 8 * min(rates))
+            frame.dwMaxBitRate = str(frame_size * 8 * max(rates))
+            # Frame intervals are in 100ns units
+            frame.dwFrameInterval = '\n'.join(str(10_000_000 // rate) for rate in rates)
+            frame.dwDefaultFrameInterval = str(10_000_000 // rates[0])
+        # The format index is the order of the header links
+        os.symlink(video_format.path, os.path.join(header.path, format_name))
+    for speed in ('fs', 'hs', 'ss'):
+        os.symlink(header.path, os.path.join(uvc['streaming']['class'][speed].path, 'h'))
+    control = uvc['control']['header']['h']
+    for speed in ('fs', 'ss'):
+        os.symlink(control.path, os.path.join(uvc['control']['class'][speed].path, 'h'))
+    gadget.link(uvc, gadget['configs']['c.1'])
+    return uvc
+
+
+def remove_uvc_groups(path: str):
+    """Remove the links and groups of a UVC function, in the reverse order of create_function_uvc()"""
+    for link in glob.glob(os.path.join(path, '*', 'class', '*', 'h')) + glob.glob(os.path.join(path, 'streaming', 'header', 'h', '*')):
+        if os.path.islink(link):
+            os.unlink(link)
+    for group in glob.glob(os.path.join(path, '*', 'header', 'h')) + glob.glob(os.path.join(path, 'streaming', '*', '*', '*x*')):
+        os.rmdir(group)
+    for group in glob.glob(os.path.join(path, 'streaming', 'uncompressed', '*')) + glob.glob(os.path.join(path, 'streaming', 'mjpeg', '*')):
+        os.rmdir(group)
+
+
 def remove_function(name):
     os.unlink(gadget['configs']['c.1'][name].path)
+    if name.startswith('uvc.'):
+        remove_uvc_groups(gadget['functions'][name].path)
     os.rmdir(gadget['functions'][name].path)
 
-def function_enable(function: str, activate=True):
+
+def mac_address(role: str) -> str:
+    """
+    Locally administered MAC address of the 'dev' or 'host' end, derived from the machine ID. The kernel picks random
+    ones every time, and the host would see a new network adapter (and forget its settings) on every connection.
+    """
+    try:
+        with open('/etc/machine-id', 'rt') as f:
+            machine_id = f.read().strip()
+    except OSError:
+        machine_id = socket.gethostname()
+    digest = hashlib.sha256(f'gadget-deck-{machine_id}-{role}'.encode()).digest()
+    return ':'.join(f'{b:02x}' for b in bytes([digest[0] & 0xfe | 0x02]) + digest[1:6])
+
+
+def ncm_available() -> bool:
+    """Whether the kernel has usb_f_ncm, as a module or built in. Only looks it up, nothing is loaded."""
+    try:
+        return subprocess.run(['modinfo', 'usb_f_ncm'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    except FileNotFoundError:
+        return True
+
+
+def create_function_net(name: str, qmult: int = NET_QMULT, mtu: Optional[int] = NET_MTU, address: Optional[str] = NET_ADDRESS):
+    """
+    NCM or ECM function; net_up() sets the MTU and `address` on its interface once the gadget is bound. Configfs can
+    not create an NCM function on a kernel without usb_f_ncm, then this falls back to ECM.
+    """
+    try:
+        function = usb_gadget.USBFunction(gadget, name)
+    except OSError:
+        if name != NET_FUNCTIONS['ncm']:
+            raise
+        print('NCM is not available, falling back to ECM')
+        function = usb_gadget.USBFunction(gadget, NET_FUNCTIONS['ecm'])
+    function.qmult = str(qmult)
+    function.dev_addr = mac_address('dev')
+    function.host_addr = mac_address('host')
+    if mtu and os.path.exists(os.path.join(function.path, 'max_segment_size')):
+        # The MTU plus the Ethernet header, tells the host how large the frames it sends may be
+        function.max_segment_size = str(mtu + 14)
+    gadget.link(function, gadget['configs']['c.1'])
+    return function
+
+
+def net_up(name: str, qmult: int = NET_QMULT, mtu: Optional[int] = NET_MTU, address: Optional[str] = NET_ADDRESS):
+    """
+    Bring the interface of a network function up, it only exists while the gadget is bound to the UDC.
+    Raises CalledProcessError when an ip command fails.
+    """
+    ifname = usb_gadget.USBFunction(gadget, name).ifname.strip()
+    if mtu:
+        subprocess.run(['ip', 'link', 'set', 'dev', ifname, 'mtu', str(mtu)], check=True)
+    subprocess.run(['ip', 'link', 'set', 'dev', ifname, 'up'], check=True)
+    if address:
+        subprocess.run(['ip', 'address', 'replace', address, 'dev', ifname], check=True)
+    print(f'{name}: {ifname} {address or "without address"}')
+
+
+def joystick_functions():
+    """Names of all joystick HID functions of the gadget, like 'hid.joystick0'"""
+    return sorted(f for f in os.listdir(gadget['functions'].path) if re.fullmatch(r'hid\.joystick\d*', f))
+
+
+def linked_functions() -> list[str]:
+    """Names of the functions linked into the gadget configuration, like 'hid.mouse'"""
+    return sorted(f.name for f in os.scandir(gadget['configs']['c.1'].path) if f.is_symlink())
+
+
+def parse_function_set(functions: str) -> dict[str, Optional[str]]:
+    """
+    Configfs names of a function set like 'joystick:2,mouse,keyboard:nkro', with their descriptor variant.
+    The number after 'joystick:' is the number of joystick functions, one per controller; 'keyboard:nkro' is the
+    N-key rollover keyboard. 'composite' is a single HID function with the joystick, mouse and keyboard reports.
+    'ncm' or 'ecm' is the network function; gadget_apply() fills in its variant with the interface settings.
+    """
+    names = {}
+    for function in filter(None, (f.strip() for f in functions.split(','))):
+        function, _, option = function.partition(':')
+        if function == 'none':
+            continue
+        if function == 'joystick':
+            names.update((f'hid.joystick{i}', None) for i in range(int(option or 1)))
+        elif function in ('keyboard', 'composite') and option in KEYBOARD_VARIANTS:
+            names[APPLY_FUNCTIONS[function]] = KEYBOARD_VARIANTS[option]
+        elif function in NET_FUNCTIONS and not option:
+            names[NET_FUNCTIONS[function]] = None
+        elif function in APPLY_FUNCTIONS and not option:
+            names[APPLY_FUNCTIONS[function]] = None
+        else:
+            raise ValueError(f'Function {function} can not be applied, use enable/disable instead')
+    return names
+
+
+def hid_descriptor(name: str, variant: Optional[str] = None) -> bytes:
+    """
+    Report descriptor of a HID function, like 'hid.joystick1' -> joystick.txt, wherever hid_layout.descriptor_path()
+    finds it. The composite function merges the joystick, mouse and keyboard descriptors (with the keyboard variant)
+    under report IDs.
+    """
+    kind = re.sub(r'\d+$', '', name[len('hid.'):])
+    if kind == 'composite':
+        return hid_layout.composite_descriptor({'joystick': 'joystick', 'mouse': 'mouse', 'keyboard': variant or 'keyboard'})
+    return hid_layout.load(variant or kind).descriptor
+
+
+def function_outdated(name: str, variant: Union[str, dict, None] = None) -> bool:
+    """
+    Whether a live function differs from how it would be created: a HID function in its report descriptor or
+    protocol, a network function in its queue length or segment size (the variant holds create_function_net() arguments).
+    """
+    path = os.path.join(gadget['functions'].path, name)
+    if name in NET_FUNCTIONS.values():
+        with open(os.path.join(path, 'qmult'), 'rt') as f:
+            if int(f.read()) != variant['qmult']:
+                return True
+        segment_size = os.path.join(path, 'max_segment_size')
+        if not variant['mtu'] or not os.path.exists(segment_size):
+            return False
+        with open(segment_size, 'rt') as f:
+            return int(f.read()) != variant['mtu'] + 14
+    if not name.startswith('hid.'):
+        return False
+    with open(os.path.join(path, 'report_desc'), 'rb') as f:
+        if f.read() != hid_descriptor(name, variant):
+            return True
+    with open(os.path.join(path, 'protocol'), 'rt') as f:
+        return int(f.read()) != hid_protocol(name[len('hid.'):], variant).get('protocol', 0)
+
+
+def hid_protocol(name: str, variant: Optional[str] = None) -> dict:
+    """
+    Interface protocol and subclass of a HID function: the keyboard is a boot keyboard, so a BIOS can use it.
+    The composite function can not be one, the boot protocol has no report IDs. Neither is the NKRO keyboard: f_hid
+    does not tell which protocol the host selected, so its reports could not be cut down to the 8 boot bytes.
+    """
+    return {'protocol': 1, 'subclass': 1} if name == 'keyboard' and variant is None else {}
+
+
+def function_create(name: str, variant: Union[str, dict, None] = None):
+    if name.startswith('hid.'):
+        if gadget['functions'].exists(name):
+            os.rmdir(gadget['functions'][name].path)
+        function = name[len('hid.'):]
+        create_function_hid(function, hid_descriptor(name, variant), **hid_protocol(function, variant))
+    elif name == 'acm.shell':
+        gadget.link(usb_gadget.USBFunction(gadget, name), gadget['configs']['c.1'])
+    elif name in NET_FUNCTIONS.values():
+        create_function_net(name, **variant)
+
+
+def function_remove(name: str):
+    if name == 'acm.shell':
+        function = usb_gadget.USBFunction(gadget, name)
+        subprocess.call(['systemctl', 'stop', f'getty@ttyGS{function.port_num}.service'])
+    remove_function(name)
+
+
+def gadget_apply(functions: str, activate=True, dry_run=False, keep=False, qmult=NET_QMULT, mtu=NET_MTU, address=NET_ADDRESS):
+    """
+    Make the gadget have exactly the given function set, in a single deactivate/activate cycle, so the host only
+    enumerates the gadget once. Only HID functions, the network and the shell are managed; mtp and uvc keep their own
+    services. With `keep`, only missing functions are created, the others stay as they are.
+    `qmult`, `mtu` and `address` are the settings of the network function.
+    """
+    desired = parse_function_set(functions)
+    for name in desired:
+        if name in NET_FUNCTIONS.values():
+            desired[name] = {'qmult': qmult, 'mtu': mtu, 'address': address}
+    live = [f for f in linked_functions() if f.startswith('hid.') or f in APPLY_FUNCTIONS.values() or f in NET_FUNCTIONS.values()]
+    if NET_FUNCTIONS['ncm'] in desired and NET_FUNCTIONS['ecm'] in live and not ncm_available():
+        # A live ECM function is the fallback of NCM on this kernel, creating NCM again would only fall back again
+        desired[NET_FUNCTIONS['ecm']] = desired.pop(NET_FUNCTIONS['ncm'])
+    remove = [f for f in live if f not in desired]
+    recreate = [f for f in desired if f in live and function_outdated(f, desired[f])]
+    create = [f for f in desired if f not in live]
+    if keep:
+        remove, recreate = [], []
+    for change, names in (('-', remove), ('~', recreate), ('+', create)):
+        for name in names:
+            print(f'{change} {name}')
+    if dry_run:
+        return
+
+    active = bool(gadget.UDC.strip())
+    if remove or recreate or create or not active:
+        gadget.deactivate()
+        for name in remove + recreate:
+            function_remove(name)
+        for name in recreate + create:
+            function_create(name, desired[name])
+        if activate and linked_functions():
+            gadget.activate()
+    chmod_hidg()
+    if 'acm.shell' in create + recreate and activate:
+        function = usb_gadget.USBFunction(gadget, 'acm.shell')
+        subprocess.call(['systemctl', 'start', f'getty@ttyGS{function.port_num}.service'])
+    if activate:
+        # The network function may have fallen back from NCM to ECM
+        settings = next((desired[name] for name in desired if name in NET_FUNCTIONS.values()), None)
+        for name in linked_functions():
+            if settings is not None and name in NET_FUNCTIONS.values():
+                net_up(name, **settings)
+
+
+def function_enable(function: str, activate=True, count=1, nkro=False, qmult=NET_QMULT, mtu=NET_MTU, address=NET_ADDRESS):
     gadget.deactivate()
-    if function in ('joystick', 'mouse', 'keyboard'):
-        function = create_function_hid(function, f'HID Descriptors/{function}.txt')
+    if function == 'joystick':
+        # One joystick function per controller: hid.joystick0, hid.joystick1, ...
+        for i in range(count):
+            if not gadget['functions'].exists(f'hid.joystick{i}'):
+                create_function_hid(f'joystick{i}', 'joystick')
+        if activate:
+            gadget.activate()
+        chmod_hidg()
+    if function in ('mouse', 'keyboard', 'composite'):
+        variant = KEYBOARD_VARIANTS['nkro'] if nkro and function in ('keyboard', 'composite') else None
+        function = create_function_hid(function, hid_descriptor(f'hid.{function}', variant), **hid_protocol(function, variant))
         if activate:
             gadget.activate()
         chmod_hidg()
@@ -90,31 +384,133 @@ def function_enable(function: str, activate=True):
         if activate:
             gadget.activate()
         subprocess.call(['systemctl', 'start', f'getty@ttyGS{function.port_num}.service'])
+    if function == 'uvc':
+        create_function_uvc()
+        if activate:
+            gadget.activate()
+    if function in NET_FUNCTIONS:
+        name = os.path.basename(create_function_net(NET_FUNCTIONS[function], qmult, mtu, address).path)
+        if activate:
+            gadget.activate()
+            net_up(name, qmult, mtu, address)
 
 
 def function_disable(function: str, activate=True):
     gadget.deactivate()
-    if function in ('joystick', 'mouse', 'keyboard'):
+    if function == 'joystick':
+        for name in joystick_functions():
+            remove_function(name)
+    if function in ('mouse', 'keyboard', 'composite'):
         remove_function(f'hid.{function}')
     if function == 'mtp':
         subprocess.call(['umount', '/dev/ffs-mtp'])
         os.rmdir('/dev/ffs-mtp')
         remove_function('ffs.mtp')
     if function == 'shell':
-        function = usb_gadget.USBFunction(gadget, 'acm.shell')
-        subprocess.call(['systemctl', 'start', f'getty@ttyGS{function.port_num}.service'])
-        remove_function('acm.shell')
-    linked_functions = [f for f in os.scandir(gadget['configs']['c.1'].path) if f.is_symlink()]
-    if activate and linked_functions:
+        function_remove('acm.shell')
+    if function == 'uvc':
+        remove_function('uvc.video')
+    if function in NET_FUNCTIONS:
+        # 'ncm' may have fallen back to ECM
+        for name in NET_FUNCTIONS.values():
+            if name in linked_functions():
+                remove_function(name)
+    if activate and linked_functions():
         gadget.activate()
         chmod_hidg()
 
+def gadget_print_status(compact=False) -> dict:
+    status = status_cache.get()
+    print(json.dumps(status, indent=None if compact else 2))
+    return status
+
+
 def chmod_hidg():
     for dev in glob.glob('/dev/hidg*'):
-        subprocess.call(['chmod', '0666', dev])
+        os.chmod(dev, 0o666)
 
 
-if __name__ == '__main__':
+class ManagerRequestHandler(socketserver.StreamRequestHandler):
+    """One JSON request per line: {"argv": ["enable", "mouse"]}, answered by one JSON response line"""
+
+    def handle(self):
+        creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, 12)
+        uid = int.from_bytes(creds[4:8], sys.byteorder)
+        for line in self.rfile:
+            if uid not in self.server.allowed_uids:
+                response = {'ok': False, 'error': f'User {uid} is not allowed to manage the gadget', 'output': ''}
+            else:
+                try:
+                    argv = json.loads(line)['argv']
+                except (ValueError, KeyError, TypeError):
+                    response = {'ok': False, 'error': 'Invalid request', 'output': ''}
+                else:
+                    response = self.server.execute(argv)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class ManagerDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serve the manager actions on a Unix socket, with the gadget kept in memory.
+    Requests take the same arguments as the command line and are executed one at a time.
+    """
+    daemon_threads = True
+
+    def __init__(self, path: str, allowed_uids):
+        self.lock = threading.Lock()
+        self.allowed_uids = set(allowed_uids)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, ManagerRequestHandler)
+        # Access is checked per connection with SO_PEERCRED
+        os.chmod(path, 0o666)
+
+    def execute(self, argv: list[str]) -> dict:
+        output = io.StringIO()
+        with self.lock, contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            try:
+                args = vars(build_parser().parse_args(argv))
+                action = args.pop('action')
+                if action is gadget_daemon:
+                    raise ValueError('Already running as daemon')
+                result = action(**args)
+                if action is not gadget_print_status:
+                    status_cache.invalidate()
+            except SystemExit as e:
+                # argparse exits on invalid arguments and --help
+                return {'ok': e.code in (0, None), 'error': None if e.code in (0, None) else 'Invalid arguments', 'output': output.getvalue()}
+            except Exception as e:
+                return {'ok': False, 'error': f'{e.__class__.__name__}: {e}', 'output': output.getvalue()}
+        try:
+            json.dumps(result)
+        except TypeError:
+            result = None
+        return {'ok': True, 'result': result, 'output': output.getvalue()}
+
+
+def gadget_daemon(socket_path: str, allow_user: list[str]):
+    allowed_uids = {0}
+    for user in allow_user:
+        try:
+            allowed_uids.add(pwd.getpwnam(user).pw_uid)
+        except KeyError:
+            print(f'Unknown user {user}')
+    with ManagerDaemon(socket_path, allowed_uids) as server:
+        print(f'Listening on {socket_path}')
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+def add_net_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--qmult', type=int, default=NET_QMULT, help='Network function: request queue length multiplier (default: %(default)s)')
+    parser.add_argument('--mtu', type=int, default=NET_MTU, help='Network function: interface MTU, above 1500 only with NCM')
+    parser.add_argument('--address', default=NET_ADDRESS, help="Network function: address of the Deck, or '' for none (default: %(default)s)")
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser('steam-gadget')
     action_parser = parser.add_subparsers(title='action', required=True)
 
@@ -130,6 +526,9 @@ if __name__ == '__main__':
     action_enable = action_parser.add_parser('enable')
     action_enable.add_argument('function')
     action_enable.add_argument('--no-activate', action='store_false', dest='activate')
+    action_enable.add_argument('--count', type=int, default=1, help='Number of joystick functions, one per controller')
+    action_enable.add_argument('--nkro', action='store_true', help='N-key rollover keyboard (or composite keyboard), not usable by a BIOS')
+    add_net_arguments(action_enable)
     action_enable.set_defaults(action=function_enable)
 
     action_disable = action_parser.add_parser('disable')
@@ -137,7 +536,27 @@ if __name__ == '__main__':
     action_disable.add_argument('--no-activate', action='store_false', dest='activate')
     action_disable.set_defaults(action=function_disable)
 
-    args = vars(parser.parse_args())
+    action_apply = action_parser.add_parser('apply', help='Set the exact function set, like joystick:2,mouse,keyboard:nkro')
+    action_apply.add_argument('functions', help="Comma-separated functions, or 'none'")
+    action_apply.add_argument('--no-activate', action='store_false', dest='activate')
+    action_apply.add_argument('--dry-run', action='store_true', help='Only print the changes')
+    action_apply.add_argument('--keep', action='store_true', help='Only create missing functions, never remove or recreate one')
+    add_net_arguments(action_apply)
+    action_apply.set_defaults(action=gadget_apply)
+
+    action_status = action_parser.add_parser('status', help='Print the functions, links, UDC and hidg devices as JSON')
+    action_status.add_argument('--compact', action='store_true', help='Print the JSON on one line')
+    action_status.set_defaults(action=gadget_print_status)
+
+    action_daemon = action_parser.add_parser('daemon', help='Serve the actions on a Unix socket, see GadgetDeck/gadget_client.py')
+    action_daemon.add_argument('--socket', dest='socket_path', default=DAEMON_SOCKET)
+    action_daemon.add_argument('--allow-user', action='append', default=['deck'], help='Users besides root that may connect (default: deck)')
+    action_daemon.set_defaults(action=gadget_daemon)
+    return parser
+
+
+if __name__ == '__main__':
+    args = vars(build_parser().parse_args())
     action = args.pop('action')
     action(**args)
 
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+
+import usb_gadget
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_manager(configfs: str):
+    """Import gadget-deck-manager.py with its gadget in `configfs` instead of /sys/kernel/config/usb_gadget"""
+    usb_gadget_class = usb_gadget.USBGadget
+    spec = importlib.util.spec_from_file_location('gadget_deck_manager', os.path.join(ROOT, 'gadget-deck-manager.py'))
+    manager = importlib.util.module_from_spec(spec)
+    with mock.patch.object(usb_gadget, 'USBGadget', lambda name: usb_gadget_class(name, configfs)):
+        spec.loader.exec_module(manager)
+    return manager
+
+
+class FunctionDisableTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.manager = load_manager(directory.name)
+        gadget = self.manager.gadget
+        with open(os.path.join(gadget.path, 'UDC'), 'wt') as f:
+            f.write('\n')
+        self.config = gadget['configs']['c.1']
+
+    def link(self, name: str):
+        function = usb_gadget.USBFunction(self.manager.gadget, name)
+        self.manager.gadget.link(function, self.config)
+
+    def test_disable_net(self):
+        for function, name in self.manager.NET_FUNCTIONS.items():
+            with self.subTest(function=function):
+                self.link(name)
+                self.manager.function_disable(function)
+                self.assertEqual(self.manager.linked_functions(), [])
+                self.assertFalse(self.manager.gadget['functions'].exists(name))
+
+    def test_disable_ncm_fallback(self):
+        # 'ncm' removes the ECM function it fell back to, and keeps the rest of the gadget
+        self.link('ecm.usb0')
+        self.link('hid.mouse')
+        with mock.patch.object(usb_gadget.USBGadget, 'activate') as activate, mock.patch.object(self.manager, 'chmod_hidg'):
+            self.manager.function_disable('ncm')
+        self.assertEqual(self.manager.linked_functions(), ['hid.mouse'])
+        activate.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+Throughput and latency of a network link, to compare the settings of the network function (NCM or ECM, --qmult,
+--mtu) between a Deck and a computer, or on a veth pair between two network namespaces as a stand-in:
+
+    util/netbench.py server                                  # On the Deck
+    util/netbench.py client 192.168.7.1                      # On the computer
+    sudo util/netbench.py veth --mtu 9000 --rate 400mbit     # Both ends on this machine, no gadget needed
+    util/netbench.py local                                   # Over loopback, to check the benchmark itself
+
+The bulk tests stream TCP for --duration seconds, to the server and then from it. The ping-pong test sends --size byte
+messages back and forth with TCP_NODELAY and reports the round trip times. The client prints the results as JSON.
+"""
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+import subprocess
+import socketserver
+
+PORT = 5207
+CHUNK = 256 * 1024
+# Test request: mode (b'B' bulk to the server, b'R' bulk from the server, b'P' ping-pong), message size, parameter
+# (duration in milliseconds of a reverse bulk test, number of round trips of a ping-pong test)
+HEADER = struct.Struct('!cIQ')
+COUNT = struct.Struct('!Q')
+
+
+def receive_exactly(sock: socket.socket, size: int, buffer: bytearray = None) -> bytes:
+    buffer = buffer if buffer is not None else bytearray(size)
+    view = memoryview(buffer)[:size]
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionError('Connection closed')
+        view = view[received:]
+    return bytes(buffer[:size])
+
+
+class BenchmarkHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            mode, size, parameter = HEADER.unpack(receive_exactly(sock, HEADER.size))
+        except ConnectionError:
+            # wait_for_port() of a client
+            return
+        if mode == b'B':
+            # Count until the client shuts its side down, then report what arrived
+            total = 0
+            buffer = bytearray(CHUNK)
+            while received := sock.recv_into(buffer):
+                total += received
+            sock.sendall(COUNT.pack(total))
+        elif mode == b'R':
+            data = bytes(CHUNK)
+            end = time.monotonic() + parameter / 1000
+            while time.monotonic() < end:
+                sock.sendall(data)
+        elif mode == b'P':
+            buffer = bytearray(size)
+            for _ in range(parameter):
+                receive_exactly(sock, size, buffer)
+                sock.sendall(buffer)
+
+
+class BenchmarkServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def connect(host: str, port: int, mode: bytes, size: int = 0, parameter: int = 0) -> socket.socket:
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(HEADER.pack(mode, size, parameter))
+    return sock
+
+
+def bulk(host: str, port: int, duration: float, reverse=False) -> dict:
+    """Throughput of one TCP stream, counted by the receiving end"""
+    start = time.monotonic()
+    if reverse:
+        total = 0
+        buffer = bytearray(CHUNK)
+        with connect(host, port, b'R', parameter=int(duration * 1000)) as sock:
+            while received := sock.recv_into(buffer):
+                total += received
+    else:
+        data = bytes(CHUNK)
+        end = start + duration
+        with connect(host, port, b'B') as sock:
+            while time.monotonic() < end:
+                sock.sendall(data)
+            sock.shutdown(socket.SHUT_WR)
+            total, = COUNT.unpack(receive_exactly(sock, COUNT.size))
+    seconds = time.monotonic() - start
+    return {'direction': 'from server' if reverse else 'to server', 'bytes': total, 'seconds': round(seconds, 3),
+            'mbit_per_s': round(total * 8 / seconds / 1e6, 1)}
+
+
+def percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def ping_pong(host: str, port: int, size: int, count: int) -> dict:
+    """Round trip times of small messages, in microseconds"""
+    message = bytes(size)
+    buffer = bytearray(size)
+    times = []
+    with connect(host, port, b'P', size, count) as sock:
+        for _ in range(count):
+            start = time.perf_counter_ns()
+            sock.sendall(message)
+            receive_exactly(sock, size, buffer)
+            times.append((time.perf_counter_ns() - start) / 1000)
+    times.sort()
+    return {'size': size, 'count': count, 'min_us': round(times[0], 1), 'p50_us': round(percentile(times, 0.5), 1),
+            'p99_us': round(percentile(times, 0.99), 1), 'max_us': round(times[-1], 1),
+            'mean_us': round(sum(times) / len(times), 1)}
+
+
+def run_client(host: str, port: int, duration: float, size: int, count: int) -> dict:
+    return {'host': host,
+            'bulk': [bulk(host, port, duration), bulk(host, port, duration, reverse=True)],
+            'ping_pong': ping_pong(host, port, size, count)}
+
+
+def wait_for_port(host: str, port: int, timeout=5.0):
+    end = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=timeout).close()
+            return
+        except OSError:
+            if time.monotonic() > end:
+                raise
+            time.sleep(0.05)
+
+
+def server(args):
+    with BenchmarkServer((args.bind, args.port), BenchmarkHandler) as benchmark_server:
+        print(f'Listening on {args.bind}:{args.port}', flush=True)
+        try:
+            benchmark_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def client(args):
+    wait_for_port(args.host, args.port)
+    print(json.dumps(run_client(args.host, args.port, args.duration, args.size, args.count), indent=2))
+
+
+def local(args):
+    with BenchmarkServer(('127.0.0.1', 0), BenchmarkHandler) as benchmark_server:
+        threading.Thread(target=benchmark_server.serve_forever, daemon=True).start()
+        results = run_client('127.0.0.1', benchmark_server.server_address[1], args.duration, args.size, args.count)
+        benchmark_server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+def veth(args):
+    """
+    The server and the client in two network namespaces, connected by a veth pair with the MTU and queue length of
+    the gadget interface. --rate and --delay shape both ends with netem, like the USB link would limit them.
+    """
+    namespaces = ('gadget-deck-a', 'gadget-deck-b')
+    addresses = ('10.207.0.1', '10.207.0.2')
+    ip = lambda *command: subprocess.run(['ip', *command], check=True)
+    try:
+        for namespace in namespaces:
+            ip('netns', 'add', namespace)
+        ip('link', 'add', 'veth-gda', 'netns', namespaces[0], 'type', 'veth', 'peer', 'veth-gdb', 'netns', namespaces[1])
+        for namespace, interface, address in zip(namespaces, ('veth-gda', 'veth-gdb'), addresses):
+            ip('-n', namespace, 'link', 'set', 'dev', interface, 'mtu', str(args.mtu), 'txqueuelen', str(args.txqueuelen), 'up')
+            ip('-n', namespace, 'address', 'add', f'{address}/24', 'dev', interface)
+            ip('-n', namespace, 'link', 'set', 'dev', 'lo', 'up')
+            if args.rate or args.delay:
+                netem = (['rate', args.rate] if args.rate else []) + (['delay', args.delay] if args.delay else [])
+                subprocess.run(['ip', 'netns', 'exec', namespace, 'tc', 'qdisc', 'add', 'dev', interface, 'root', 'netem', *netem], check=True)
+        server_process = subprocess.Popen(['ip', 'netns', 'exec', namespaces[0], sys.executable, __file__, 'server',
+                                           '--bind', addresses[0], '--port', str(args.port)], stdout=subprocess.DEVNULL)
+        try:
+            output = subprocess.run(['ip', 'netns', 'exec', namespaces[1], sys.executable, __file__, 'client', addresses[0],
+                                     '--port', str(args.port), '--duration', str(args.duration), '--size', str(args.size),
+                                     '--count', str(args.count)], check=True, capture_output=True, text=True).stdout
+        finally:
+            server_process.terminate()
+            server_process.wait()
+        results = json.loads(output)
+        results['link'] = {'mtu': args.mtu, 'txqueuelen': args.txqueuelen, 'rate': args.rate, 'delay': args.delay}
+        print(json.dumps(results, indent=2))
+    finally:
+        for namespace in namespaces:
+            subprocess.run(['ip', 'netns', 'delete', namespace], stderr=subprocess.DEVNULL)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser('netbench', description='TCP throughput and round trip times of a network link')
+    action_parser = parser.add_subparsers(title='action', required=True)
+
+    def test_arguments(action: argparse.ArgumentParser):
+        action.add_argument('--duration', type=float, default=5, help='Seconds of every bulk test (default: %(default)s)')
+        action.add_argument('--size', type=int, default=64, help='Message size of the ping-pong test (default: %(default)s)')
+        action.add_argument('--count', type=int, default=2000, help='Round trips of the ping-pong test (default: %(default)s)')
+
+    action_server = action_parser.add_parser('server')
+    action_server.add_argument('--bind', default='0.0.0.0')
+    action_server.add_argument('--port', type=int, default=PORT)
+    action_server.set_defaults(action=server)
+
+    action_client = action_parser.add_parser('client')
+    action_client.add_argument('host')
+    action_client.add_argument('--port', type=int, default=PORT)
+    test_arguments(action_client)
+    action_client.set_defaults(action=client)
+
+    action_local = action_parser.add_parser('local', help='Server and client in this process, over loopback')
+    test_arguments(action_local)
+    action_local.set_defaults(action=local)
+
+    action_veth = action_parser.add_parser('veth', help='Server and client in two network namespaces on a veth pair (root)')
+    action_veth.add_argument('--port', type=int, default=PORT)
+    action_veth.add_argument('--mtu', type=int, default=1500)
+    action_veth.add_argument('--txqueuelen', type=int, default=1000)
+    action_veth.add_argument('--rate', help="Limit both ends with netem, like '400mbit'")
+    action_veth.add_argument('--delay', help="Delay every packet with netem, like '250us'")
+    test_arguments(action_veth)
+    action_veth.set_defaults(action=veth)
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    args.action(args)